@@ -2,17 +2,35 @@
     Continuous Compliance App deploment script.
 """
 import argparse
-from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+import base64
+import compileall
+import hashlib
 import logging
 import os
+import py_compile
 import shutil
+import sys
 import boto3
 
 log = logging.getLogger()
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
 
+# The python version of the Lambda runtime. Byte-compiled files are only
+# used by the runtime when they are produced by the same python version.
+LAMBDA_PYTHON_VERSION = (3, 7)
 
-def deploy_app(deployment_zip: str, app_stack_name: str):
+# The directory the deployment zip is extracted to by the Lambda runtime
+LAMBDA_TASK_ROOT = "/var/task"
+
+# The timestamp and permissions of every entry in the deployment zip.
+# 1980-01-01 is the earliest date a zip file can hold.
+ZIP_ENTRY_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ZIP_ENTRY_PERMISSIONS = 0o100644
+
+
+def deploy_app(deployment_zip: str, app_stack_name: str, force: bool = False):
     def find_deployment_targets(app_stack_name: str):
         """
             Identifies all Lambda functions names that are exposed in the CloudFormation
@@ -32,28 +50,120 @@ def deploy_app(deployment_zip: str, app_stack_name: str):
 
         return lambda_function_names
 
+    def deploy_function(name: str):
+        """
+            Updates the code of a single function, unless it is already
+            running the deployment zip. Returns True if it was updated.
+        """
+        deployed_code_sha256 = lambda_client.get_function_configuration(
+            FunctionName=name)['CodeSha256']
+
+        if deployed_code_sha256 == deployment_zip_sha256 and not force:
+            log.info("%s is up to date (%s)" % (name, deployed_code_sha256))
+            return False
+
+        log.info("Deploying %s to %s" % (deployment_zip, name))
+        lambda_client.update_function_code(
+            FunctionName=name,
+            ZipFile=deployment_zip_contents,
+            Publish=True,
+        )
+        return True
+
     lambda_client = boto3.client('lambda')
 
     lambda_function_names = find_deployment_targets(app_stack_name)
 
-    with open(deployment_zip, "rb") as deployment_zip_file:
-        deployment_zip_contents = deployment_zip_file.read()
-
     if len(lambda_function_names) == 0:
         raise Exception(
             "No target lambda functions were found in the CloudFormation outputs")
 
-    for name in lambda_function_names:
-        log.info("Deploying %s to %s" % (deployment_zip, name) )
-        lambda_client.update_function_code(
-            FunctionName=name,
-            ZipFile=deployment_zip_contents,
-            Publish=True,
-        )
+    with open(deployment_zip, "rb") as deployment_zip_file:
+        deployment_zip_contents = deployment_zip_file.read()
+
+    deployment_zip_sha256 = code_sha256(deployment_zip_contents)
+    log.info("Deployment artifact hash: %s" % deployment_zip_sha256)
+
+    with ThreadPoolExecutor(max_workers=len(lambda_function_names)) as executor:
+        updated = list(executor.map(deploy_function, lambda_function_names))
+
+    log.info("Updated %d of %d function(s)" %
+             (updated.count(True), len(lambda_function_names)))
+
+
+def code_sha256(deployment_zip_contents: bytes):
+    """
+        Returns the hash of a deployment zip, in the format Lambda reports
+        it as the CodeSha256 of a function
+    """
+    return base64.b64encode(hashlib.sha256(deployment_zip_contents).digest()).decode()
+
+
+def generate_module_manifest(build_dir_name: str):
+    """
+        Writes the compliance module manifest to the build directory, so that
+        the Lambda functions can look up compliance modules without
+        importing all of them
+    """
+    sys.path.insert(0, build_dir_name)
+    try:
+        from compliance import registry
+    finally:
+        sys.path.remove(build_dir_name)
+
+    module_registry = registry.scan_module_registry(
+        os.path.join(build_dir_name, "compliance", "modules"))
+    manifest_file_name = os.path.join(
+        build_dir_name, "compliance", registry.MANIFEST_FILE_NAME)
+
+    log.info("Writing module manifest with %d module(s) to %s" %
+             (len(module_registry), manifest_file_name))
+    with open(manifest_file_name, "w") as manifest_file:
+        manifest_file.write(registry.render_module_manifest(module_registry))
+
+
+def prepare_build_directory(src_dir_name: str, build_dir_name: str):
+    """
+        Copies the python source files to the build directory, generates the
+        module manifest and byte-compiles everything, so that the Lambda
+        functions do not compile the sources on every cold start. Sources
+        are only compiled by an interpreter matching the Lambda runtime,
+        since the runtime ignores bytecode of other python versions.
+    """
+    shutil.copytree(src_dir_name, build_dir_name, ignore=shutil.ignore_patterns(
+        "__pycache__", "*.pyc"))
+
+    generate_module_manifest(build_dir_name)
+
+    # bytecode compiled by another python version would be dead weight in
+    # the zip, and would make its hash depend on the developer's interpreter
+    if sys.version_info[:2] != LAMBDA_PYTHON_VERSION:
+        log.warning("Packaging with python %d.%d, but the Lambda runtime is python %d.%d. "
+                    "The sources will not be byte-compiled; use a python %d.%d interpreter "
+                    "to package them with their bytecode.",
+                    sys.version_info[0], sys.version_info[1],
+                    LAMBDA_PYTHON_VERSION[0], LAMBDA_PYTHON_VERSION[1],
+                    LAMBDA_PYTHON_VERSION[0], LAMBDA_PYTHON_VERSION[1])
+        return
+
+    # the source timestamps are not preserved in the zip, so the compiled
+    # files are validated by hash instead, and the hash is not checked
+    # since the sources are read only. The compiled files refer to the
+    # sources by their path in the Lambda runtime, rather than in the
+    # build directory.
+    if not compileall.compile_dir(build_dir_name, ddir=LAMBDA_TASK_ROOT, quiet=1,
+                                  invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH):
+        raise Exception("The application could not be byte-compiled")
+
 
 def assemble_deployment_zip(src_dir_name: str, zipfile_name: str):
     """
-        Creates the deployment zip file by including all python source files
+        Creates the deployment zip file by including all python source files,
+        and their byte-compiled counterparts when they were compiled.
+
+        The zip only depends on the content of the files: entries are written
+        in sorted order, with fixed timestamps and permissions, so that an
+        unchanged application produces the same zip, and the same CodeSha256.
     """
     def collect_artifact_names(src_dir_name: str):
         file_paths = []
@@ -64,20 +174,31 @@ def assemble_deployment_zip(src_dir_name: str, zipfile_name: str):
                 file_paths.append(filepath)
         return file_paths
 
-    allowed_file_extentions = ['.py']
+    allowed_file_extentions = ['.py', '.pyc']
     artifact_list = collect_artifact_names(src_dir_name)
 
-    with ZipFile(zipfile_name, 'w') as zip:
+    archive_entries = []
+    for artifact in artifact_list:
+        ext = os.path.splitext(artifact)[1]
+
+        if ext in allowed_file_extentions:
+            archive_name = os.path.relpath(
+                artifact, src_dir_name).replace(os.sep, "/")
+            archive_entries.append((archive_name, artifact))
+        else:
+            log.info("Skipping %s" % artifact)
+
+    with ZipFile(zipfile_name, 'w', ZIP_DEFLATED) as zip:
         # writing each file one by one
-        for artifact in artifact_list:
-            ext = os.path.splitext(artifact)[1]
+        for (archive_name, artifact) in sorted(archive_entries):
+            log.info("Adding %s to %s" % (artifact, zipfile_name))
 
-            if ext in allowed_file_extentions:
-                log.info("Adding %s to %s" % (artifact, zipfile_name))
-                archive_name = artifact.replace(src_dir_name, "")
-                zip.write(artifact, archive_name)
-            else:
-                log.info("Skipping %s" % artifact)
+            zip_info = ZipInfo(archive_name, date_time=ZIP_ENTRY_DATE_TIME)
+            zip_info.compress_type = ZIP_DEFLATED
+            zip_info.external_attr = ZIP_ENTRY_PERMISSIONS << 16
+
+            with open(artifact, "rb") as artifact_file:
+                zip.writestr(zip_info, artifact_file.read())
 
 
 def main():
@@ -86,6 +207,7 @@ def main():
     """
 
     deploy_dir = "./deploy"
+    build_dir = "%s/build" % deploy_dir
     deploy_archive = "%s/cc-app.zip" % deploy_dir
 
     description = """
@@ -96,6 +218,8 @@ def main():
 
     parser.add_argument("-cf_stack_name", help="Continuous Compliance App CloudFormation stack name",
                         type=str, required=True)
+    parser.add_argument("-force", help="Update every function, even when its code is unchanged",
+                        action="store_true")
 
     args = parser.parse_args()
 
@@ -103,18 +227,21 @@ def main():
 
         log.info("Deployment artifact name: %s" % deploy_archive)
         log.info("Cleaning Deployment Directory")
-        shutil.rmtree(deploy_dir)
+        shutil.rmtree(deploy_dir, ignore_errors=True)
 
         log.info("Creating Deployment Directory")
         os.mkdir(deploy_dir, 0o777)
 
         log.info(args.cf_stack_name)
 
+        log.info("Preparing Build Directory")
+        prepare_build_directory('./src', build_dir)
+
         log.info("Generating Deployment Artifact")
-        assemble_deployment_zip('./src', deploy_archive)
+        assemble_deployment_zip(build_dir, deploy_archive)
 
         log.info("Deploying App")
-        deploy_app(deploy_archive, args.cf_stack_name)
+        deploy_app(deploy_archive, args.cf_stack_name, args.force)
 
         log.info("Done!")
     except Exception as e:
@@ -1,13 +1,228 @@
 """Author: Mark Hanegraaff -- 2021
 """
 
-import boto3
 from support.logging_definition import logging
 from exception.exceptions import AWSError
+from support.metrics import METRICS
+import aws_connector.rate_limiter as rate_limiter
+from datetime import datetime, timedelta, timezone
+import threading
 import uuid
 
 log = logging.getLogger()
 
+# The size of the HTTP connection pool of each boto client. It must be at
+# least as large as the number of concurrent calls issued through a single
+# client by the scanners and publishers, otherwise connections are
+# discarded and re-opened.
+MAX_POOL_CONNECTIONS = 10
+
+
+class CredentialCache():
+    '''
+        A process wide cache of assume-role credentials keyed by role arn.
+        Because it lives at module scope, it survives warm Lambda invocations,
+        and credentials are reused until they are about to expire.
+
+        Attributes:
+            REFRESH_WINDOW_SECONDS: Credentials expiring within this many
+                seconds are refreshed ahead of time rather than reused.
+            hits: The number of requests served from the cache
+            misses: The number of requests that required an assume-role
+    '''
+
+    REFRESH_WINDOW_SECONDS = 300
+
+    def __init__(self):
+        self.credentials = {}
+        self.role_locks = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_credentials(self, assume_role_arn: str):
+        '''
+            Returns the credentials dictionary for the supplied role, as
+            returned by sts:AssumeRole, assuming the role only if no fresh
+            credentials are cached.
+        '''
+        # each role has its own lock so that concurrent requests for the
+        # same role result in a single assume-role call
+        with self.lock:
+            role_lock = self.role_locks.setdefault(
+                assume_role_arn, threading.Lock())
+
+        with role_lock:
+            credentials = self.credentials.get(assume_role_arn, None)
+
+            if credentials is not None and not self.expiring(credentials):
+                with self.lock:
+                    self.hits += 1
+                return credentials
+
+            with self.lock:
+                self.misses += 1
+
+            sts_client = CLIENT_POOL.get_client(None, None, 'sts', None)
+            assumed_role_response = rate_limiter.call(
+                sts_client, "sts", "AssumeRole",
+                RoleArn=assume_role_arn,
+                RoleSessionName=str(uuid.uuid4())
+            )
+
+            credentials = assumed_role_response['Credentials']
+            self.credentials[assume_role_arn] = credentials
+
+            return credentials
+
+    def expiring(self, credentials: dict):
+        '''
+            Returns True if the credentials will expire within the refresh window
+        '''
+        refresh_time = datetime.now(timezone.utc) + \
+            timedelta(seconds=self.REFRESH_WINDOW_SECONDS)
+
+        return credentials['Expiration'] <= refresh_time
+
+    def clear(self):
+        '''
+            Removes all cached credentials and resets the counters
+        '''
+        with self.lock:
+            self.credentials = {}
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''
+            Returns the cache hit and miss counters as a dictionary
+        '''
+        return {
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class ClientPool():
+    '''
+        A process wide pool of boto sessions and clients. Because it lives at
+        module scope, warm Lambda invocations reuse clients along with their
+        keep-alive HTTP connections.
+
+        Sessions are keyed by assume role arn (None for the default
+        credentials) and clients by (assume role arn, service name, region
+        name). Each entry also records the access key it was built with, so
+        that entries are replaced once credentials are refreshed.
+    '''
+
+    def __init__(self):
+        self.sessions = {}
+        self.clients = {}
+        # boto sessions are not thread safe, so all sessions and clients
+        # are created while holding this lock
+        self.lock = threading.Lock()
+
+    def get_session(self, assume_role_arn: str, credentials: dict):
+        '''
+            Returns a boto session for the supplied role and credentials,
+            creating it only if the pool does not contain one built with
+            the same credentials.
+        '''
+        identity = self.credentials_identity(credentials)
+
+        with self.lock:
+            (pooled_identity, session) = self.sessions.get(
+                assume_role_arn, (None, None))
+
+            if session is None or pooled_identity != identity:
+                # boto3 is imported on first use, since importing it
+                # dominates the cold start time of the Lambda functions
+                import boto3
+
+                if credentials is None:
+                    session = boto3.Session()
+                else:
+                    session = boto3.Session(
+                        aws_access_key_id=credentials['AccessKeyId'],
+                        aws_secret_access_key=credentials['SecretAccessKey'],
+                        aws_session_token=credentials['SessionToken']
+                    )
+                self.sessions[assume_role_arn] = (identity, session)
+
+            return session
+
+    def get_client(self, assume_role_arn: str, credentials: dict, service_name: str, region_name: str):
+        '''
+            Returns a boto client for the supplied role, service and region,
+            creating it only if the pool does not contain one built with
+            the same credentials.
+        '''
+        identity = self.credentials_identity(credentials)
+        session = self.get_session(assume_role_arn, credentials)
+        client_key = (assume_role_arn, service_name, region_name)
+
+        with self.lock:
+            (pooled_identity, client) = self.clients.get(
+                client_key, (None, None))
+
+            if client is None or pooled_identity != identity:
+                from botocore.config import Config
+
+                # botocore makes a single attempt per call, since the
+                # rate limiters own retries and backoff
+                with METRICS.span("create_client"):
+                    client = session.client(
+                        service_name,
+                        region_name=region_name,
+                        config=Config(
+                            max_pool_connections=MAX_POOL_CONNECTIONS,
+                            retries={'mode': 'standard', 'total_max_attempts': 1})
+                    )
+
+                # calls made through the client share the rate
+                # limiters of the account it belongs to
+                rate_limiter.register_client(
+                    client, self.account_id(assume_role_arn))
+                self.clients[client_key] = (identity, client)
+
+            return client
+
+    def account_id(self, assume_role_arn: str):
+        '''
+            Returns the account id of an assume role arn, e.g.
+            "arn:aws:iam::999999999999:role/role-name" -> "999999999999",
+            or DEFAULT_ACCOUNT for the default credentials
+        '''
+        if assume_role_arn is None:
+            return rate_limiter.DEFAULT_ACCOUNT
+
+        arn_parts = assume_role_arn.split(":")
+        if len(arn_parts) < 5:
+            return assume_role_arn
+        return arn_parts[4]
+
+    def credentials_identity(self, credentials: dict):
+        '''
+            Returns the value identifying a set of credentials
+        '''
+        if credentials is None:
+            return None
+        return credentials['AccessKeyId']
+
+    def clear(self):
+        '''
+            Removes all pooled sessions and clients
+        '''
+        with self.lock:
+            self.sessions = {}
+            self.clients = {}
+
+
+# The credential cache and client pool shared by all AWSClient objects
+# in this process
+CREDENTIAL_CACHE = CredentialCache()
+CLIENT_POOL = ClientPool()
+
 
 class AWSClient():
     '''
@@ -25,7 +240,9 @@ class AWSClient():
     def __init__(self, assume_role_arn: str = None):
         '''
             Initalizes the boto3 session and optionally assume role
-            if an assume role arn is supplied.
+            if an assume role arn is supplied. Assume-role credentials are
+            served from the process wide credential cache, and sessions from
+            the process wide client pool, when possible.
 
             Parameters
             ----------
@@ -34,28 +251,77 @@ class AWSClient():
                 assume-role operation will take place
 
         '''
+        self.assume_role_arn = assume_role_arn
+
         try:
             if assume_role_arn == None:
-                self.session = boto3.Session()
+                self.credentials = None
             else:
-                sts_client = boto3.client('sts')
-                assumed_role_response = sts_client.assume_role(
-                    RoleArn=assume_role_arn,
-                    RoleSessionName=str(uuid.uuid4())
-                )
-
-                credentials = assumed_role_response['Credentials']
-
-                self.session = boto3.Session(
-                    aws_access_key_id=credentials['AccessKeyId'],
-                    aws_secret_access_key=credentials['SecretAccessKey'],
-                    aws_session_token=credentials['SessionToken']
-                )
+                self.credentials = CREDENTIAL_CACHE.get_credentials(
+                    assume_role_arn)
+
+            self.session = CLIENT_POOL.get_session(
+                assume_role_arn, self.credentials)
         except Exception as e:
             raise AWSError("Could not initialize AWSClient object", e)
 
         # store the current region name faciliate some SDK calls
         self.update_region_name(self.session.region_name)
 
-    def get_boto_client(self, service_name: str):
-        return self.session.client(service_name)
+    def get_boto_client(self, service_name: str, region_name: str = None):
+        '''
+            Returns a boto client for the supplied service. Clients are
+            pooled at process scope and reused across AWSClient objects
+            sharing the same credentials.
+
+            Parameters
+            ----------
+            service_name: str
+                The boto service name, e.g. "s3"
+            region_name: str
+                Optional region name. If one is not provided the session's
+                region is used.
+        '''
+        if region_name is None:
+            region_name = self.session.region_name
+
+        return CLIENT_POOL.get_client(
+            self.assume_role_arn, self.credentials, service_name, region_name)
+
+
+class LazyAWSClient():
+    '''
+        A stand-in for AWSClient that defers its creation, and therefore any
+        assume-role operation, until the first boto client is requested.
+        Modules that can complete their work without calling AWS will never
+        incur the cost of initializing a session.
+    '''
+
+    def __init__(self, assume_role_arn: str = None):
+        '''
+            Parameters
+            ----------
+            assume_role_arn: str
+                Optional assume role arn, supplied to the AWSClient
+                once it is created.
+        '''
+        self.assume_role_arn = assume_role_arn
+        self.aws_client = None
+        self.lock = threading.Lock()
+
+    def get_aws_client(self):
+        '''
+            Returns the underlying AWSClient, creating it on first use
+        '''
+        with self.lock:
+            if self.aws_client is None:
+                self.aws_client = AWSClient(self.assume_role_arn)
+
+            return self.aws_client
+
+    def get_boto_client(self, service_name: str, region_name: str = None):
+        '''
+            Returns a boto client for the supplied service.
+            See AWSClient.get_boto_client
+        '''
+        return self.get_aws_client().get_boto_client(service_name, region_name)
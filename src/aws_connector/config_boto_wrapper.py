@@ -0,0 +1,232 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+
+import datetime
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from exception.exceptions import AWSError
+import aws_connector.rate_limiter as rate_limiter
+from support.concurrency import chunked
+
+# The maximum number of evaluations accepted by a single put_evaluations call
+MAX_EVALUATIONS_PER_CALL = 100
+
+# The maximum number of results returned by a single select_resource_config call
+MAX_QUERY_RESULTS_PER_PAGE = 100
+
+# The default number of put_evaluations calls that may be in-flight at once
+PUBLISH_CONCURRENCY = 4
+
+# The number of times evaluations rejected in 'FailedEvaluations'
+# are submitted before giving up on them
+MAX_PUBLISH_ATTEMPTS = 5
+
+
+def chunk_evaluations(evaluations: object, batch_size: int = MAX_EVALUATIONS_PER_CALL):
+    '''
+        Consumes an iterable of evaluations and returns them as batches no
+        larger than 'batch_size'. E.g.
+
+        [eval1, eval2 ... eval100], [eval101, ...]
+    '''
+    return chunked(evaluations, batch_size)
+
+
+def put_evaluations(boto_config_client: object, evaluations: object, result_token: str,
+                    ordering_timestamp: str = None, max_workers: int = PUBLISH_CONCURRENCY,
+                    on_published: object = None):
+    '''
+        Publishes compliance.evaluation.Evaluation records to the Config
+        service and returns the number of evaluations published. Evaluations
+        may be supplied as any iterable, including a generator, and are
+        consumed as they are published. They are split into batches sized
+        for the service, and at most 'max_workers' batches are published
+        concurrently.
+
+        Each batch is converted to the Config format just before it is sent,
+        using 'ordering_timestamp' for evaluations without a timestamp
+        of their own.
+
+        Calls are issued through the account's rate limiter, which retries
+        throttled batches, and evaluations returned in 'FailedEvaluations'
+        are resubmitted up to MAX_PUBLISH_ATTEMPTS times. An AWSError is
+        raised if any batch could not be published, once all other batches
+        have been published.
+
+        If an 'on_published' function is supplied, it is called with each
+        batch once it has been published, possibly from a worker thread.
+    '''
+    def publish_batch(batch: list):
+        config_evaluations = [evaluation.to_config(ordering_timestamp)
+                              for evaluation in batch]
+        attempt = 0
+
+        while True:
+            try:
+                response = rate_limiter.call(
+                    boto_config_client, "config", "PutEvaluations",
+                    Evaluations=config_evaluations,
+                    ResultToken=result_token
+                )
+            except Exception as e:
+                raise AWSError(
+                    "Could not publish evaluations to the Config service", e)
+
+            failed_evaluations = response.get('FailedEvaluations', [])
+            if len(failed_evaluations) == 0:
+                break
+
+            if attempt >= MAX_PUBLISH_ATTEMPTS - 1:
+                raise AWSError("%d evaluation(s) were not accepted by the Config service" %
+                               len(failed_evaluations), None)
+
+            config_evaluations = failed_evaluations
+            time.sleep(rate_limiter.backoff_delay(attempt))
+            attempt += 1
+
+        if on_published is not None:
+            on_published(batch)
+
+        return len(batch)
+
+    published_count = 0
+
+    if max_workers <= 1:
+        for batch in chunk_evaluations(evaluations):
+            published_count += publish_batch(batch)
+        return published_count
+
+    errors = []
+    batch_count = 0
+
+    def collect(future: object):
+        nonlocal published_count
+        if future.exception() is None:
+            published_count += future.result()
+        else:
+            errors.append(future.exception())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+
+        for batch in chunk_evaluations(evaluations):
+            pending.append(executor.submit(publish_batch, batch))
+            batch_count += 1
+
+            # wait for the oldest batch, so that only a bounded
+            # number of batches are held in memory
+            if len(pending) >= max_workers:
+                collect(pending.popleft())
+
+        while len(pending) > 0:
+            collect(pending.popleft())
+
+    if len(errors) > 0:
+        raise AWSError("%d of %d evaluation batches could not be published" %
+                       (len(errors), batch_count), errors[0])
+
+    return published_count
+
+
+def iterate_resource_config(boto_config_client: object, expression: str):
+    '''
+        Runs a Config advanced query against the configuration items recorded
+        in the account and yields each result as a dictionary, one page at
+        a time, following pagination tokens. E.g.
+
+        {
+            "resourceId": "bucketA",
+            "resourceType": "AWS::S3::Bucket",
+            "supplementaryConfiguration": {...}
+        }
+    '''
+    query_args = {
+        'Expression': expression,
+        'Limit': MAX_QUERY_RESULTS_PER_PAGE
+    }
+
+    while True:
+        try:
+            query_response = rate_limiter.call(
+                boto_config_client, "config", "SelectResourceConfig", **query_args)
+        except Exception as e:
+            raise AWSError("Could not run Config advanced query: %s" %
+                           expression, e)
+
+        for result in query_response.get('Results', []):
+            yield json.loads(result)
+
+        next_token = query_response.get('NextToken', '')
+        if next_token == '':
+            break
+        query_args['NextToken'] = next_token
+
+
+def select_resource_config(boto_config_client: object, expression: str):
+    '''
+        Runs a Config advanced query and returns all results as a list
+        of dictionaries. Please see iterate_resource_config
+    '''
+    return list(iterate_resource_config(boto_config_client, expression))
+
+
+def get_latest_configuration_item(boto_config_client: object, resource_type: str, resource_id: str):
+    '''
+        Returns the most recent configuration item recorded for a resource,
+        or None if one cannot be found. The item is converted from the format
+        returned by get_resource_config_history to the format used by
+        configuration change notifications, so that it can be evaluated
+        like the item of any other change event.
+    '''
+    try:
+        history_response = rate_limiter.call(
+            boto_config_client, "config", "GetResourceConfigHistory",
+            resourceType=resource_type,
+            resourceId=resource_id,
+            limit=1
+        )
+    except Exception as e:
+        raise AWSError("Could not read the configuration history of resource: %s" %
+                       resource_id, e)
+
+    configuration_items = history_response.get('configurationItems', [])
+    if len(configuration_items) == 0:
+        return None
+
+    return convert_configuration_item(configuration_items[0])
+
+
+def convert_configuration_item(configuration_item: dict):
+    '''
+        Converts a configuration item returned by the Config API to the
+        format used by configuration change notifications
+    '''
+    configuration_item = dict(configuration_item)
+
+    for (key, value) in configuration_item.items():
+        if isinstance(value, datetime.datetime):
+            configuration_item[key] = value.isoformat()
+
+    configuration_item['awsAccountId'] = configuration_item.get('accountId')
+    configuration_item['ARN'] = configuration_item.get('arn')
+    configuration_item['configurationStateMd5Hash'] = configuration_item.get(
+        'configurationItemMD5Hash')
+    configuration_item['configurationItemVersion'] = configuration_item.get(
+        'version')
+
+    # the API returns these documents as JSON strings
+    if isinstance(configuration_item.get('configuration'), str):
+        configuration_item['configuration'] = json.loads(
+            configuration_item['configuration'])
+
+    supplementary_config = {}
+    for (key, value) in configuration_item.get('supplementaryConfiguration', {}).items():
+        try:
+            supplementary_config[key] = json.loads(value)
+        except Exception:
+            supplementary_config[key] = value
+    configuration_item['supplementaryConfiguration'] = supplementary_config
+
+    return configuration_item
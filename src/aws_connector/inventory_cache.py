@@ -0,0 +1,323 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a cache of the resource attributes read from AWS
+services while scanning an account, such as the region and versioning
+status of each S3 bucket, so that repeat scans and remediations do not
+read them again.
+
+Attributes are kept in a SQLite database in /tmp, which survives warm
+Lambda invocations, and optionally in the state store shared by all
+containers. Entries expire after a configurable number of seconds, and
+are invalidated when a configuration change event reports a newer state
+of the resource.
+
+Change events only reach one container, so the invalidation of an entry
+is only seen by every container when the cache is shared, in which case
+the shared store is authoritative. Otherwise entries are kept for less
+than the interval between scheduled scans, so that each scheduled scan
+reads the attributes again rather than publishing a state another
+container invalidated.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import logging
+from support import logging_definition
+
+log = logging.getLogger()
+
+# The number of seconds resource attributes are cached for. The cache is
+# disabled unless this is set.
+INVENTORY_CACHE_SECONDS = int(os.environ.get(
+    "COMPLIANCE_APP_INVENTORY_CACHE_SECONDS", 0))
+INVENTORY_CACHE_LOCATION = os.environ.get(
+    "COMPLIANCE_APP_INVENTORY_CACHE_LOCATION", "/tmp/compliance-inventory.db")
+
+# When set to "true", entries are also kept in the state store configured
+# by COMPLIANCE_APP_STATE_STORE, so that they are shared by all containers
+INVENTORY_CACHE_SHARED = os.environ.get(
+    "COMPLIANCE_APP_INVENTORY_CACHE_SHARED", "false").lower() == "true"
+
+# The longest entries are kept for when the cache is not shared. Scheduled
+# rules run at most once an hour, and a Lambda invocation lasts at most 15
+# minutes, so entries read by a scheduled scan expire before the next one.
+MAX_UNSHARED_CACHE_SECONDS = 2700
+
+# The number of new entries written to the stores at once
+WRITE_BATCH_SIZE = 100
+
+
+class InventoryCache():
+    '''
+        Caches resource attributes by account, resource type and resource id.
+        Each entry is stored as a list of [resource, time read], e.g.
+
+        [{"region": "us-east-1", "attributes": {"versioning_status": "Enabled"}}, 1614556800.0]
+
+        Stores are supplied as functions returning a state store, so that
+        they are only opened once the cache is used. When a shared store is
+        configured, entries missing from it are not read from the local
+        store, since they may have been invalidated by another container.
+    '''
+
+    def __init__(self, local_store: object, ttl_seconds: int, shared_store: object = None):
+        self.local_store_loader = local_store
+        self.shared_store_loader = shared_store
+        self.ttl_seconds = ttl_seconds
+
+        self.lock = threading.Lock()
+        self.stores = None
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.ttl_seconds > 0
+
+    def partition(self, aws_account_id: str, resource_type: str):
+        return "inventory|%s|%s" % (aws_account_id, resource_type)
+
+    def get_stores(self):
+        '''
+            Returns the local store, followed by the shared store if
+            one is configured
+        '''
+        with self.lock:
+            if self.stores is None:
+                self.stores = [self.local_store_loader()]
+                if self.shared_store_loader is not None:
+                    shared_store = self.shared_store_loader()
+                    if shared_store is not None:
+                        self.stores.append(shared_store)
+
+            return self.stores
+
+    def max_age_seconds(self):
+        '''
+            Returns the number of seconds entries are kept for, which is
+            capped to MAX_UNSHARED_CACHE_SECONDS unless the cache is shared
+        '''
+        if len(self.get_stores()) > 1:
+            return self.ttl_seconds
+        return min(self.ttl_seconds, MAX_UNSHARED_CACHE_SECONDS)
+
+    def is_current(self, entry: list):
+        return entry is not None and time.time() - entry[1] < self.max_age_seconds()
+
+    def read_stores(self):
+        '''
+            Returns the stores entries are read from: the shared store if
+            one is configured, or else the local store
+        '''
+        stores = self.get_stores()
+        return stores[1:] if len(stores) > 1 else stores
+
+    def snapshot(self, aws_account_id: str, resource_type: str):
+        '''
+            Returns an InventorySnapshot holding the current entries of a
+            resource type in an account, used to read and record the
+            attributes of many resources during a scan. Returns None if
+            the cache is disabled.
+        '''
+        if not self.enabled:
+            return None
+
+        partition = self.partition(aws_account_id, resource_type)
+        stores = self.get_stores()
+
+        local_entries = stores[0].get_partition(partition)
+
+        entries = {}
+        for store in self.read_stores():
+            store_entries = local_entries if store is stores[0] else store.get_partition(partition)
+            for (resource_id, entry) in store_entries.items():
+                if self.is_current(entry) and \
+                        (resource_id not in entries or entries[resource_id][1] < entry[1]):
+                    entries[resource_id] = entry
+
+        # expired entries, and those invalidated in the shared store, are
+        # removed from the container's store, so that resources that no
+        # longer exist do not accumulate
+        removed_ids = [resource_id for resource_id in local_entries
+                       if resource_id not in entries]
+        if len(removed_ids) > 0:
+            stores[0].delete_items(partition, removed_ids)
+
+        # entries read from the shared store are kept by the container
+        shared_entries = {resource_id: entry for (resource_id, entry) in entries.items()
+                          if local_entries.get(resource_id, None) != entry}
+        if len(shared_entries) > 0:
+            stores[0].put_items(partition, shared_entries)
+
+        log.info("Loaded %d cached %s resource(s) in AWS Account: %s",
+                 len(entries), resource_type, aws_account_id)
+
+        return InventorySnapshot(self, partition, entries)
+
+    def get_attributes(self, aws_account_id: str, resource_type: str, resource_id: str):
+        '''
+            Returns the cached region and attributes of a single resource,
+            or None if they are not cached or the cache is disabled
+        '''
+        if not self.enabled:
+            return None
+
+        partition = self.partition(aws_account_id, resource_type)
+        for store in self.read_stores():
+            entry = store.get_item(partition, resource_id)
+            if self.is_current(entry):
+                self.count(hits=1)
+                return entry[0]
+
+        self.count(misses=1)
+        return None
+
+    def put_entries(self, partition: str, entries: dict):
+        '''
+            Writes a dictionary of resource id -> entry to every store
+        '''
+        for store in self.get_stores():
+            store.put_items(partition, entries)
+
+    def invalidate(self, aws_account_id: str, resource_type: str, resource_id: str):
+        '''
+            Removes the cached attributes of a resource, for example
+            after it was remediated
+        '''
+        if not self.enabled:
+            return
+
+        partition = self.partition(aws_account_id, resource_type)
+        for store in self.get_stores():
+            store.delete_items(partition, [resource_id])
+
+    def invalidate_configuration_item(self, aws_account_id: str, configuration_item: dict):
+        '''
+            Removes the cached attributes of the resource described by the
+            configuration item of a change event, unless they were read
+            after the change was captured
+        '''
+        if not self.enabled:
+            return
+
+        partition = self.partition(
+            aws_account_id, configuration_item['resourceType'])
+        resource_id = configuration_item['resourceId']
+        capture_time = parse_capture_time(
+            configuration_item.get('configurationItemCaptureTime', None))
+
+        for store in self.get_stores():
+            entry = store.get_item(partition, resource_id)
+            if entry is None:
+                continue
+            if capture_time is not None and entry[1] > capture_time:
+                continue
+
+            log.info("Invalidating the cached attributes of %s", resource_id)
+            store.delete_items(partition, [resource_id])
+
+    def count(self, hits: int = 0, misses: int = 0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+
+class InventorySnapshot():
+    '''
+        The cached entries of a resource type in an account, read by a scan.
+        Attributes recorded with put are written to the stores in batches of
+        WRITE_BATCH_SIZE, and must be written with flush once the scan ends.
+
+        Snapshots may be used from multiple threads.
+    '''
+
+    def __init__(self, inventory_cache: InventoryCache, partition: str, entries: dict):
+        self.inventory_cache = inventory_cache
+        self.partition = partition
+        self.entries = entries
+
+        self.lock = threading.Lock()
+        self.pending_entries = {}
+
+    def get(self, resource_id: str):
+        '''
+            Returns the cached region and attributes of a resource, or None
+        '''
+        entry = self.entries.get(resource_id, None)
+        if entry is None:
+            self.inventory_cache.count(misses=1)
+            return None
+
+        self.inventory_cache.count(hits=1)
+        return entry[0]
+
+    def put(self, resource_id: str, attributes: dict):
+        '''
+            Records the attributes of a resource read from AWS
+        '''
+        with self.lock:
+            self.pending_entries[resource_id] = [attributes, time.time()]
+            if len(self.pending_entries) < WRITE_BATCH_SIZE:
+                return
+
+            pending_entries = self.pending_entries
+            self.pending_entries = {}
+
+        self.inventory_cache.put_entries(self.partition, pending_entries)
+
+    def flush(self):
+        '''
+            Writes the attributes recorded since the last write
+        '''
+        with self.lock:
+            pending_entries = self.pending_entries
+            self.pending_entries = {}
+
+        if len(pending_entries) > 0:
+            self.inventory_cache.put_entries(self.partition, pending_entries)
+
+
+def parse_capture_time(capture_time: str):
+    '''
+        Converts the capture time of a configuration item, e.g.
+        "2021-02-27T18:05:07.395Z", to seconds since the epoch.
+        Returns None if the time cannot be parsed.
+    '''
+    if not capture_time:
+        return None
+
+    for time_format in ["%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z"]:
+        try:
+            return datetime.strptime(str(capture_time).replace("Z", "+0000"), time_format).timestamp()
+        except ValueError:
+            pass
+
+    return None
+
+
+def load_local_store():
+    from state.sqlite_store import SQLiteStateStore
+
+    return SQLiteStateStore(INVENTORY_CACHE_LOCATION)
+
+
+def load_shared_store():
+    from state import factory as state_factory
+
+    store_type = os.environ.get("COMPLIANCE_APP_STATE_STORE", None)
+    if not store_type:
+        log.warning(
+            "The inventory cache cannot be shared, because a state store is not configured")
+        return None
+
+    return state_factory.load_state_store(
+        store_type, os.environ.get("COMPLIANCE_APP_STATE_STORE_LOCATION", None))
+
+
+# The inventory cache shared by all modules
+INVENTORY_CACHE = InventoryCache(load_local_store, INVENTORY_CACHE_SECONDS,
+                                 load_shared_store if INVENTORY_CACHE_SHARED else None)
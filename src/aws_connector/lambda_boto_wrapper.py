@@ -0,0 +1,23 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+
+import json
+from exception.exceptions import AWSError
+import aws_connector.rate_limiter as rate_limiter
+
+
+def invoke_async(boto_lambda_client: object, function_name: str, payload: dict):
+    '''
+        Invokes a Lambda function asynchronously with a JSON serializable
+        payload. The function name may also be its ARN.
+    '''
+    try:
+        rate_limiter.call(
+            boto_lambda_client, "lambda", "Invoke",
+            FunctionName=function_name,
+            InvocationType='Event',
+            Payload=json.dumps(payload)
+        )
+    except Exception as e:
+        raise AWSError("Could not invoke Lambda function: %s" %
+                       function_name, e)
@@ -0,0 +1,349 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a process wide set of adaptive rate limiters, one per
+(account, service, operation), shared by all connector functions.
+
+Each limiter combines a concurrency limit with a token bucket. Both follow
+an additive increase / multiplicative decrease (AIMD) policy: they grow
+slowly while calls succeed, and are cut in half when the service throttles
+a call. Throttled calls are retried with backoff rather than failed, so
+that scans run at the highest throughput the account allows without
+dropping resources. Transient errors, such as server errors and dropped
+connections, are retried the same way without slowing the limiter down.
+
+Pooled boto clients are created with botocore retries disabled, so that
+these limiters are the only place calls are retried.
+"""
+
+import random
+import re
+import threading
+import time
+import weakref
+from support.metrics import METRICS
+
+THROTTLING_ERROR_CODES = [
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'SlowDown'
+]
+
+TRANSIENT_ERROR_CODES = [
+    'InternalError',
+    'InternalFailure',
+    'InternalServerError',
+    'ServiceUnavailable',
+    'RequestTimeout',
+    'RequestTimeoutException'
+]
+
+# The botocore exceptions raised when a connection fails or times out,
+# matched by name so that botocore is not imported
+TRANSIENT_EXCEPTION_NAMES = [
+    'ConnectionError',
+    'EndpointConnectionError',
+    'ConnectionClosedError',
+    'ConnectTimeoutError',
+    'ReadTimeoutError'
+]
+
+# The number of times a throttled call is attempted before its error is raised
+MAX_ATTEMPTS = 10
+
+# The number of times a call failing with a transient error is attempted
+MAX_TRANSIENT_ATTEMPTS = 3
+
+# The base and maximum delays used when backing off after a failed call
+BACKOFF_BASE_SECONDS = 0.1
+MAX_BACKOFF_SECONDS = 20
+
+# Limits of the number of in-flight calls of a single operation
+INITIAL_CONCURRENCY = 10
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 100
+
+# The minimum rate, in calls per second, of a throttled operation, and the
+# number of calls per second the rate grows by each second without throttling
+MIN_RATE = 1.0
+RATE_INCREASE = 10.0
+
+# The factor applied to the concurrency limit and rate when a call is throttled
+DECREASE_FACTOR = 0.5
+
+# Throttling errors received within this many seconds of a decrease are
+# attributed to calls issued before it, and do not decrease the limits again
+DECREASE_COOLDOWN_SECONDS = 0.2
+
+# The account name used for clients created with the default credentials
+DEFAULT_ACCOUNT = "default"
+
+# The limiters of this process, keyed by (account, service, operation)
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
+
+# The account each pooled boto client belongs to. See register_client
+CLIENT_ACCOUNTS = weakref.WeakKeyDictionary()
+CLIENT_ACCOUNTS_LOCK = threading.Lock()
+
+
+def is_throttling_error(e: Exception):
+    '''
+        Returns True if the exception was raised because the AWS service
+        throttled the request
+    '''
+    error_code = getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+
+    return error_code in THROTTLING_ERROR_CODES
+
+
+def is_transient_error(e: Exception):
+    '''
+        Returns True if the call failed because of a server error or a
+        connection problem, and is likely to succeed if retried
+    '''
+    if type(e).__name__ in TRANSIENT_EXCEPTION_NAMES:
+        return True
+
+    response = getattr(e, 'response', {})
+    if response.get('Error', {}).get('Code', '') in TRANSIENT_ERROR_CODES:
+        return True
+
+    return (response.get('ResponseMetadata', {}).get('HTTPStatusCode', None) or 0) >= 500
+
+
+def backoff_delay(attempt: int):
+    '''
+        Returns the number of seconds to wait before retrying a failed
+        call for the nth time, using capped exponential backoff with
+        full jitter.
+    '''
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+class AdaptiveRateLimiter():
+    '''
+        Limits the concurrency and rate of calls to a single AWS operation.
+
+        The concurrency limit starts at INITIAL_CONCURRENCY and the rate is
+        initially unlimited. Each successful call grows the concurrency
+        limit by 1/limit, and the rate by RATE_INCREASE/rate, so that both
+        grow by about one unit per round of calls. When a call is throttled,
+        the concurrency limit is halved, and the rate is set to half of the
+        rate calls were being sent at. Calls throttled within
+        DECREASE_COOLDOWN_SECONDS of a decrease do not decrease them again.
+    '''
+
+    def __init__(self, initial_concurrency: int = INITIAL_CONCURRENCY,
+                 max_concurrency: int = MAX_CONCURRENCY):
+        self.condition = threading.Condition()
+        self.concurrency_limit = float(initial_concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+
+        # token bucket, allowed to go into debt: a caller that takes a token
+        # the bucket does not have waits until it would have been refilled
+        self.rate = None
+        self.tokens = 0.0
+        self.last_refill = time.monotonic()
+
+        # the rate calls are sent at, measured over windows of about a second
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.measured_rate = None
+
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.throttles = 0
+
+    def acquire(self):
+        '''
+            Blocks until a call may be issued
+        '''
+        with self.condition:
+            while self.in_flight >= int(self.concurrency_limit):
+                self.condition.wait()
+            self.in_flight += 1
+            delay = self.reserve_token()
+
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve_token(self):
+        '''
+            Takes a token from the bucket and returns the number of seconds
+            the caller must wait for it. Must be called holding the lock.
+        '''
+        now = time.monotonic()
+
+        self.window_count += 1
+        elapsed = now - self.window_start
+        if elapsed >= 1.0:
+            self.measured_rate = self.window_count / elapsed
+            self.window_start = now
+            self.window_count = 0
+
+        if self.rate is None:
+            return 0.0
+
+        self.tokens = min(max(1.0, self.rate), self.tokens +
+                          (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        self.tokens -= 1.0
+
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def release(self, throttled: bool = False):
+        '''
+            Records the outcome of a call issued after acquire(), and
+            adjusts the limits
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            if throttled:
+                self.throttles += 1
+
+                if now - self.last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                    self.last_decrease = now
+                    self.concurrency_limit = max(
+                        MIN_CONCURRENCY, self.concurrency_limit * DECREASE_FACTOR)
+                    self.rate = max(MIN_RATE, self.current_rate(
+                        now) * DECREASE_FACTOR)
+                    self.tokens = min(self.tokens, 0.0)
+            else:
+                self.successes += 1
+                self.concurrency_limit = min(self.max_concurrency,
+                                             self.concurrency_limit + 1.0 / self.concurrency_limit)
+                if self.rate is not None:
+                    self.rate += RATE_INCREASE / self.rate
+
+            self.condition.notify_all()
+
+    def current_rate(self, now: float):
+        '''
+            Returns the enforced rate, or the measured rate of calls when
+            the rate is not limited. Must be called holding the lock.
+        '''
+        if self.rate is not None:
+            return self.rate
+
+        elapsed = now - self.window_start
+        if self.measured_rate is not None and elapsed < 0.5:
+            return self.measured_rate
+
+        return self.window_count / max(elapsed, 0.001)
+
+    def stats(self):
+        '''
+            Returns the limits and counters of the limiter as a dictionary
+        '''
+        with self.condition:
+            return {
+                "concurrency_limit": int(self.concurrency_limit),
+                "rate": round(self.rate, 2) if self.rate is not None else None,
+                "successes": self.successes,
+                "throttles": self.throttles
+            }
+
+
+def register_client(boto_client: object, account_id: str):
+    '''
+        Records the account a boto client belongs to, so that its calls
+        share the limiters of that account
+    '''
+    with CLIENT_ACCOUNTS_LOCK:
+        CLIENT_ACCOUNTS[boto_client] = account_id
+
+
+def client_account(boto_client: object):
+    '''
+        Returns the account a boto client was registered with, or
+        DEFAULT_ACCOUNT if it was not registered
+    '''
+    with CLIENT_ACCOUNTS_LOCK:
+        try:
+            return CLIENT_ACCOUNTS.get(boto_client, DEFAULT_ACCOUNT)
+        except TypeError:
+            return DEFAULT_ACCOUNT
+
+
+def get_rate_limiter(account_id: str, service_name: str, operation_name: str):
+    '''
+        Returns the limiter of an operation, creating it on first use
+    '''
+    limiter_key = (account_id, service_name, operation_name)
+
+    with RATE_LIMITERS_LOCK:
+        limiter = RATE_LIMITERS.get(limiter_key, None)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter()
+            RATE_LIMITERS[limiter_key] = limiter
+
+        return limiter
+
+
+def method_name(operation_name: str):
+    '''
+        Returns the boto client method of an operation, e.g.
+        "GetBucketVersioning" -> "get_bucket_versioning"
+    '''
+    return re.sub('(?<!^)(?=[A-Z])', '_', operation_name).lower()
+
+
+def call(boto_client: object, service_name: str, operation_name: str, **kwargs):
+    '''
+        Calls an operation of a boto client through the limiter of the
+        client's account, retrying throttled calls up to MAX_ATTEMPTS times
+        and calls failing with a transient error up to MAX_TRANSIENT_ATTEMPTS
+        times, and returns the response. E.g.
+
+        call(boto_s3_client, "s3", "GetBucketVersioning", Bucket="bucketA")
+    '''
+    limiter = get_rate_limiter(client_account(
+        boto_client), service_name, operation_name)
+    client_method = getattr(boto_client, method_name(operation_name))
+    attempt = 0
+
+    while True:
+        limiter.acquire()
+        try:
+            with METRICS.aws_call(service_name, operation_name):
+                response = client_method(**kwargs)
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            limiter.release(throttled)
+
+            if throttled:
+                max_attempts = MAX_ATTEMPTS
+            elif is_transient_error(e):
+                max_attempts = MAX_TRANSIENT_ATTEMPTS
+            else:
+                raise e
+
+            if attempt >= max_attempts - 1:
+                raise e
+
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+
+        limiter.release(False)
+        return response
+
+
+def limiter_stats():
+    '''
+        Returns the stats of each limiter as a dictionary keyed
+        by "account:service:operation"
+    '''
+    with RATE_LIMITERS_LOCK:
+        limiters = list(RATE_LIMITERS.items())
+
+    return {"%s:%s:%s" % limiter_key: limiter.stats() for (limiter_key, limiter) in limiters}
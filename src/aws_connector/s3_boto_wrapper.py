@@ -1,9 +1,56 @@
 """Author: Mark Hanegraaff -- 2021
 """
 
-import boto3
 from exception.exceptions import AWSError
-from aws_connector.aws_client import AWSClient
+from support.concurrency import bounded_map
+import aws_connector.rate_limiter as rate_limiter
+from aws_connector.aws_client import AWSClient, MAX_POOL_CONNECTIONS
+
+# The default number of in-flight get_bucket_versioning calls issued when
+# scanning all buckets. A value of 1 will scan buckets sequentially.
+# This matches the size of the client connection pool.
+SCAN_CONCURRENCY = MAX_POOL_CONNECTIONS
+
+# An index of bucket name -> region name. Bucket names are globally unique and
+# a bucket's region cannot change, so regions are resolved once and kept
+# for the life of the container.
+BUCKET_REGION_INDEX = {}
+
+
+def iterate_buckets(boto_s3_client: object, start_after: str = None):
+    '''
+        Yields the names of the S3 buckets belonging to all regions, one
+        page of the listing at a time. The S3 service lists buckets in
+        ascending name order. E.g.
+
+        'bucketA', 'bucketB', 'bucketC', ...
+
+        When 'start_after' is supplied, only the names sorting after it
+        are yielded.
+    '''
+    list_args = {}
+
+    while True:
+        try:
+            bucket_list = rate_limiter.call(
+                boto_s3_client, "s3", "ListBuckets", **list_args)
+        except Exception as e:
+            raise AWSError("Could not list s3 buckets", e)
+
+        for bucket in bucket_list['Buckets']:
+            bucket_name = bucket['Name']
+
+            # newer versions of the API report the region with each bucket
+            if 'BucketRegion' in bucket:
+                BUCKET_REGION_INDEX[bucket_name] = bucket['BucketRegion']
+
+            if start_after is None or bucket_name > start_after:
+                yield bucket_name
+
+        continuation_token = bucket_list.get('ContinuationToken', None)
+        if not continuation_token:
+            break
+        list_args['ContinuationToken'] = continuation_token
 
 
 def get_all_buckets(boto_s3_client: object):
@@ -13,22 +60,160 @@ def get_all_buckets(boto_s3_client: object):
 
         ['bucketA', 'bucketB', 'bucketC', ...]
     '''
-    all_s3_buckets = []
+    return list(iterate_buckets(boto_s3_client))
+
+
+def get_bucket_region(boto_s3_client: object, bucket_name: str):
+    '''
+        Returns the region name a bucket was created in, using the bucket
+        region index when possible. E.g.
+
+        'us-west-2'
+    '''
+    region_name = BUCKET_REGION_INDEX.get(bucket_name, None)
+
+    if region_name is None:
+        try:
+            location_response = rate_limiter.call(
+                boto_s3_client, "s3", "GetBucketLocation", Bucket=bucket_name)
+        except Exception as e:
+            raise AWSError(
+                "Could not determine the region of S3 Bucket: %s" % bucket_name, e)
+
+        # buckets in us-east-1 have a null location constraint, while
+        # "EU" is a legacy alias of eu-west-1
+        region_name = location_response.get('LocationConstraint', None)
+        if region_name is None or region_name == '':
+            region_name = 'us-east-1'
+        elif region_name == 'EU':
+            region_name = 'eu-west-1'
+
+        BUCKET_REGION_INDEX[bucket_name] = region_name
+
+    return region_name
+
+
+def get_bucket_versioning(boto_s3_client: object, bucket_name: str):
+    '''
+        Returns the versioning status of a single bucket. Buckets that
+        have never had versioning enabled are reported as "Suspended"
+    '''
+    versioning_response = rate_limiter.call(
+        boto_s3_client, "s3", "GetBucketVersioning", Bucket=bucket_name)
+
+    return versioning_response.get('Status', 'Suspended')
+
+
+def get_bucket_attributes(boto_s3_client: object, bucket_name: str, attribute_readers: dict,
+                          regional_client: object = None):
+    '''
+        Reads the attributes of a single bucket and returns them as a tuple
+        of (region name, attributes). 'attribute_readers' maps the name of
+        each attribute to a function reading its value, given an S3 client
+        and a bucket name, e.g.
+
+        {"versioning_status": get_bucket_versioning}
+
+        returns
+
+        ("us-east-1", {"versioning_status": "Enabled"})
+
+        If a 'regional_client' function is supplied, it is called with a
+        region name and must return an S3 client for that region. The
+        attributes are then read using the client of the region the bucket
+        belongs to, which avoids cross-region redirects.
+    '''
+    if regional_client is None:
+        (region_name, attribute_client) = (
+            BUCKET_REGION_INDEX.get(bucket_name, None), boto_s3_client)
+    else:
+        region_name = get_bucket_region(boto_s3_client, bucket_name)
+        attribute_client = regional_client(region_name)
+
+    return (region_name, {attribute: read_attribute(attribute_client, bucket_name)
+                          for (attribute, read_attribute) in attribute_readers.items()})
+
+
+def iterate_bucket_attributes(boto_s3_client: object, attribute_readers: dict,
+                              max_workers: int = SCAN_CONCURRENCY, regional_client: object = None,
+                              start_after: str = None, snapshot: object = None):
+    '''
+        Scans all S3 buckets and yields the attributes of each one as a
+        (bucket_name, attributes, exception) tuple, in listing order. The
+        exception is None unless the bucket could not be scanned. E.g.
+
+        ("bucketA", {"versioning_status": "Enabled"}, None)
+        ("bucketB", {"versioning_status": "Suspended"}, None)
+        ("bucketC", None, ExceptionObject)
+
+        Please see get_bucket_attributes for a description of
+        'attribute_readers' and 'regional_client'.
+
+        Buckets are scanned using a pool of at most 'max_workers' threads,
+        which bounds the number of in-flight calls to the S3 service. Only a
+        small window of buckets is scanned ahead of the consumer, so memory
+        use does not grow with the number of buckets.
+
+        When 'start_after' is supplied, only the buckets whose name sorts
+        after it are scanned.
+
+        If an inventory 'snapshot' is supplied (see
+        aws_connector.inventory_cache), buckets whose region and attributes
+        it holds are not read again, and the attributes of the buckets that
+        are read are recorded in it.
+    '''
+    def scan_bucket(bucket_name: str):
+        if snapshot is not None:
+            entry = snapshot.get(bucket_name)
+            cached_attributes = entry.get('attributes', {}) if entry is not None else {}
+            if all([attribute in cached_attributes for attribute in attribute_readers]):
+                if entry['region'] is not None:
+                    BUCKET_REGION_INDEX.setdefault(
+                        bucket_name, entry['region'])
+                return {attribute: cached_attributes[attribute] for attribute in attribute_readers}
+
+        (region_name, attributes) = get_bucket_attributes(
+            boto_s3_client, bucket_name, attribute_readers, regional_client)
+
+        if snapshot is not None:
+            snapshot.put(bucket_name, {
+                "region": region_name,
+                "attributes": attributes
+            })
+
+        return attributes
 
     try:
-        bucket_list = boto_s3_client.list_buckets()
+        yield from bounded_map(scan_bucket, iterate_buckets(boto_s3_client, start_after), max_workers)
+    finally:
+        if snapshot is not None:
+            snapshot.flush()
 
-        for bucket in bucket_list['Buckets']:
-            bucket_name = bucket['Name']
 
-            all_s3_buckets.append(bucket_name)
-    except Exception as e:
-        raise AWSError("Could not list s3 buckets", e)
+def iterate_bucket_versioning_configuration(boto_s3_client: object, max_workers: int = SCAN_CONCURRENCY,
+                                                regional_client: object = None):
+    '''
+        Scans all S3 buckets and yields the versioning configuration of each
+        one as a (bucket_name, status, exception) tuple, in listing order.
+        The exception is None unless the bucket could not be scanned. E.g.
+
+        ("bucketA", "Enabled", None)
+        ("bucketB", "Suspended", None)
+        ("bucketC", None, ExceptionObject)
 
-    return all_s3_buckets
+        Please see iterate_bucket_attributes for a description of
+        the parameters.
+    '''
+    for (bucket_name, attributes, exception) in iterate_bucket_attributes(
+            boto_s3_client, {"versioning_status": get_bucket_versioning}, max_workers, regional_client):
+        if exception is not None:
+            yield (bucket_name, None, exception)
+        else:
+            yield (bucket_name, attributes["versioning_status"], None)
 
 
-def get_all_bucket_versioning_configuration(boto_s3_client: object):
+def get_all_bucket_versioning_configuration(boto_s3_client: object, max_workers: int = SCAN_CONCURRENCY,
+                                            regional_client: object = None):
     '''
         Scans all S3 buckets and returns the bucket versioning configuration
         as a dictionary. E.g.
@@ -44,21 +229,19 @@ def get_all_bucket_versioning_configuration(boto_s3_client: object):
         {
             "bucketC": ExceptionObject
         }
-    '''
-
-    all_bucket_names = get_all_buckets(boto_s3_client)
 
+        Please see iterate_bucket_versioning_configuration for a description
+        of the parameters.
+    '''
     versioning_dict = {}
     exception_dict = {}
 
-    for bucket_name in all_bucket_names:
-        try:
-            versioning_response = boto_s3_client.get_bucket_versioning(
-                Bucket=bucket_name)
-            versioning_dict[bucket_name] = versioning_response.get(
-                'Status', 'Suspended')
-        except Exception as e:
-            exception_dict[bucket_name] = e
+    for (bucket_name, status, exception) in iterate_bucket_versioning_configuration(
+            boto_s3_client, max_workers, regional_client):
+        if exception is None:
+            versioning_dict[bucket_name] = status
+        else:
+            exception_dict[bucket_name] = exception
 
     return (versioning_dict, exception_dict)
 
@@ -69,7 +252,8 @@ def enable_versioning(boto_s3_client: object, bucket_name: str):
     '''
 
     try:
-        boto_s3_client.put_bucket_versioning(
+        rate_limiter.call(
+            boto_s3_client, "s3", "PutBucketVersioning",
             Bucket=bucket_name,
             VersioningConfiguration={
                 'Status': 'Enabled'
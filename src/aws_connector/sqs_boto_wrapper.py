@@ -0,0 +1,84 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+
+import json
+from exception.exceptions import AWSError
+import aws_connector.rate_limiter as rate_limiter
+
+# The maximum number of messages sent, received or deleted by a single call
+MAX_MESSAGES_PER_CALL = 10
+
+# The maximum number of seconds a receive_message call may wait for messages
+MAX_WAIT_SECONDS = 20
+
+
+def send_messages(boto_sqs_client: object, queue_url: str, messages: list):
+    '''
+        Sends a list of JSON serializable messages to a queue, in batches
+        of MAX_MESSAGES_PER_CALL. An AWSError is raised if any message
+        was not accepted.
+    '''
+    for start in range(0, len(messages), MAX_MESSAGES_PER_CALL):
+        batch = messages[start:start + MAX_MESSAGES_PER_CALL]
+
+        try:
+            response = rate_limiter.call(
+                boto_sqs_client, "sqs", "SendMessageBatch",
+                QueueUrl=queue_url,
+                Entries=[{
+                    'Id': str(i),
+                    'MessageBody': json.dumps(message)
+                } for (i, message) in enumerate(batch)]
+            )
+        except Exception as e:
+            raise AWSError("Could not send messages to queue: %s" %
+                           queue_url, e)
+
+        failed = response.get('Failed', [])
+        if len(failed) > 0:
+            raise AWSError("%d message(s) were not accepted by queue: %s" %
+                           (len(failed), queue_url), None)
+
+
+def receive_messages(boto_sqs_client: object, queue_url: str, max_messages: int = MAX_MESSAGES_PER_CALL,
+                     wait_seconds: int = 0):
+    '''
+        Receives up to 'max_messages' messages from a queue, waiting up to
+        'wait_seconds' for the first one, and returns them as a list of
+        (receipt handle, message) tuples.
+    '''
+    try:
+        response = rate_limiter.call(
+            boto_sqs_client, "sqs", "ReceiveMessage",
+            QueueUrl=queue_url,
+            MaxNumberOfMessages=min(max_messages, MAX_MESSAGES_PER_CALL),
+            WaitTimeSeconds=min(int(wait_seconds), MAX_WAIT_SECONDS)
+        )
+    except Exception as e:
+        raise AWSError("Could not receive messages from queue: %s" %
+                       queue_url, e)
+
+    return [(message['ReceiptHandle'], json.loads(message['Body']))
+            for message in response.get('Messages', [])]
+
+
+def delete_messages(boto_sqs_client: object, queue_url: str, receipt_handles: list):
+    '''
+        Deletes the messages identified by their receipt handles from
+        a queue, in batches of MAX_MESSAGES_PER_CALL
+    '''
+    for start in range(0, len(receipt_handles), MAX_MESSAGES_PER_CALL):
+        batch = receipt_handles[start:start + MAX_MESSAGES_PER_CALL]
+
+        try:
+            rate_limiter.call(
+                boto_sqs_client, "sqs", "DeleteMessageBatch",
+                QueueUrl=queue_url,
+                Entries=[{
+                    'Id': str(i),
+                    'ReceiptHandle': receipt_handle
+                } for (i, receipt_handle) in enumerate(batch)]
+            )
+        except Exception as e:
+            raise AWSError("Could not delete messages from queue: %s" %
+                           queue_url, e)
@@ -0,0 +1,332 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains an in-process fake of the STS, S3 and Config services,
+used to benchmark the Lambda handlers without an AWS account.
+
+The fake holds a simulated inventory of S3 buckets, and every call it serves
+is counted and delayed by a configurable latency. Calls are rejected with the
+throttling error the real service would return when they exceed a configurable
+capacity, and at random at a configurable rate.
+"""
+
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+
+# The error codes returned by each service when a request is throttled
+THROTTLING_ERROR_CODES = {
+    'sts': 'Throttling',
+    's3': 'SlowDown',
+    'config': 'ThrottlingException'
+}
+
+# The number of buckets returned by each page of list_buckets
+LIST_BUCKETS_PAGE_SIZE = 1000
+
+# The maximum number of evaluations accepted by put_evaluations
+MAX_EVALUATIONS_PER_CALL = 100
+
+
+class FakeAWS():
+    '''
+        The state shared by all fake sessions and clients: the bucket
+        inventory, the evaluations published to Config and the call counters.
+
+        Attributes:
+            bucket_count: The number of buckets in the inventory
+            latency_ms: The delay added to every call, in milliseconds
+            throttle_rate: The fraction of calls rejected at random with a
+                throttling error, between 0 and 1
+            capacity: The number of calls per second each operation
+                accepts before throttling, or None for no limit
+            versioning_ratio: The fraction of buckets with versioning enabled
+            regions: The regions buckets are spread across
+            report_bucket_region: When True, list_buckets reports the region
+                of each bucket, as newer versions of the API do
+            call_counts: Counter of calls keyed by "service:operation"
+            throttle_counts: Counter of throttled calls keyed by "service:operation"
+            published_evaluations: Dictionary of resource id -> the last
+                evaluation published for it
+    '''
+
+    def __init__(self, bucket_count: int, latency_ms: float = 0, throttle_rate: float = 0.0,
+                 capacity: float = None, versioning_ratio: float = 0.5, regions: list = None,
+                 report_bucket_region: bool = False, seed: int = 0):
+        self.bucket_count = bucket_count
+        self.latency_ms = latency_ms
+        self.throttle_rate = throttle_rate
+        self.capacity = capacity
+        self.versioning_ratio = versioning_ratio
+        self.regions = regions if regions is not None else [
+            'us-east-1', 'us-west-2', 'eu-west-1']
+        self.report_bucket_region = report_bucket_region
+
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+
+        self.buckets = {}
+        for i in range(bucket_count):
+            self.buckets["bucket-%06d" % i] = {
+                "region": self.regions[i % len(self.regions)],
+                "status": "Enabled" if self.random.random() < versioning_ratio else "Suspended"
+            }
+        self.bucket_names = list(self.buckets.keys())
+
+        self.reset_counters()
+
+    def reset_counters(self):
+        '''
+            Clears the call counters and the published evaluations
+        '''
+        with self.lock:
+            self.call_counts = Counter()
+            self.throttle_counts = Counter()
+            self.published_evaluations = {}
+            # the token bucket of each operation, as (tokens, last refill time)
+            self.capacity_buckets = {}
+
+    def record_call(self, service_name: str, operation_name: str):
+        '''
+            Counts a call, waits for the simulated latency and raises a
+            throttling error if the call is selected to be throttled
+        '''
+        call_name = "%s:%s" % (service_name, operation_name)
+
+        with self.lock:
+            self.call_counts[call_name] += 1
+            throttled = self.throttle_rate > 0 and self.random.random() < self.throttle_rate
+
+            if self.capacity is not None:
+                now = time.monotonic()
+                (tokens, last_refill) = self.capacity_buckets.get(
+                    call_name, (self.capacity, now))
+                tokens = min(self.capacity, tokens +
+                             (now - last_refill) * self.capacity)
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    throttled = True
+                self.capacity_buckets[call_name] = (tokens, now)
+
+            if throttled:
+                self.throttle_counts[call_name] += 1
+
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+        if throttled:
+            raise ClientError({
+                'Error': {
+                    'Code': THROTTLING_ERROR_CODES[service_name],
+                    'Message': 'Rate exceeded'
+                }
+            }, operation_name)
+
+    def non_compliant_bucket_names(self):
+        '''
+            Returns the names of the buckets without versioning
+        '''
+        return [bucket_name for bucket_name in self.bucket_names
+                if self.buckets[bucket_name]['status'] != 'Enabled']
+
+    def configuration_item(self, bucket_name: str):
+        '''
+            Returns the configuration item of a bucket, in the format used
+            by configuration change notifications
+        '''
+        bucket = self.buckets[bucket_name]
+        return {
+            "configurationItemCaptureTime": "2021-01-13T05:00:23.319Z",
+            "configurationStateId": 1610514023319,
+            "configurationStateMd5Hash": "",
+            "configurationItemStatus": "OK",
+            "configurationItemVersion": "1.3",
+            "awsAccountId": "999999999999",
+            "awsRegion": bucket['region'],
+            "resourceType": "AWS::S3::Bucket",
+            "resourceId": bucket_name,
+            "resourceName": bucket_name,
+            "ARN": "arn:aws:s3:::%s" % bucket_name,
+            "configuration": {"name": bucket_name},
+            "supplementaryConfiguration": {
+                "BucketVersioningConfiguration": {
+                    "status": bucket['status'],
+                    "isMfaDeleteEnabled": None
+                }
+            },
+            "tags": {}
+        }
+
+    def session(self, **kwargs):
+        '''
+            Returns a fake boto session. This method has the signature of
+            the boto3.Session constructor, which it replaces.
+        '''
+        return FakeSession(self, kwargs.get('region_name', None))
+
+
+class FakeSession():
+    '''
+        A fake boto session that creates fake clients
+    '''
+
+    def __init__(self, fake_aws: FakeAWS, region_name: str = None):
+        self.fake_aws = fake_aws
+        self.region_name = region_name if region_name is not None else 'us-east-1'
+
+    def client(self, service_name: str, region_name: str = None, config: object = None):
+        clients = {
+            'sts': FakeSTSClient,
+            's3': FakeS3Client,
+            'config': FakeConfigClient
+        }
+
+        if service_name not in clients:
+            raise ValueError(
+                "The %s service is not simulated" % service_name)
+
+        return clients[service_name](self.fake_aws, region_name or self.region_name)
+
+
+class FakeClient():
+    '''
+        Base class of the fake service clients
+    '''
+    SERVICE_NAME = ""
+
+    def __init__(self, fake_aws: FakeAWS, region_name: str):
+        self.fake_aws = fake_aws
+        self.region_name = region_name
+
+    def record_call(self, operation_name: str):
+        self.fake_aws.record_call(self.SERVICE_NAME, operation_name)
+
+
+class FakeSTSClient(FakeClient):
+    SERVICE_NAME = "sts"
+
+    def assume_role(self, RoleArn: str, RoleSessionName: str):
+        self.record_call('AssumeRole')
+
+        return {
+            'Credentials': {
+                'AccessKeyId': 'ASIA%s' % RoleSessionName[:12].upper(),
+                'SecretAccessKey': 'secret',
+                'SessionToken': 'token',
+                'Expiration': datetime.now(timezone.utc) + timedelta(hours=1)
+            }
+        }
+
+
+class FakeS3Client(FakeClient):
+    SERVICE_NAME = "s3"
+
+    def list_buckets(self, ContinuationToken: str = None):
+        self.record_call('ListBuckets')
+
+        start = int(ContinuationToken) if ContinuationToken else 0
+        end = start + LIST_BUCKETS_PAGE_SIZE
+
+        buckets = []
+        for bucket_name in self.fake_aws.bucket_names[start:end]:
+            bucket = {'Name': bucket_name}
+            if self.fake_aws.report_bucket_region:
+                bucket['BucketRegion'] = self.fake_aws.buckets[bucket_name]['region']
+            buckets.append(bucket)
+
+        response = {'Buckets': buckets}
+        if end < len(self.fake_aws.bucket_names):
+            response['ContinuationToken'] = str(end)
+        return response
+
+    def get_bucket_location(self, Bucket: str):
+        self.record_call('GetBucketLocation')
+
+        region_name = self.fake_aws.buckets[Bucket]['region']
+        return {
+            'LocationConstraint': None if region_name == 'us-east-1' else region_name
+        }
+
+    def get_bucket_versioning(self, Bucket: str):
+        self.record_call('GetBucketVersioning')
+
+        status = self.fake_aws.buckets[Bucket]['status']
+        if status == 'Suspended':
+            return {}
+        return {'Status': status}
+
+    def put_bucket_versioning(self, Bucket: str, VersioningConfiguration: dict):
+        self.record_call('PutBucketVersioning')
+
+        with self.fake_aws.lock:
+            self.fake_aws.buckets[Bucket]['status'] = VersioningConfiguration['Status']
+        return {}
+
+
+class FakeConfigClient(FakeClient):
+    SERVICE_NAME = "config"
+
+    def put_evaluations(self, Evaluations: list, ResultToken: str):
+        self.record_call('PutEvaluations')
+
+        if len(Evaluations) > MAX_EVALUATIONS_PER_CALL:
+            raise ClientError({
+                'Error': {
+                    'Code': 'ValidationException',
+                    'Message': 'Too many evaluations'
+                }
+            }, 'PutEvaluations')
+
+        with self.fake_aws.lock:
+            for evaluation in Evaluations:
+                self.fake_aws.published_evaluations[evaluation['ComplianceResourceId']] = evaluation
+        return {'FailedEvaluations': []}
+
+    def select_resource_config(self, Expression: str, Limit: int = 100, NextToken: str = None):
+        self.record_call('SelectResourceConfig')
+
+        start = int(NextToken) if NextToken else 0
+        end = start + Limit
+
+        results = []
+        for bucket_name in self.fake_aws.bucket_names[start:end]:
+            configuration_item = self.fake_aws.configuration_item(bucket_name)
+            results.append(json.dumps({
+                'resourceId': bucket_name,
+                'resourceType': configuration_item['resourceType'],
+                'configurationItemStatus': configuration_item['configurationItemStatus'],
+                'supplementaryConfiguration': configuration_item['supplementaryConfiguration']
+            }))
+
+        response = {'Results': results}
+        if end < len(self.fake_aws.bucket_names):
+            response['NextToken'] = str(end)
+        return response
+
+    def get_resource_config_history(self, resourceType: str, resourceId: str, limit: int = 10):
+        self.record_call('GetResourceConfigHistory')
+
+        configuration_item = self.fake_aws.configuration_item(resourceId)
+        return {
+            'configurationItems': [{
+                'version': configuration_item['configurationItemVersion'],
+                'accountId': configuration_item['awsAccountId'],
+                'configurationItemCaptureTime': datetime.now(timezone.utc),
+                'configurationItemStatus': configuration_item['configurationItemStatus'],
+                'configurationStateId': str(configuration_item['configurationStateId']),
+                'configurationItemMD5Hash': '',
+                'arn': configuration_item['ARN'],
+                'resourceType': resourceType,
+                'resourceId': resourceId,
+                'resourceName': resourceId,
+                'awsRegion': configuration_item['awsRegion'],
+                'configuration': json.dumps(configuration_item['configuration']),
+                'supplementaryConfiguration': {
+                    key: json.dumps(value) for (key, value) in configuration_item['supplementaryConfiguration'].items()
+                }
+            }]
+        }
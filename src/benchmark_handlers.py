@@ -0,0 +1,359 @@
+"""Author: Mark Hanegraaff -- 2021
+
+    This script benchmarks the Generic Compliance Rule and the Generic
+    Remediation Lambda Functions offline, against an in-process fake of the
+    STS, S3 and Config services (see benchmark/fake_aws.py).
+
+    No AWS account or credentials are needed, so it can be run as part of
+    a build to catch regressions in the scan and publish paths.
+
+    Each scenario is run once for every bucket count, and reports the wall
+    time, the number of resources processed and missed, the API calls made
+    by operation and the peak memory allocated while it ran.
+
+    For example:
+
+    python benchmark_handlers.py -buckets 10,1000,100000 -latency_ms 20 -capacity 200
+"""
+
+import argparse
+import json
+import logging
+import time
+import tracemalloc
+
+import boto3
+from support import logging_definition
+from benchmark.fake_aws import FakeAWS
+from state.sqlite_store import SQLiteStateStore
+from aws_connector.aws_client import CREDENTIAL_CACHE, CLIENT_POOL
+import aws_connector.s3_boto_wrapper as s3
+import aws_connector.inventory_cache as inventory_cache
+import aws_connector.rate_limiter as rate_limiter
+import compliance.modules.base_module as base_module
+import lambda_functions.generic_config_rule_handler as generic_config_rule_handler
+import lambda_functions.simple_remediation_handler as simple_remediation_handler
+
+log = logging.getLogger()
+
+AWS_ACCOUNT_ID = "999999999999"
+
+
+def scheduled_event(inventory_source: str):
+    '''
+        Returns a scheduled Config rule event
+    '''
+    return {
+        "invokingEvent": json.dumps({
+            "awsAccountId": AWS_ACCOUNT_ID,
+            "notificationCreationTime": "2021-01-13T05:00:23.319Z",
+            "messageType": "ScheduledNotification",
+            "recordVersion": "1.0"
+        }),
+        "ruleParameters": json.dumps({
+            "MasterAccountID": AWS_ACCOUNT_ID,
+            "ComplianceCommand": "S3_ENABLE_VERSIONING",
+            "InventorySource": inventory_source
+        }),
+        "resultToken": "benchmarkResultToken",
+        "eventLeftScope": False,
+        "configRuleName": "benchmark-rule",
+        "accountId": AWS_ACCOUNT_ID,
+        "version": "1.0"
+    }
+
+
+def change_event(configuration_item: dict):
+    '''
+        Returns a configuration change Config rule event for the
+        supplied configuration item. Like the events of separate rule
+        invocations, each event carries its own result token.
+    '''
+    return {
+        "invokingEvent": json.dumps({
+            "configurationItem": configuration_item,
+            "notificationCreationTime": "2021-01-13T05:00:23.352Z",
+            "messageType": "ConfigurationItemChangeNotification",
+            "recordVersion": "1.3"
+        }),
+        "ruleParameters": json.dumps({
+            "MasterAccountID": AWS_ACCOUNT_ID,
+            "ComplianceCommand": "S3_ENABLE_VERSIONING"
+        }),
+        "resultToken": "benchmarkResultToken-%s-%s" % (
+            configuration_item['resourceId'], configuration_item['configurationStateId']),
+        "eventLeftScope": False,
+        "configRuleName": "benchmark-rule",
+        "accountId": AWS_ACCOUNT_ID,
+        "version": "1.0"
+    }
+
+
+def run_scheduled_service_scan(fake_aws: FakeAWS, args: object):
+    '''
+        A scheduled evaluation reading the inventory from the S3 service.
+        Returns the number of resources expected and processed.
+    '''
+    generic_config_rule_handler.evaluate_compliance(
+        scheduled_event("SERVICE"), {})
+    return (fake_aws.bucket_count, len(fake_aws.published_evaluations))
+
+
+def run_scheduled_config_scan(fake_aws: FakeAWS, args: object):
+    '''
+        A scheduled evaluation reading the inventory from the Config service
+    '''
+    generic_config_rule_handler.evaluate_compliance(
+        scheduled_event("CONFIG"), {})
+    return (fake_aws.bucket_count, len(fake_aws.published_evaluations))
+
+
+def run_cached_service_scans(fake_aws: FakeAWS, args: object):
+    '''
+        Two scheduled evaluations reading the inventory from the S3 service,
+        the second one reading bucket attributes from the inventory cache.
+        The counters are reset after the first scan, so that the calls and
+        evaluations reported are those of the cached scan, which must not
+        read the versioning status of any bucket.
+    '''
+    cache = inventory_cache.INVENTORY_CACHE
+    (local_store, ttl_seconds) = (cache.local_store_loader, cache.ttl_seconds)
+
+    cache.local_store_loader = lambda: SQLiteStateStore(":memory:")
+    cache.ttl_seconds = 3600
+    cache.stores = None
+
+    try:
+        generic_config_rule_handler.evaluate_compliance(
+            scheduled_event("SERVICE"), {})
+        fake_aws.reset_counters()
+
+        generic_config_rule_handler.evaluate_compliance(
+            scheduled_event("SERVICE"), {})
+    finally:
+        (cache.local_store_loader, cache.ttl_seconds) = (local_store, ttl_seconds)
+        cache.stores = None
+
+    versioning_calls = fake_aws.call_counts["s3:GetBucketVersioning"]
+    if versioning_calls > 0:
+        raise AssertionError(
+            "The cached scan read the versioning status of %d bucket(s)" % versioning_calls)
+
+    return (fake_aws.bucket_count, len(fake_aws.published_evaluations))
+
+
+def run_change_events(fake_aws: FakeAWS, args: object):
+    '''
+        A sequence of configuration change events, each handled by
+        its own invocation of a warm function
+    '''
+    bucket_names = fake_aws.bucket_names[:args.events]
+
+    for bucket_name in bucket_names:
+        generic_config_rule_handler.evaluate_compliance(
+            change_event(fake_aws.configuration_item(bucket_name)), {})
+
+    return (len(bucket_names), len(fake_aws.published_evaluations))
+
+
+def run_buffered_change_events(fake_aws: FakeAWS, args: object):
+    '''
+        The change events of run_change_events, each followed by the event
+        of a newer state of the same bucket, buffered in memory and
+        evaluated together
+    '''
+    bucket_names = fake_aws.bucket_names[:args.events]
+
+    queue_type = generic_config_rule_handler.CHANGE_EVENT_QUEUE_TYPE
+    window_seconds = generic_config_rule_handler.CHANGE_EVENT_WINDOW_SECONDS
+    generic_config_rule_handler.CHANGE_EVENT_QUEUE_TYPE = "MEMORY"
+    generic_config_rule_handler.CHANGE_EVENT_WINDOW_SECONDS = 3600
+
+    try:
+        for bucket_name in bucket_names:
+            for state_offset in range(2):
+                configuration_item = fake_aws.configuration_item(bucket_name)
+                configuration_item['configurationStateId'] += state_offset
+                generic_config_rule_handler.evaluate_compliance(
+                    change_event(configuration_item), {})
+
+        generic_config_rule_handler.evaluate_buffered_compliance({}, {})
+    finally:
+        generic_config_rule_handler.CHANGE_EVENT_QUEUE_TYPE = queue_type
+        generic_config_rule_handler.CHANGE_EVENT_WINDOW_SECONDS = window_seconds
+        generic_config_rule_handler.CHANGE_EVENT_BUFFER = None
+
+    return (len(bucket_names), len(fake_aws.published_evaluations))
+
+
+def run_batch_remediation(fake_aws: FakeAWS, args: object):
+    '''
+        A batch remediation of non-compliant buckets
+    '''
+    bucket_names = fake_aws.non_compliant_bucket_names()[:args.remediations]
+
+    response = simple_remediation_handler.remediate_resource({
+        "resources": [{
+            "resourceID": bucket_name,
+            "remediationAccountID": AWS_ACCOUNT_ID,
+            "complianceCommand": "S3_ENABLE_VERSIONING"
+        } for bucket_name in bucket_names]
+    }, {})
+
+    return (len(bucket_names), response['succeeded'])
+
+
+SCENARIOS = {
+    "scheduled_service": run_scheduled_service_scan,
+    "scheduled_config": run_scheduled_config_scan,
+    "cached_rescan": run_cached_service_scans,
+    "change_events": run_change_events,
+    "buffered_changes": run_buffered_change_events,
+    "batch_remediation": run_batch_remediation
+}
+
+
+def reset_process_state():
+    '''
+        Clears the caches kept at module scope, so that each scenario
+        starts like a cold function
+    '''
+    CREDENTIAL_CACHE.clear()
+    CLIENT_POOL.clear()
+    s3.BUCKET_REGION_INDEX.clear()
+    with rate_limiter.RATE_LIMITERS_LOCK:
+        rate_limiter.RATE_LIMITERS.clear()
+    with base_module.CONFIGURATION_ITEM_CACHE_LOCK:
+        base_module.CONFIGURATION_ITEM_CACHE.clear()
+    generic_config_rule_handler.CHANGE_EVENT_CACHE = None
+    generic_config_rule_handler.CHANGE_EVENT_BUFFER = None
+
+
+def run_benchmark(scenario_name: str, bucket_count: int, args: object):
+    '''
+        Runs a scenario against a new fake inventory and returns its
+        measurements as a dictionary
+    '''
+    fake_aws = FakeAWS(bucket_count, latency_ms=args.latency_ms, throttle_rate=args.throttle_rate,
+                       capacity=args.capacity, report_bucket_region=args.report_bucket_region)
+
+    reset_process_state()
+    boto3_session = boto3.Session
+    boto3.Session = fake_aws.session
+
+    error = None
+    (expected_count, processed_count) = (0, 0)
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    try:
+        (expected_count, processed_count) = SCENARIOS[scenario_name](
+            fake_aws, args)
+    except Exception as e:
+        error = str(e)
+    finally:
+        wall_time = time.perf_counter() - start_time
+        (current_memory, peak_memory) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        boto3.Session = boto3_session
+
+    return {
+        "scenario": scenario_name,
+        "buckets": bucket_count,
+        "latency_ms": args.latency_ms,
+        "throttle_rate": args.throttle_rate,
+        "capacity": args.capacity,
+        "wall_time_seconds": round(wall_time, 3),
+        "expected": expected_count,
+        "processed": processed_count,
+        "missed": expected_count - processed_count,
+        "api_calls": sum(fake_aws.call_counts.values()),
+        "api_calls_by_operation": dict(sorted(fake_aws.call_counts.items())),
+        "throttled_calls": sum(fake_aws.throttle_counts.values()),
+        "peak_memory_mb": round(peak_memory / (1024 * 1024), 2),
+        "error": error
+    }
+
+
+def print_report(results: list):
+    '''
+        Prints the measurements of each run as a table, followed by
+        the API calls made by each run
+    '''
+    header = "%-18s %8s %10s %9s %9s %7s %9s %9s %10s" % (
+        "scenario", "buckets", "wall (s)", "expected", "processed", "missed",
+        "api calls", "throttled", "peak (MB)")
+    print(header)
+    print("-" * len(header))
+
+    for result in results:
+        print("%-18s %8d %10.3f %9d %9d %7d %9d %9d %10.2f%s" % (
+            result['scenario'], result['buckets'], result['wall_time_seconds'],
+            result['expected'], result['processed'], result['missed'],
+            result['api_calls'], result['throttled_calls'], result['peak_memory_mb'],
+            "  ERROR: %s" % result['error'] if result['error'] is not None else ""))
+
+    print("")
+    for result in results:
+        print("%s / %d buckets: %s" % (result['scenario'], result['buckets'], ", ".join(
+            ["%s=%d" % (operation, count) for (operation, count) in result['api_calls_by_operation'].items()])))
+
+
+def main():
+    """
+        Main Function for this script
+    """
+    description = """
+                Benchmarks the compliance Lambda handlers against simulated AWS services
+            """
+
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument("-buckets", help="Comma separated list of bucket counts, e.g. 10,1000,100000",
+                        type=str, default="10,1000,10000")
+    parser.add_argument("-scenarios", help="Comma separated list of scenarios: %s" % ", ".join(SCENARIOS.keys()),
+                        type=str, default=",".join(SCENARIOS.keys()))
+    parser.add_argument("-latency_ms", help="Simulated latency of each API call in milliseconds",
+                        type=float, default=10)
+    parser.add_argument("-throttle_rate", help="Fraction of API calls rejected at random with a throttling error",
+                        type=float, default=0.0)
+    parser.add_argument("-capacity", help="Calls per second accepted by each operation before it throttles",
+                        type=float, default=None)
+    parser.add_argument("-events", help="Number of change events sent by the change_events and buffered_changes scenarios",
+                        type=int, default=100)
+    parser.add_argument("-remediations", help="Maximum number of buckets remediated by the batch_remediation scenario",
+                        type=int, default=100)
+    parser.add_argument("-report_bucket_region", help="Report bucket regions in the bucket listing",
+                        action="store_true")
+    parser.add_argument("-json", help="Write the results to this file as JSON",
+                        type=str, default=None)
+    parser.add_argument("-verbose", help="Keep the handlers' informational logging",
+                        action="store_true")
+
+    args = parser.parse_args()
+
+    if not args.verbose:
+        log.setLevel(logging.WARNING)
+
+    scenario_names = [name.strip()
+                      for name in args.scenarios.split(",") if name.strip() != ""]
+    for scenario_name in scenario_names:
+        if scenario_name not in SCENARIOS:
+            parser.error("Unknown scenario: %s" % scenario_name)
+
+    bucket_counts = [int(count) for count in args.buckets.split(",")]
+
+    results = []
+    for bucket_count in bucket_counts:
+        for scenario_name in scenario_names:
+            results.append(run_benchmark(scenario_name, bucket_count, args))
+
+    print_report(results)
+
+    if args.json is not None:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
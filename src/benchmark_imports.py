@@ -0,0 +1,91 @@
+"""Author: Mark Hanegraaff -- 2021
+
+    This script measures the time taken to import each Lambda handler, which
+    is paid on every cold start, and checks it against a budget.
+
+    Each handler is imported by a new python process several times, and the
+    median time is reported along with whether boto3 was imported. The script
+    exits with an error if any handler exceeds its budget.
+
+    For example:
+
+    python benchmark_imports.py -runs 5
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+from support import logging_definition
+
+log = logging.getLogger()
+
+# The import time budget of each handler, in milliseconds
+IMPORT_TIME_BUDGETS_MS = {
+    "lambda_functions.generic_config_rule_handler": 100,
+    "lambda_functions.simple_remediation_handler": 100,
+    "lambda_functions.organization_scan_handler": 100
+}
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import %s
+import_time_ms = (time.perf_counter() - start_time) * 1000.0
+print(json.dumps({"import_time_ms": import_time_ms, "boto3_imported": "boto3" in sys.modules}))
+"""
+
+
+def measure_import(handler_module: str):
+    '''
+        Imports a handler module in a new python process and returns
+        the time it took in milliseconds, and whether boto3 was imported
+    '''
+    output = subprocess.check_output(
+        [sys.executable, "-c", IMPORT_SCRIPT % handler_module])
+    measurement = json.loads(output.decode().strip().splitlines()[-1])
+
+    return (measurement['import_time_ms'], measurement['boto3_imported'])
+
+
+def main():
+    """
+        Main Function for this script
+    """
+    description = """
+                Measures the import time of the Lambda handlers against their budget
+            """
+
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument("-runs", help="Number of times each handler is imported",
+                        type=int, default=5)
+
+    args = parser.parse_args()
+
+    over_budget = []
+
+    for (handler_module, budget_ms) in IMPORT_TIME_BUDGETS_MS.items():
+        measurements = [measure_import(handler_module)
+                        for i in range(args.runs)]
+        median_ms = statistics.median(
+            [import_time_ms for (import_time_ms, boto3_imported) in measurements])
+        boto3_imported = any(
+            [boto3_imported for (import_time_ms, boto3_imported) in measurements])
+
+        log.info("%s: %.1f ms (budget: %d ms), boto3 imported: %s",
+                 handler_module, median_ms, budget_ms, boto3_imported)
+
+        if median_ms > budget_ms:
+            over_budget.append(handler_module)
+
+    if len(over_budget) > 0:
+        log.error("The following handlers exceed their import time budget: %s",
+                  ", ".join(over_budget))
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains the evaluation record produced by compliance modules,
+and its conversion to the format accepted by the Config service.
+
+Scans may produce hundreds of thousands of evaluations, so the record uses
+slots rather than a dictionary, and compliance types and annotations are
+shared constants rather than per resource strings.
+"""
+
+import sys
+
+COMPLIANT = sys.intern("COMPLIANT")
+NON_COMPLIANT = sys.intern("NON_COMPLIANT")
+NOT_APPLICABLE = sys.intern("NOT_APPLICABLE")
+INSUFFICIENT_DATA = sys.intern("INSUFFICIENT_DATA")
+
+DELETED_ANNOTATION = "This resource was deleted."
+
+# The annotation of resources a rule does not apply to, by resource type
+NOT_APPLICABLE_ANNOTATIONS = {}
+
+
+class Evaluation():
+    '''
+        The compliance status of a single resource.
+
+        Attributes:
+            resource_type: The resource type, e.g. "AWS::S3::Bucket"
+            resource_id: The resource id, e.g. "bucketA"
+            compliance_type: One of COMPLIANT, NON_COMPLIANT, NOT_APPLICABLE
+                or INSUFFICIENT_DATA
+            annotation: A human readable explanation of the compliance type
+            ordering_timestamp: The time of the configuration change that was
+                evaluated, or None when the evaluation is published with the
+                timestamp of the event being processed
+    '''
+    __slots__ = ("resource_type", "resource_id", "compliance_type",
+                 "annotation", "ordering_timestamp")
+
+    def __init__(self, resource_type: str, resource_id: str, compliance_type: str,
+                 annotation: str, ordering_timestamp: str = None):
+        self.resource_type = resource_type
+        self.resource_id = resource_id
+        self.compliance_type = compliance_type
+        self.annotation = annotation
+        self.ordering_timestamp = ordering_timestamp
+
+    def to_config(self, ordering_timestamp: str = None):
+        '''
+            Returns the evaluation in the format accepted by the Config
+            service's put_evaluations. The evaluation's own ordering
+            timestamp takes precedence over the one supplied.
+        '''
+        return {
+            'ComplianceResourceType': self.resource_type,
+            'ComplianceResourceId': self.resource_id,
+            'ComplianceType': self.compliance_type,
+            'Annotation': self.annotation,
+            'OrderingTimestamp': self.ordering_timestamp or ordering_timestamp
+        }
+
+    def to_dict(self):
+        '''
+            Returns the evaluation as a JSON serializable dictionary, e.g.
+
+            {
+                "resource_type": "AWS::S3::Bucket",
+                "resource_id": "bucketA",
+                "compliance_type": "COMPLIANT",
+                "annotation": "Object Versioning is enabled"
+            }
+        '''
+        return {
+            "resource_type": self.resource_type,
+            "resource_id": self.resource_id,
+            "compliance_type": self.compliance_type,
+            "annotation": self.annotation
+        }
+
+    def __repr__(self):
+        return "Evaluation(%s, %s, %s)" % (self.resource_type, self.resource_id, self.compliance_type)
+
+
+def not_applicable_evaluation(resource_type: str, resource_id: str):
+    '''
+        Returns the evaluation of a resource whose type the rule does
+        not apply to
+    '''
+    annotation = NOT_APPLICABLE_ANNOTATIONS.get(resource_type, None)
+    if annotation is None:
+        annotation = "The rule doesn't apply to resources of type %s." % resource_type
+        NOT_APPLICABLE_ANNOTATIONS[resource_type] = annotation
+
+    return Evaluation(resource_type, resource_id, NOT_APPLICABLE, annotation)
+
+
+def deleted_evaluation(resource_type: str, resource_id: str):
+    '''
+        Returns the evaluation of a deleted resource
+    '''
+    return Evaluation(resource_type, resource_id, NOT_APPLICABLE, DELETED_ANNOTATION)
@@ -4,18 +4,50 @@ This module contains a small factory capable of generating appropriate
 compliance module objects based on a name
 """
 
-from exception.exceptions import NotSupportedError
-from compliance.modules.s3_versioning import S3Versioning
-from aws_connector.aws_client import AWSClient
+from compliance import registry
+from compliance.module_group import ComplianceModuleGroup
+from aws_connector.aws_client import LazyAWSClient
 
 
-def load_compliance_module(module_name: str, assume_role_name: str, aws_account_id: str):
+def load_compliance_module(module_name: str, assume_role_name: str, aws_account_id: str,
+                           inventory_source: str = "SERVICE", aws_client_object: object = None):
     '''
         Returns the appropriate compliance module module given
         the module name. If one cannot be found, raise a NotSupported error
+
+        Modules are looked up in the module registry, and only the module
+        implementing the command is imported.
+
+        The module's AWS session is created the first time the module
+        requests a boto client, so no assume-role operation takes place for
+        events that can be evaluated without calling AWS.
+
+        'inventory_source' selects where scheduled evaluations read the
+        resource inventory from. See BaseComplianceModule.INVENTORY_SOURCES
+
+        An 'aws_client_object' may be supplied to share an AWS session
+        between several modules targeting the same account.
     '''
+    compliance_module_class = registry.get_module_class(module_name)
+
+    if aws_client_object is None:
+        aws_client_object = LazyAWSClient(assume_role_name)
+
+    return compliance_module_class(aws_client_object, aws_account_id, inventory_source)
+
+
+def load_compliance_module_group(module_names: list, assume_role_name: str, aws_account_id: str,
+                                 inventory_source: str = "SERVICE"):
+    '''
+        Returns a compliance module group that evaluates the supplied modules
+        over a shared inventory. All modules share the same AWS session, so
+        at most one assume-role operation takes place.
+    '''
+    aws_client_object = LazyAWSClient(assume_role_name)
+
+    compliance_modules = []
+    for module_name in module_names:
+        compliance_modules.append(load_compliance_module(
+            module_name, assume_role_name, aws_account_id, inventory_source, aws_client_object))
 
-    if module_name == "S3_ENABLE_VERSIONING":
-        return S3Versioning(AWSClient(assume_role_name), aws_account_id)
-    else:
-        raise NotSupportedError
+    return ComplianceModuleGroup(compliance_modules)
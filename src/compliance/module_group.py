@@ -0,0 +1,226 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a compliance module group, which evaluates several
+compliance modules targeting the same resource type in a single pass over
+a shared inventory.
+"""
+
+import logging
+from support import logging_definition
+from support.logging_definition import RESOURCE_LOG, SUMMARY
+from support.concurrency import bounded_map
+from exception.exceptions import ValidationError
+from aws_connector.aws_client import MAX_POOL_CONNECTIONS
+from compliance.evaluation import Evaluation, COMPLIANT, NON_COMPLIANT, NOT_APPLICABLE, INSUFFICIENT_DATA
+
+log = logging.getLogger()
+
+
+class ComplianceModuleGroup():
+    '''
+        Evaluates a list of compliance modules that target the same resource
+        type. The resource inventory is read once and every module's rules are
+        applied to each resource.
+
+        A Config rule reports a single evaluation per resource, so the
+        evaluations produced by each module are combined: a resource is
+        NON_COMPLIANT if any module finds it non-compliant, and the
+        annotation lists the modules that produced that result. A group of
+        one module behaves exactly like the module itself.
+    '''
+
+    # The maximum length of an evaluation annotation accepted by Config
+    MAX_ANNOTATION_LENGTH = 256
+
+    # When combining evaluations, the first compliance type found in
+    # this list is reported
+    COMPLIANCE_PRECEDENCE = [NON_COMPLIANT,
+                             INSUFFICIENT_DATA, COMPLIANT, NOT_APPLICABLE]
+
+    def __init__(self, compliance_modules: list, max_workers: int = MAX_POOL_CONNECTIONS):
+        if len(compliance_modules) == 0:
+            raise ValidationError(
+                "A compliance module group requires at least one module", None)
+
+        applicable_resources = set(
+            [module.APPLICABLE_RESOURCE for module in compliance_modules])
+        if len(applicable_resources) > 1:
+            raise ValidationError("Grouped compliance modules must target the same resource type, found: %s" %
+                                  ", ".join(sorted(applicable_resources)), None)
+
+        self.compliance_modules = compliance_modules
+        self.max_workers = max_workers
+
+        # all modules are loaded with the same inventory source
+        self.inventory_source = compliance_modules[0].inventory_source
+        self.APPLICABLE_RESOURCE = compliance_modules[0].APPLICABLE_RESOURCE
+
+        self.scan_failed_resource_ids = []
+
+    @property
+    def failed_resource_ids(self):
+        '''
+            The ids of the resources the last scan could not evaluate
+        '''
+        if len(self.compliance_modules) == 1:
+            return self.compliance_modules[0].failed_resource_ids
+        return self.scan_failed_resource_ids
+
+    def set_max_workers(self, max_workers: int):
+        '''
+            Sets the number of concurrent calls made when scanning resources,
+            for the group and each of its modules
+        '''
+        self.max_workers = max_workers
+        for module in self.compliance_modules:
+            module.max_workers = max_workers
+
+    def evaluate_compliance_all(self, start_after: str = None):
+        '''
+            Evaluates the compliance of all resources covered by the group's
+            modules, yielding one combined evaluation per resource. When
+            'start_after' is supplied, only the resources whose id sorts
+            after it are evaluated.
+        '''
+        if len(self.compliance_modules) == 1:
+            yield from self.compliance_modules[0].evaluate_compliance_all(start_after)
+            return
+
+        first_module = self.compliance_modules[0]
+
+        if self.inventory_source == first_module.INVENTORY_SOURCE_CONFIG:
+            yield from self.evaluate_compliance_config_inventory(start_after)
+            return
+
+        self.scan_failed_resource_ids = []
+
+        try:
+            for (resource_id, results, exception) in bounded_map(
+                    self.evaluate_compliance_resource_id, first_module.list_resource_ids(start_after), self.max_workers):
+                if exception is not None:
+                    # failures are recorded as they occur, since a scan
+                    # stopped at its deadline does not run to the end
+                    self.scan_failed_resource_ids.append(resource_id)
+                    SUMMARY.record_failure(resource_id, exception)
+                    RESOURCE_LOG.warning("%s -> %s", resource_id, exception)
+                    continue
+
+                yield results[0]
+        finally:
+            if len(self.scan_failed_resource_ids) > 0:
+                log.warning("%d resource(s) could not be evaluated because of an AWS Error",
+                            len(self.scan_failed_resource_ids))
+
+    def scan_resumable(self):
+        '''
+            Returns True if evaluate_compliance_all yields evaluations in
+            ascending order of resource id. The resources of a group are
+            listed by its first module.
+        '''
+        first_module = self.compliance_modules[0]
+
+        if len(self.compliance_modules) == 1 or self.inventory_source == first_module.INVENTORY_SOURCE_SERVICE:
+            return first_module.scan_resumable()
+        return False
+
+    def evaluate_compliance_config_inventory(self, start_after: str = None):
+        '''
+            Reads the inventory from the Config service with a single query
+            selecting the fields needed by all modules, and evaluates each
+            item with every module.
+        '''
+        first_module = self.compliance_modules[0]
+
+        inventory_fields = []
+        for module in self.compliance_modules:
+            for field in module.CONFIG_INVENTORY_FIELDS:
+                if field not in inventory_fields:
+                    inventory_fields.append(field)
+
+        for configuration_item in first_module.get_config_inventory(inventory_fields):
+            if configuration_item.get('configurationItemStatus', '') in first_module.DELETED_ITEM_STATUSES:
+                continue
+            if start_after is not None and configuration_item['resourceId'] <= start_after:
+                continue
+
+            yield self.evaluate_compliance_resource(configuration_item)[0]
+
+    def evaluate_compliance_resource(self, configuration_item: dict):
+        '''
+            Evaluates a configuration item with every module and returns
+            the combined evaluation as a list of one element.
+        '''
+        results = []
+        for module in self.compliance_modules:
+            for evaluation in module.evaluate_compliance_resource(configuration_item):
+                results.append((module.MODULE_NAME, evaluation))
+
+        return [self.combine_evaluations(results)]
+
+    def evaluate_compliance_resources(self, configuration_items: list):
+        '''
+            Evaluates a list of configuration items with every module, using
+            each module's batch evaluation, and returns one combined
+            evaluation per resource.
+        '''
+        if len(self.compliance_modules) == 1:
+            return self.compliance_modules[0].evaluate_compliance_resources(configuration_items)
+
+        resource_results = {}
+        for module in self.compliance_modules:
+            for evaluation in module.evaluate_compliance_resources(configuration_items):
+                resource_key = (
+                    evaluation.resource_type, evaluation.resource_id)
+                resource_results.setdefault(resource_key, []).append(
+                    (module.MODULE_NAME, evaluation))
+
+        return [self.combine_evaluations(results) for results in resource_results.values()]
+
+    def evaluate_compliance_resource_id(self, resource_id: str):
+        '''
+            Evaluates a resource given its id with every module, and returns
+            the combined evaluation as a list of one element.
+        '''
+        results = []
+        for module in self.compliance_modules:
+            for evaluation in module.evaluate_compliance_resource_id(resource_id):
+                results.append((module.MODULE_NAME, evaluation))
+
+        return [self.combine_evaluations(results)]
+
+    def get_configuration_item(self, configuration_item_summary: dict):
+        '''
+            Returns the full configuration item described by the summary
+            of an oversized configuration change notification.
+            See BaseComplianceModule.get_configuration_item
+        '''
+        return self.compliance_modules[0].get_configuration_item(configuration_item_summary)
+
+    def combine_evaluations(self, module_evaluations: list):
+        '''
+            Combines the evaluations produced by each module for the same
+            resource, supplied as (module_name, evaluation) tuples, into
+            a single evaluation.
+        '''
+        evaluations = [evaluation for (module_name, evaluation) in module_evaluations]
+
+        if len(evaluations) == 1:
+            return evaluations[0]
+
+        compliance_types = [evaluation.compliance_type
+                            for evaluation in evaluations]
+        compliance_type = None
+        for candidate in self.COMPLIANCE_PRECEDENCE:
+            if candidate in compliance_types:
+                compliance_type = candidate
+                break
+
+        annotation = "; ".join(["%s: %s" % (module_name, evaluation.annotation)
+                                for (module_name, evaluation) in module_evaluations
+                                if evaluation.compliance_type == compliance_type])
+
+        if len(annotation) > self.MAX_ANNOTATION_LENGTH:
+            annotation = annotation[:self.MAX_ANNOTATION_LENGTH - 3] + "..."
+
+        return Evaluation(evaluations[0].resource_type, evaluations[0].resource_id,
+                          compliance_type, annotation)
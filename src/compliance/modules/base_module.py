@@ -1,13 +1,27 @@
 """Author: Mark Hanegraaff -- 2021
 """
 from abc import ABC, abstractmethod
-from aws_connector.aws_client import AWSClient
+from aws_connector.aws_client import AWSClient, MAX_POOL_CONNECTIONS
+from exception.exceptions import ValidationError, NotSupportedError
+import aws_connector.config_boto_wrapper as config
+from support.concurrency import chunked
+from compliance.rules.rule_engine import ColumnarInventory, evaluate_rules
 
 import logging
+import threading
+from collections import OrderedDict
 from support import logging_definition
+from support.logging_definition import RESOURCE_LOG
 
 log = logging.getLogger()
 
+# Configuration items read from the Config history, keyed by (account id,
+# resource type, resource id, configuration state id), and kept for the life
+# of the container so that redelivered notifications are not read twice
+CONFIGURATION_ITEM_CACHE = OrderedDict()
+CONFIGURATION_ITEM_CACHE_SIZE = 256
+CONFIGURATION_ITEM_CACHE_LOCK = threading.Lock()
+
 
 class BaseComplianceModule(ABC):
     '''
@@ -22,6 +36,23 @@ class BaseComplianceModule(ABC):
                 the "ComplianceCommand" supplied to the corresponding Config Rule 
                 and SSM Documents.
             DESCRIPTION: A description of this module
+            CONFIG_INVENTORY_FIELDS: The configuration item fields needed
+                to evaluate a resource, when the inventory is read from
+                the Config service. For example
+                "supplementaryConfiguration.BucketVersioningConfiguration"
+            INVENTORY_SOURCES: The supported inventory sources for scheduled
+                evaluations. "SERVICE" reads resources from the service API
+                that owns them, while "CONFIG" reads them from the Config
+                service using an advanced query.
+            RULES: The table of rules applied by the module, see
+                compliance.rules.rule_engine.Rule
+            ATTRIBUTE_PATHS: Maps the attribute of each rule to the dot
+                separated path of its value within a configuration item, e.g.
+                {"versioning_status": "supplementaryConfiguration.BucketVersioningConfiguration.status"}
+            SERVICE_ATTRIBUTE_READERS: Maps the attribute of each rule to a
+                function reading its value from the service API that owns the
+                resource, given a client and a resource id, e.g.
+                {"versioning_status": s3_boto_wrapper.get_bucket_versioning}
 
     '''
     # The resource type targeted by the detective module "AWS::S3::Bucket"
@@ -31,20 +62,57 @@ class BaseComplianceModule(ABC):
     # A human readable description of what the mdoule does
     DESCRIPTION = ""
 
-    def __init__(self, aws_client_object: object, aws_account_id: str):
+    CONFIG_INVENTORY_FIELDS = []
+
+    RULES = []
+    ATTRIBUTE_PATHS = {}
+    SERVICE_ATTRIBUTE_READERS = {}
+
+    # The number of configuration items evaluated at once by the rule engine
+    RULE_EVALUATION_BATCH_SIZE = 1000
+
+    # The number of resources scanned from a service API that are evaluated
+    # at once by the rule engine, kept small so that evaluations are
+    # published while the scan is still running
+    SCAN_EVALUATION_BATCH_SIZE = 100
+
+    INVENTORY_SOURCE_SERVICE = "SERVICE"
+    INVENTORY_SOURCE_CONFIG = "CONFIG"
+    INVENTORY_SOURCES = [INVENTORY_SOURCE_SERVICE, INVENTORY_SOURCE_CONFIG]
+
+    # Configuration items in these states are not evaluated by scheduled runs
+    DELETED_ITEM_STATUSES = ['ResourceDeleted',
+                             'ResourceDeletedNotRecorded', 'ResourceNotRecorded']
+
+    def __init__(self, aws_client_object: object, aws_account_id: str,
+                 inventory_source: str = INVENTORY_SOURCE_SERVICE):
+        if inventory_source not in self.INVENTORY_SOURCES:
+            raise ValidationError(
+                "Invalid inventory source: %s" % inventory_source, None)
+
         self.aws_client_object = aws_client_object
         self.aws_account_id = aws_account_id
-        log.info("Initalized compliance module: %s targeting AWS Account ID: %s" % (
-            self.MODULE_NAME, self.aws_account_id))
-        log.info("Module description: %s" % self.DESCRIPTION)
-        log.info("Applicable Resource: %s" % self.APPLICABLE_RESOURCE)
+        self.inventory_source = inventory_source
+
+        # the number of concurrent calls made when scanning resources
+        self.max_workers = MAX_POOL_CONNECTIONS
+
+        # the ids of the resources the last scan could not evaluate
+        self.failed_resource_ids = []
+        log.info("Initalized compliance module: %s targeting AWS Account ID: %s, Applicable Resource: %s",
+                 self.MODULE_NAME, self.aws_account_id, self.APPLICABLE_RESOURCE)
 
     @abstractmethod
-    def evaluate_compliance_all(self):
+    def evaluate_compliance_all(self, start_after: str = None):
         '''
             Evaluate the compliance of all resources that are covered by this
             rule. This method must be called when the AWS Config rule is triggered
-            on a schedule.
+            on a schedule. When 'start_after' is supplied, only the resources
+            whose id sorts after it are evaluated.
+
+            Returns an iterable of evaluations. Implementations should be
+            generators that yield each evaluation as soon as it is available,
+            so that evaluations can be published while the scan is running.
         '''
         pass
 
@@ -65,6 +133,225 @@ class BaseComplianceModule(ABC):
         '''
         pass
 
+    def scan_resumable(self):
+        '''
+            Returns True if evaluate_compliance_all yields evaluations in
+            ascending order of resource id, so that a scan interrupted after
+            a resource can be resumed by passing its id as 'start_after'
+        '''
+        return False
+
+    def list_resource_ids(self, start_after: str = None):
+        '''
+            Yields the ids of all resources covered by this module, using the
+            service API that owns them, skipping the ids that do not sort
+            after 'start_after' when it is supplied. Modules that implement
+            this method and evaluate_compliance_resource_id can be evaluated
+            together with other modules over a shared inventory.
+        '''
+        raise NotSupportedError(
+            "%s does not support listing resources" % self.MODULE_NAME, None)
+
+    def evaluate_compliance_resource_id(self, resource_id: str):
+        '''
+            Evaluates the compliance of a single resource given its id, by
+            reading the resource's configuration from the service API that
+            owns it.
+        '''
+        raise NotSupportedError(
+            "%s does not support evaluating resources by id" % self.MODULE_NAME, None)
+
+    def get_config_inventory(self, inventory_fields: list = None):
+        '''
+            Yields the configuration items of all resources covered by this
+            module, as recorded by the Config service. Each item contains
+            the resource id, type and status, plus the fields listed in
+            'inventory_fields', which defaults to CONFIG_INVENTORY_FIELDS.
+
+            The inventory is read with a paginated advanced query, which
+            costs one call per page of results rather than one per resource.
+        '''
+        if inventory_fields is None:
+            inventory_fields = self.CONFIG_INVENTORY_FIELDS
+
+        fields = ["resourceId", "resourceType",
+                  "configurationItemStatus"] + inventory_fields
+
+        expression = "SELECT %s WHERE resourceType = '%s'" % (
+            ", ".join(fields), self.APPLICABLE_RESOURCE)
+
+        return config.iterate_resource_config(
+            self.aws_client_object.get_boto_client('config'), expression)
+
+    def evaluate_compliance_config_inventory(self, start_after: str = None):
+        '''
+            Evaluates the compliance of all resources covered by this module,
+            using the inventory recorded by the Config service. When
+            'start_after' is supplied, only the resources whose id sorts
+            after it are evaluated.
+
+            Modules declaring a rule table have their items evaluated in
+            batches of RULE_EVALUATION_BATCH_SIZE by the rule engine. Other
+            modules have each item evaluated with evaluate_compliance_resource.
+        '''
+        configuration_items = (configuration_item for configuration_item in self.get_config_inventory()
+                               if configuration_item.get('configurationItemStatus', '') not in self.DELETED_ITEM_STATUSES
+                               and (start_after is None or configuration_item['resourceId'] > start_after))
+
+        if len(self.RULES) == 0:
+            for configuration_item in configuration_items:
+                yield from self.evaluate_compliance_resource(configuration_item)
+            return
+
+        for batch in chunked(configuration_items, self.RULE_EVALUATION_BATCH_SIZE):
+            yield from self.evaluate_configuration_items(batch)
+
+    def evaluate_compliance_resources(self, configuration_items: list):
+        '''
+            Evaluates the compliance of a list of configuration items, for
+            example the items of several configuration change events, and
+            returns a list of evaluations.
+
+            Modules declaring a rule table have all applicable items that
+            carry the rule attributes evaluated at once by the rule engine.
+            Other items are evaluated with evaluate_compliance_resource.
+        '''
+        evaluations = []
+        rule_items = []
+
+        for configuration_item in configuration_items:
+            if self.rule_attributes_available(configuration_item):
+                rule_items.append(configuration_item)
+            else:
+                evaluations.extend(
+                    self.evaluate_compliance_resource(configuration_item))
+
+        if len(rule_items) > 0:
+            evaluations.extend(self.evaluate_configuration_items(rule_items))
+
+        return evaluations
+
+    def rule_attributes_available(self, configuration_item: dict):
+        '''
+            Returns True if the configuration item can be evaluated by the
+            module's rule table, because it is applicable to the module and
+            contains the documents holding the rule attributes
+        '''
+        if len(self.RULES) == 0 or not self.config_item_resource_applicable(configuration_item):
+            return False
+
+        for attribute_path in self.ATTRIBUTE_PATHS.values():
+            if attribute_path.split(".")[0] not in configuration_item:
+                return False
+
+        return True
+
+    def rule_attributes(self):
+        '''
+            Returns the names of the attributes the module's rules apply
+            to, in rule table order
+        '''
+        attributes = []
+        for rule in self.RULES:
+            if rule.attribute not in attributes:
+                attributes.append(rule.attribute)
+
+        return attributes
+
+    def service_attribute_readers(self):
+        '''
+            Returns the functions reading the attributes of the module's
+            rules from the service API, see SERVICE_ATTRIBUTE_READERS
+        '''
+        try:
+            return {attribute: self.SERVICE_ATTRIBUTE_READERS[attribute]
+                    for attribute in self.rule_attributes()}
+        except KeyError as e:
+            raise NotSupportedError(
+                "%s cannot read attribute %s from the service API" % (self.MODULE_NAME, e), None)
+
+    def evaluate_resource_attributes(self, resource_attributes: list):
+        '''
+            Applies the module's rule table to a list of (resource id,
+            attributes) tuples, where attributes is a dictionary holding the
+            value of each rule attribute, and returns one evaluation per
+            resource, in the same order.
+        '''
+        inventory = ColumnarInventory(
+            self.APPLICABLE_RESOURCE,
+            [resource_id for (resource_id, attributes) in resource_attributes],
+            {attribute: [attributes[attribute] for (resource_id, attributes) in resource_attributes]
+             for attribute in self.rule_attributes()})
+
+        return self.evaluate_inventory(inventory)
+
+    def evaluate_configuration_items(self, configuration_items: list):
+        '''
+            Applies the module's rule table to a list of configuration items
+            and returns one evaluation per item, in the same order.
+        '''
+        inventory = ColumnarInventory.from_configuration_items(
+            self.APPLICABLE_RESOURCE, configuration_items, self.ATTRIBUTE_PATHS)
+
+        return self.evaluate_inventory(inventory)
+
+    def evaluate_inventory(self, inventory: ColumnarInventory):
+        '''
+            Applies the module's rule table to a columnar inventory and
+            returns one evaluation per resource, in inventory order.
+        '''
+        evaluations = evaluate_rules(self.RULES, inventory)
+
+        for evaluation in evaluations:
+            RESOURCE_LOG.info("%s - %s -> %s", evaluation.resource_id,
+                              self.MODULE_NAME, evaluation.compliance_type)
+
+        return evaluations
+
+    def get_configuration_item(self, configuration_item_summary: dict):
+        '''
+            Returns the full configuration item described by the summary
+            included in an oversized configuration change notification, by
+            reading the latest item from the Config history.
+
+            Returns None if the history does not yet contain the state
+            described by the summary.
+        '''
+        cache_key = (self.aws_account_id, configuration_item_summary['resourceType'],
+                     configuration_item_summary['resourceId'],
+                     str(configuration_item_summary.get('configurationStateId', '')))
+
+        with CONFIGURATION_ITEM_CACHE_LOCK:
+            if cache_key in CONFIGURATION_ITEM_CACHE:
+                CONFIGURATION_ITEM_CACHE.move_to_end(cache_key)
+                return CONFIGURATION_ITEM_CACHE[cache_key]
+
+        configuration_item = config.get_latest_configuration_item(
+            self.aws_client_object.get_boto_client('config'),
+            configuration_item_summary['resourceType'],
+            configuration_item_summary['resourceId'])
+
+        if configuration_item is None:
+            return None
+
+        # the history is eventually consistent, and may not include the
+        # change yet
+        try:
+            if int(configuration_item['configurationStateId']) < \
+                    int(configuration_item_summary['configurationStateId']):
+                log.info("The configuration history of %s does not include state: %s yet",
+                         configuration_item_summary['resourceId'], configuration_item_summary['configurationStateId'])
+                return None
+        except (KeyError, TypeError, ValueError):
+            pass
+
+        with CONFIGURATION_ITEM_CACHE_LOCK:
+            CONFIGURATION_ITEM_CACHE[cache_key] = configuration_item
+            while len(CONFIGURATION_ITEM_CACHE) > CONFIGURATION_ITEM_CACHE_SIZE:
+                CONFIGURATION_ITEM_CACHE.popitem(last=False)
+
+        return configuration_item
+
     def config_item_resource_applicable(self, configuration_item: dict):
         '''
             Returns True if the configuration item resource type matches that
@@ -3,10 +3,14 @@
 
 import logging
 from support import logging_definition
+from support.logging_definition import RESOURCE_LOG, SUMMARY
 from exception.exceptions import NotSupportedError, ValidationError
 from compliance.modules.base_module import BaseComplianceModule
+from compliance.evaluation import not_applicable_evaluation
 import compliance.rules.s3_rules as s3_rules
 import aws_connector.s3_boto_wrapper as s3
+from support.concurrency import chunked
+from aws_connector.inventory_cache import INVENTORY_CACHE
 log = logging.getLogger()
 
 
@@ -20,49 +24,65 @@ class S3Versioning(BaseComplianceModule):
     APPLICABLE_RESOURCE = "AWS::S3::Bucket"
     MODULE_NAME = "S3_ENABLE_VERSIONING"
     DESCRIPTION = "Module that checks if S3 Versioning is enabled"
-
-    def __init__(self, aws_client_object: object, aws_account_id: str):
-        super().__init__(aws_client_object, aws_account_id)
-
-    def evaluate_compliance_all(self):
+    CONFIG_INVENTORY_FIELDS = [
+        "supplementaryConfiguration.BucketVersioningConfiguration"]
+
+    RULES = [s3_rules.VERSIONING_ENABLED]
+    ATTRIBUTE_PATHS = {
+        "versioning_status": "supplementaryConfiguration.BucketVersioningConfiguration.status"
+    }
+    SERVICE_ATTRIBUTE_READERS = {
+        "versioning_status": s3.get_bucket_versioning
+    }
+
+    def __init__(self, aws_client_object: object, aws_account_id: str,
+                 inventory_source: str = BaseComplianceModule.INVENTORY_SOURCE_SERVICE):
+        super().__init__(aws_client_object, aws_account_id, inventory_source)
+
+    def evaluate_compliance_all(self, start_after: str = None):
         '''
-            Evaluate the compliance of all available S3 buckets
+            Evaluate the compliance of all available S3 buckets. Evaluations
+            are yielded as soon as each bucket is scanned, in bucket name
+            order when the buckets are listed by the S3 service.
         '''
-        log.info("Evaluating the compliance rule for applicable resources: %s" %
+        log.info("Evaluating the compliance rule for applicable resources: %s",
                  self.APPLICABLE_RESOURCE)
 
-        (versioning_dict, exception_dict) = s3.get_all_bucket_versioning_configuration(
-            self.aws_client_object.get_boto_client('s3'))
-
-        evaluations = []
-
-        for bucket_name in versioning_dict.keys():
-            if s3_rules.versioning_enabled(versioning_dict[bucket_name]):
-                log.info("%s - %s -> %s" %
-                         (bucket_name, self.MODULE_NAME, "COMPLIANT"))
-                evaluations.append({
-                    "resource_type": self.APPLICABLE_RESOURCE,
-                    "resource_id": bucket_name,
-                    "compliance_type": "COMPLIANT",
-                    "annotation": "Object Versioning is enabled"
-                })
-            else:
-                log.info("%s - %s -> %s" %
-                         (bucket_name, self.MODULE_NAME, "NON_COMPLIANT"))
-                evaluations.append({
-                    "resource_type": self.APPLICABLE_RESOURCE,
-                    "resource_id": bucket_name,
-                    "compliance_type": "NON_COMPLIANT",
-                    "annotation": "Object Versioning is not enabled"
-                })
-
-        log.warning(
-            "The following S3 bukets could not be evaluated because of an AWS Error")
-        for bucket_name in exception_dict.keys():
-            log.warning("%s - %s -> %s" % (bucket_name,
-                                           self.MODULE_NAME, exception_dict[bucket_name]))
-
-        return evaluations
+        if self.inventory_source == self.INVENTORY_SOURCE_CONFIG:
+            yield from self.evaluate_compliance_config_inventory(start_after)
+            return
+
+        self.failed_resource_ids = []
+        snapshot = INVENTORY_CACHE.snapshot(
+            self.aws_account_id, self.APPLICABLE_RESOURCE)
+
+        def scanned_buckets():
+            for (bucket_name, attributes, exception) in s3.iterate_bucket_attributes(
+                    self.aws_client_object.get_boto_client('s3'),
+                    self.service_attribute_readers(),
+                    max_workers=self.max_workers,
+                    regional_client=self.get_regional_s3_client,
+                    start_after=start_after,
+                    snapshot=snapshot):
+                if exception is not None:
+                    # failures are recorded as they occur, since a scan
+                    # stopped at its deadline does not run to the end
+                    self.failed_resource_ids.append(bucket_name)
+                    SUMMARY.record_failure(bucket_name, exception)
+                    RESOURCE_LOG.warning("%s - %s -> %s", bucket_name,
+                                         self.MODULE_NAME, exception)
+                    continue
+                yield (bucket_name, attributes)
+
+        # buckets are evaluated in small batches, so that evaluations are
+        # still published while the scan is running
+        try:
+            for batch in chunked(scanned_buckets(), self.SCAN_EVALUATION_BATCH_SIZE):
+                yield from self.evaluate_resource_attributes(batch)
+        finally:
+            if len(self.failed_resource_ids) > 0:
+                log.warning("%d S3 bucket(s) could not be evaluated because of an AWS Error",
+                            len(self.failed_resource_ids))
 
     def evaluate_compliance_resource(self, configuration_item: dict):
         '''
@@ -71,48 +91,43 @@ class S3Versioning(BaseComplianceModule):
         '''
         bucket_name = configuration_item['resourceId']
 
-        log.info(
-            "Checking if versioning in enabled for the S3 Bucket: %s" % bucket_name)
+        RESOURCE_LOG.info(
+            "Checking if versioning in enabled for the S3 Bucket: %s", bucket_name)
 
         if self.config_item_resource_applicable(configuration_item) == False:
-            log.info("This even is not applicable for this module's resource type: " %
-                     self.APPLICABLE_RESOURCE)
-            return [{
-                "resource_type": configuration_item['resourceType'],
-                "resource_id": bucket_name,
-                "compliance_type": "NOT_APPLICABLE",
-                "annotation": "The rule doesn't apply to resources of type "
-                    + configuration_item["resourceType"] + "."
-                    }]
+            RESOURCE_LOG.info("This even is not applicable for this module's resource type: %s",
+                              self.APPLICABLE_RESOURCE)
+            return [not_applicable_evaluation(configuration_item['resourceType'], bucket_name)]
 
-        try:
-            supplementary_config = configuration_item[
-                'supplementaryConfiguration']
-        except Exception as e:
+        if 'supplementaryConfiguration' not in configuration_item:
             raise ValidationError(
-                "Count not extract S3 supplementary configuration from event", e)
-
-        versioning_flag = supplementary_config.get(
-            "BucketVersioningConfiguration", {}).get('status', None)
-
-        if s3_rules.versioning_enabled(versioning_flag) == True:
-            log.info("%s - %s -> %s" %
-                     (bucket_name, self.MODULE_NAME, "COMPLIANT"))
-            return [{
-                "resource_type": configuration_item['resourceType'],
-                "resource_id": bucket_name,
-                "compliance_type": "COMPLIANT",
-                "annotation": "Object Versioning is enabled"
-            }]
-        else:
-            log.info("%s - %s -> %s" %
-                     (bucket_name, self.MODULE_NAME, "NON_COMPLIANT"))
-            return [{
-                "resource_type": configuration_item['resourceType'],
-                "resource_id": bucket_name,
-                "compliance_type": "NON_COMPLIANT",
-                "annotation": "Object Versioning is not enabled"
-            }]
+                "Count not extract S3 supplementary configuration from event", None)
+
+        return self.evaluate_configuration_items([configuration_item])
+
+    def scan_resumable(self):
+        '''
+            Buckets listed by the S3 service are sorted by name, while the
+            order of the Config inventory is not defined
+        '''
+        return self.inventory_source == self.INVENTORY_SOURCE_SERVICE
+
+    def list_resource_ids(self, start_after: str = None):
+        '''
+            Yields the names of all S3 buckets, in name order
+        '''
+        return s3.iterate_buckets(self.aws_client_object.get_boto_client('s3'), start_after)
+
+    def evaluate_compliance_resource_id(self, resource_id: str):
+        '''
+            Evaluates the compliance of a single S3 bucket by reading its
+            attributes from the S3 service
+        '''
+        (region_name, attributes) = s3.get_bucket_attributes(
+            self.aws_client_object.get_boto_client('s3'), resource_id,
+            self.service_attribute_readers(), self.get_regional_s3_client)
+
+        return self.evaluate_resource_attributes([(resource_id, attributes)])
 
     def remediate_resource(self, resource_id: str):
         '''
@@ -121,6 +136,26 @@ class S3Versioning(BaseComplianceModule):
 
         boto_s3_client = self.aws_client_object.get_boto_client('s3')
 
-        log.info("Remediating: %s : %s : %s" %
-                 (self.APPLICABLE_RESOURCE, resource_id, self.MODULE_NAME))
-        s3.enable_versioning(boto_s3_client, resource_id)
+        RESOURCE_LOG.info("Remediating: %s : %s : %s",
+                          self.APPLICABLE_RESOURCE, resource_id, self.MODULE_NAME)
+
+        attributes = INVENTORY_CACHE.get_attributes(
+            self.aws_account_id, self.APPLICABLE_RESOURCE, resource_id)
+        if attributes is not None and attributes['region'] is not None:
+            region_name = attributes['region']
+        else:
+            region_name = s3.get_bucket_region(boto_s3_client, resource_id)
+
+        s3.enable_versioning(
+            self.get_regional_s3_client(region_name), resource_id)
+
+        # the cached versioning status no longer applies
+        INVENTORY_CACHE.invalidate(
+            self.aws_account_id, self.APPLICABLE_RESOURCE, resource_id)
+
+    def get_regional_s3_client(self, region_name: str):
+        '''
+            Returns the S3 client used for buckets located in the
+            supplied region
+        '''
+        return self.aws_client_object.get_boto_client('s3', region_name)
@@ -0,0 +1,119 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a driver that evaluates compliance commands across
+many member accounts concurrently.
+"""
+
+import json
+import logging
+from support import logging_definition
+from support.concurrency import bounded_map
+from aws_connector.config_boto_wrapper import chunk_evaluations
+from compliance import factory
+
+log = logging.getLogger()
+
+# The default number of accounts scanned at the same time
+ACCOUNT_CONCURRENCY = 10
+
+# The default number of AWS calls in-flight at the same time, across
+# all accounts
+TOTAL_CONCURRENCY = 100
+
+
+def execution_role_arn(aws_account_id: str):
+    '''
+        Returns the arn of the role assumed to evaluate resources
+        in the supplied account
+    '''
+    return 'arn:aws:iam::%s:role/role-compliance-generic-rule' % aws_account_id
+
+
+def log_evaluations(aws_account_id: str, evaluations: list):
+    '''
+        The default publisher. Writes each evaluation to the log as a JSON
+        audit event, which can be ingested by a log analytics system.
+    '''
+    # audit events are never sampled, but are only serialized when
+    # they are written
+    if not log.isEnabledFor(logging.INFO):
+        return
+
+    for evaluation in evaluations:
+        log.info("AUDIT %s", json.dumps(
+            dict(evaluation.to_dict(), aws_account_id=aws_account_id)))
+
+
+def scan_accounts(account_ids: list, compliance_commands: list, inventory_source: str = "SERVICE",
+                  publisher: object = log_evaluations, max_concurrent_accounts: int = ACCOUNT_CONCURRENCY,
+                  max_concurrent_calls: int = TOTAL_CONCURRENCY):
+    '''
+        Evaluates the supplied compliance commands in every account and
+        returns a summary of each account's evaluation, e.g.
+
+        [
+            {
+                "accountID": "999999999999",
+                "status": "SUCCEEDED",
+                "evaluated": 10,
+                "complianceTypes": {"COMPLIANT": 8, "NON_COMPLIANT": 2}
+            },
+            {
+                "accountID": "888888888888",
+                "status": "FAILED",
+                "error": "..."
+            }
+        ]
+
+        At most 'max_concurrent_accounts' accounts are scanned at once, and
+        the 'max_concurrent_calls' budget is divided between them, which
+        caps the number of concurrent calls made within each account.
+
+        Evaluations are streamed to the 'publisher' function in batches as
+        each account is scanned. It is called with the account id and a list
+        of evaluations, possibly from several threads at once.
+    '''
+    per_account_workers = max(
+        1, max_concurrent_calls // max(1, max_concurrent_accounts))
+
+    def scan_account(aws_account_id: str):
+        compliance_module = factory.load_compliance_module_group(
+            compliance_commands, execution_role_arn(aws_account_id), aws_account_id, inventory_source)
+        compliance_module.set_max_workers(per_account_workers)
+
+        compliance_types = {}
+        evaluated_count = 0
+
+        for batch in chunk_evaluations(compliance_module.evaluate_compliance_all()):
+            for evaluation in batch:
+                compliance_types[evaluation.compliance_type] = compliance_types.get(
+                    evaluation.compliance_type, 0) + 1
+            evaluated_count += len(batch)
+            publisher(aws_account_id, batch)
+
+        return (evaluated_count, compliance_types)
+
+    summaries = []
+
+    for (aws_account_id, result, exception) in bounded_map(
+            scan_account, account_ids, max_concurrent_accounts):
+        if exception is None:
+            (evaluated_count, compliance_types) = result
+            log.info("Evaluated %d resource(s) in AWS Account: %s",
+                     evaluated_count, aws_account_id)
+            summaries.append({
+                "accountID": aws_account_id,
+                "status": "SUCCEEDED",
+                "evaluated": evaluated_count,
+                "complianceTypes": compliance_types
+            })
+        else:
+            log.error("Could not evaluate AWS Account: %s, because: %s",
+                      aws_account_id, str(exception))
+            summaries.append({
+                "accountID": aws_account_id,
+                "status": "FAILED",
+                "error": str(exception)
+            })
+
+    return summaries
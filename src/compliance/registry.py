@@ -0,0 +1,126 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module maps compliance commands to the compliance module classes
+implementing them, so that an invocation only imports the module it uses.
+
+The mapping is read from the module manifest (compliance/module_manifest.py),
+which deploy-app.py generates when packaging the application. When running
+from a source tree without a manifest, the mapping is built by parsing the
+source code of the compliance modules, without importing them.
+"""
+
+import ast
+import importlib
+import os
+import threading
+from exception.exceptions import NotSupportedError, ValidationError
+
+MODULES_PACKAGE = "compliance.modules"
+MODULES_DIR = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), "modules")
+
+MANIFEST_MODULE = "compliance.module_manifest"
+MANIFEST_FILE_NAME = "module_manifest.py"
+
+# The registry of this process, loaded on first use
+MODULE_REGISTRY = None
+MODULE_REGISTRY_LOCK = threading.Lock()
+
+
+def scan_module_registry(modules_dir: str = MODULES_DIR, modules_package: str = MODULES_PACKAGE):
+    '''
+        Parses the compliance modules found in 'modules_dir' and returns the
+        registry of the classes declaring a MODULE_NAME, e.g.
+
+        {
+            "S3_ENABLE_VERSIONING": ["compliance.modules.s3_versioning", "S3Versioning"]
+        }
+    '''
+    registry = {}
+
+    for file_name in sorted(os.listdir(modules_dir)):
+        if not file_name.endswith(".py") or file_name.startswith("__"):
+            continue
+
+        with open(os.path.join(modules_dir, file_name), "r") as module_file:
+            module_tree = ast.parse(module_file.read(), file_name)
+
+        import_path = "%s.%s" % (modules_package, file_name[:-3])
+
+        for node in module_tree.body:
+            if not isinstance(node, ast.ClassDef):
+                continue
+
+            for statement in node.body:
+                if not isinstance(statement, ast.Assign):
+                    continue
+                if "MODULE_NAME" not in [target.id for target in statement.targets
+                                         if isinstance(target, ast.Name)]:
+                    continue
+
+                try:
+                    module_name = ast.literal_eval(statement.value)
+                except ValueError:
+                    continue
+
+                # base classes leave the name empty
+                if not isinstance(module_name, str) or module_name == "":
+                    continue
+
+                if module_name in registry:
+                    raise ValidationError("Compliance module %s is declared by both %s and %s.%s" % (
+                        module_name, ".".join(registry[module_name]), import_path, node.name), None)
+
+                registry[module_name] = [import_path, node.name]
+
+    return registry
+
+
+def render_module_manifest(registry: dict):
+    '''
+        Returns the source code of a module manifest containing the
+        supplied registry
+    '''
+    lines = [
+        '"""This module was generated by deploy-app.py. Do not edit it."""',
+        "",
+        "MODULE_REGISTRY = {"
+    ]
+    for module_name in sorted(registry.keys()):
+        (import_path, class_name) = registry[module_name]
+        lines.append("    %r: [%r, %r]," % (module_name, import_path, class_name))
+    lines.append("}")
+
+    return "\n".join(lines) + "\n"
+
+
+def get_module_registry():
+    '''
+        Returns the registry of this process, reading it from the module
+        manifest if one was packaged, and from the module sources otherwise
+    '''
+    global MODULE_REGISTRY
+
+    with MODULE_REGISTRY_LOCK:
+        if MODULE_REGISTRY is None:
+            try:
+                module_manifest = importlib.import_module(MANIFEST_MODULE)
+                MODULE_REGISTRY = module_manifest.MODULE_REGISTRY
+            except ImportError:
+                MODULE_REGISTRY = scan_module_registry()
+
+        return MODULE_REGISTRY
+
+
+def get_module_class(module_name: str):
+    '''
+        Returns the class implementing a compliance command, importing its
+        module if needed. If the command is unknown, raise a NotSupported error
+    '''
+    try:
+        (import_path, class_name) = get_module_registry()[module_name]
+    except KeyError:
+        raise NotSupportedError(
+            "Unknown compliance module: %s" % module_name, None)
+
+    return getattr(importlib.import_module(import_path), class_name)
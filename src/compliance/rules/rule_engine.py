@@ -0,0 +1,176 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a table driven rule engine. Rules are declared as
+predicates over named resource attributes, and are evaluated in bulk over
+a columnar inventory, one attribute column at a time.
+"""
+
+from compliance.evaluation import Evaluation, COMPLIANT, NON_COMPLIANT
+
+# Rule operators
+EQUALS = "EQUALS"
+NOT_EQUALS = "NOT_EQUALS"
+IN = "IN"
+NOT_IN = "NOT_IN"
+PREDICATE = "PREDICATE"
+
+
+class Rule():
+    '''
+        A declarative compliance rule. A resource complies with the rule when
+        the value of its attribute satisfies the operator, e.g.
+
+        Rule("versioning_status", EQUALS, "Enabled",
+             "Object Versioning is enabled", "Object Versioning is not enabled")
+
+        Attributes:
+            attribute: The name of the inventory column the rule applies to
+            operator: One of EQUALS, NOT_EQUALS, IN, NOT_IN or PREDICATE
+            value: The value compared against. For IN and NOT_IN this is a
+                collection of values, and for PREDICATE it is a function
+                accepting an attribute value and returning a boolean.
+            compliant_annotation: The annotation of compliant resources
+            non_compliant_annotation: The annotation of non-compliant resources
+    '''
+
+    OPERATORS = [EQUALS, NOT_EQUALS, IN, NOT_IN, PREDICATE]
+
+    def __init__(self, attribute: str, operator: str, value: object,
+                 compliant_annotation: str, non_compliant_annotation: str):
+        if operator not in self.OPERATORS:
+            raise ValueError("Unknown rule operator: %s" % operator)
+
+        self.attribute = attribute
+        self.operator = operator
+        self.value = value
+        self.compliant_annotation = compliant_annotation
+        self.non_compliant_annotation = non_compliant_annotation
+
+    def evaluate_column(self, column: list):
+        '''
+            Applies the rule to a column of attribute values and returns
+            a list of booleans, True for compliant values.
+        '''
+        value = self.value
+
+        if self.operator == EQUALS:
+            return [attribute_value == value for attribute_value in column]
+        elif self.operator == NOT_EQUALS:
+            return [attribute_value != value for attribute_value in column]
+        elif self.operator == IN:
+            value = frozenset(value)
+            return [attribute_value in value for attribute_value in column]
+        elif self.operator == NOT_IN:
+            value = frozenset(value)
+            return [attribute_value not in value for attribute_value in column]
+        else:
+            return [bool(value(attribute_value)) for attribute_value in column]
+
+    def evaluate(self, attribute_value: object):
+        '''
+            Applies the rule to a single attribute value
+        '''
+        return self.evaluate_column([attribute_value])[0]
+
+
+class ColumnarInventory():
+    '''
+        A set of resources of the same type, stored as one list of resource
+        ids and one list of values for each attribute, e.g.
+
+        resource_ids: ["bucketA", "bucketB"]
+        columns: {"versioning_status": ["Enabled", "Suspended"]}
+    '''
+
+    def __init__(self, resource_type: str, resource_ids: list, columns: dict):
+        for (attribute, column) in columns.items():
+            if len(column) != len(resource_ids):
+                raise ValueError(
+                    "Column %s does not match the number of resources" % attribute)
+
+        self.resource_type = resource_type
+        self.resource_ids = resource_ids
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.resource_ids)
+
+    @classmethod
+    def from_configuration_items(cls, resource_type: str, configuration_items: list, attribute_paths: dict):
+        '''
+            Builds an inventory from configuration items. 'attribute_paths'
+            maps each attribute name to the dot separated path of its value
+            within a configuration item, e.g.
+
+            {"versioning_status": "supplementaryConfiguration.BucketVersioningConfiguration.status"}
+
+            Missing values are stored as None.
+        '''
+        resource_ids = [configuration_item['resourceId']
+                        for configuration_item in configuration_items]
+
+        columns = {}
+        for (attribute, path) in attribute_paths.items():
+            keys = path.split(".")
+            column = []
+            for configuration_item in configuration_items:
+                attribute_value = configuration_item
+                for key in keys:
+                    if not isinstance(attribute_value, dict):
+                        attribute_value = None
+                        break
+                    attribute_value = attribute_value.get(key, None)
+                column.append(attribute_value)
+            columns[attribute] = column
+
+        return cls(resource_type, resource_ids, columns)
+
+
+def evaluate_rules(rules: list, inventory: ColumnarInventory):
+    '''
+        Evaluates a table of rules over an inventory and returns one
+        Evaluation per resource, in inventory order.
+
+        A resource is compliant when it satisfies every rule. Its annotation
+        is that of the rules it fails, or of all rules if it is compliant.
+    '''
+    rule_results = [rule.evaluate_column(inventory.columns[rule.attribute])
+                    for rule in rules]
+
+    evaluations = []
+
+    if len(rules) == 1:
+        # the common case of a single rule needs no combining
+        (rule, results) = (rules[0], rule_results[0])
+        resource_type = inventory.resource_type
+        for (resource_id, compliant) in zip(inventory.resource_ids, results):
+            if compliant:
+                evaluations.append(Evaluation(
+                    resource_type, resource_id, COMPLIANT, rule.compliant_annotation))
+            else:
+                evaluations.append(Evaluation(
+                    resource_type, resource_id, NON_COMPLIANT, rule.non_compliant_annotation))
+        return evaluations
+
+    compliant_annotation = "; ".join(
+        [rule.compliant_annotation for rule in rules])
+
+    # resources failing the same rules share their annotation
+    non_compliant_annotations = {}
+
+    for (resource_id, results) in zip(inventory.resource_ids, zip(*rule_results)):
+        if all(results):
+            compliance_type = COMPLIANT
+            annotation = compliant_annotation
+        else:
+            compliance_type = NON_COMPLIANT
+            annotation = non_compliant_annotations.get(results, None)
+            if annotation is None:
+                annotation = "; ".join([rule.non_compliant_annotation
+                                        for (rule, compliant) in zip(rules, results) if not compliant])
+                non_compliant_annotations[results] = annotation
+
+        evaluations.append(Evaluation(
+            inventory.resource_type, resource_id, compliance_type, annotation))
+
+    return evaluations
@@ -2,13 +2,15 @@
 
 This module contains all compliance rules pertinent to the S3 Service
 """
+from compliance.rules.rule_engine import Rule, EQUALS
+
+# Rule table entries, evaluated by the rule engine
+VERSIONING_ENABLED = Rule("versioning_status", EQUALS, "Enabled",
+                          "Object Versioning is enabled", "Object Versioning is not enabled")
 
 
 def versioning_enabled(status: str):
     '''
         Checks the S3 veriong status and return true if enabled. Otherwise returns False
     '''
-    if status == 'Enabled':
-        return True
-    else:
-        return False
+    return VERSIONING_ENABLED.evaluate(status)
@@ -0,0 +1,39 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+from abc import ABC, abstractmethod
+
+
+class BaseEventQueue(ABC):
+    '''
+        Base Class for all event queues. An event queue holds JSON
+        serializable messages with the semantics of an SQS standard queue:
+        a received message is hidden from other receivers until it is
+        deleted, or until its visibility timeout expires, after which it
+        is delivered again.
+
+        Implementations must be safe to use from multiple threads.
+    '''
+
+    @abstractmethod
+    def send_messages(self, messages: list):
+        '''
+            Adds a list of messages to the queue
+        '''
+        pass
+
+    @abstractmethod
+    def receive_messages(self, max_messages: int, wait_seconds: int = 0):
+        '''
+            Returns up to 'max_messages' messages as a list of
+            (receipt handle, message) tuples, waiting up to 'wait_seconds'
+            for the first one.
+        '''
+        pass
+
+    @abstractmethod
+    def delete_messages(self, receipt_handles: list):
+        '''
+            Removes received messages from the queue, once they have
+            been processed
+        '''
+        pass
@@ -0,0 +1,164 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a buffer of configuration change events, used to
+evaluate the changes of many resources together rather than one Lambda
+invocation at a time.
+
+Events are held in an event queue. When they are read back, the events of
+each Config rule are coalesced so that only the newest configuration state
+of every resource is evaluated.
+"""
+
+import json
+import threading
+import time
+
+# The number of events read from the queue by each call to receive_events
+MAX_RECEIVED_EVENTS = 1000
+
+# The number of messages requested from the queue at once
+RECEIVE_BATCH_SIZE = 10
+
+
+class ChangeEventBuffer():
+    '''
+        Buffers configuration change events in an event queue.
+
+        A buffer collects events for up to 'window_seconds', or until events
+        for 'max_events' distinct resources are pending, before flush_due()
+        reports they should be evaluated, so that superseded changes are
+        coalesced and modules are loaded once per batch. This is only tracked for the events submitted by this
+        process, so it is meaningful for queues held in memory; events held
+        in SQS are delivered to the buffered rule function by an event
+        source mapping, whose batching window plays the same role.
+    '''
+
+    DEFAULT_WINDOW_SECONDS = 5
+    DEFAULT_MAX_EVENTS = 100
+
+    def __init__(self, event_queue: object, window_seconds: float = DEFAULT_WINDOW_SECONDS,
+                 max_events: int = DEFAULT_MAX_EVENTS):
+        self.event_queue = event_queue
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+
+        self.lock = threading.Lock()
+        self.pending_resources = set()
+        self.first_pending_time = None
+
+    def submit(self, event: dict):
+        '''
+            Adds a Config rule change event to the buffer
+        '''
+        self.event_queue.send_messages([event])
+
+        configuration_item = event_configuration_item(
+            json.loads(event['invokingEvent']))
+
+        with self.lock:
+            self.pending_resources.add((event['accountId'], event.get('configRuleName', ''),
+                                        configuration_item['resourceType'], configuration_item['resourceId']))
+            if self.first_pending_time is None:
+                self.first_pending_time = time.monotonic()
+
+    def flush_due(self):
+        '''
+            Returns True if the events submitted by this process should be
+            evaluated, because the window elapsed or enough are pending
+        '''
+        with self.lock:
+            if self.first_pending_time is None:
+                return False
+
+            return len(self.pending_resources) >= self.max_events or \
+                time.monotonic() - self.first_pending_time >= self.window_seconds
+
+    def receive_events(self, max_events: int = MAX_RECEIVED_EVENTS):
+        '''
+            Reads up to 'max_events' events from the queue and returns them
+            as a tuple of (receipt handles, events). The events must be
+            deleted with delete_events once they have been published.
+        '''
+        receipt_handles = []
+        events = []
+
+        while len(events) < max_events:
+            messages = self.event_queue.receive_messages(
+                min(RECEIVE_BATCH_SIZE, max_events - len(events)))
+            if len(messages) == 0:
+                break
+
+            for (receipt_handle, event) in messages:
+                receipt_handles.append(receipt_handle)
+                events.append(event)
+
+        with self.lock:
+            self.pending_resources = set()
+            self.first_pending_time = None
+
+        return (receipt_handles, events)
+
+    def delete_events(self, receipt_handles: list):
+        '''
+            Removes published events from the queue
+        '''
+        if len(receipt_handles) > 0:
+            self.event_queue.delete_messages(receipt_handles)
+
+
+def event_configuration_item(invoking_event: dict):
+    '''
+        Returns the configuration item of a change event, which is a summary
+        of the item for oversized change events
+    '''
+    if invoking_event['messageType'] == 'OversizedConfigurationItemChangeNotification':
+        return invoking_event['configurationItemSummary']
+    return invoking_event['configurationItem']
+
+
+def configuration_item_age(configuration_item: dict):
+    '''
+        Returns a key ordering the configuration items of a resource
+        from the oldest to the newest
+    '''
+    try:
+        state_id = int(configuration_item.get('configurationStateId', 0))
+    except (TypeError, ValueError):
+        state_id = 0
+
+    return (str(configuration_item.get('configurationItemCaptureTime', '')), state_id)
+
+
+def coalesce_change_events(events: list):
+    '''
+        Groups a list of Config rule change events by account and rule, and
+        keeps the newest configuration item of each resource.
+
+        Returns a list of (event, items) tuples, one per group, where 'items'
+        is a list of (message type, configuration item, result token) tuples,
+        and the event is the last event received for the group, which
+        supplies the rule parameters. Each result token is the one of the
+        rule invocation that delivered the item, with which its evaluation
+        must be published.
+    '''
+    groups = {}
+
+    for event in events:
+        invoking_event = json.loads(event['invokingEvent'])
+        configuration_item = event_configuration_item(invoking_event)
+
+        group_key = (event['accountId'], event.get(
+            'configRuleName', ''), event['ruleParameters'])
+        resource_key = (
+            configuration_item['resourceType'], configuration_item['resourceId'])
+
+        newest_items = groups[group_key][1] if group_key in groups else {}
+        groups[group_key] = (event, newest_items)
+
+        newest = newest_items.get(resource_key, None)
+        if newest is None or configuration_item_age(configuration_item) >= configuration_item_age(newest[1]):
+            newest_items[resource_key] = (
+                invoking_event['messageType'], configuration_item, event['resultToken'])
+
+    return [(group_event, list(newest_items.values()))
+            for (group_event, newest_items) in groups.values()]
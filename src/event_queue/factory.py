@@ -0,0 +1,31 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a small factory capable of generating event queue
+objects based on a queue type
+"""
+
+from exception.exceptions import NotSupportedError, ValidationError
+
+
+def load_event_queue(queue_type: str, location: str = None):
+    '''
+        Returns an event queue given its type. The location is the queue
+        URL of "SQS" queues, and is not used by "MEMORY" queues.
+        If the queue type is not supported, raise a NotSupported error
+    '''
+    if queue_type == "MEMORY":
+        from event_queue.memory_queue import MemoryEventQueue
+
+        return MemoryEventQueue()
+    elif queue_type == "SQS":
+        from aws_connector.aws_client import AWSClient
+        from event_queue.sqs_queue import SQSEventQueue
+
+        if location is None:
+            raise ValidationError("SQS event queues require a queue URL", None)
+
+        # The queue is hosted in the master account, so no assume role is needed
+        return SQSEventQueue(AWSClient().get_boto_client('sqs'), location)
+    else:
+        raise NotSupportedError(
+            "Unknown event queue type: %s" % queue_type, None)
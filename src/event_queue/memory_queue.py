@@ -0,0 +1,78 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+import itertools
+import threading
+import time
+from collections import deque
+from event_queue.base_queue import BaseEventQueue
+
+
+class MemoryEventQueue(BaseEventQueue):
+    '''
+        An event queue held in the memory of the process. Its contents
+        survive warm Lambda invocations, but are not shared between
+        containers, so it is meant for local runs and as a stand-in for
+        SQS in tests and benchmarks.
+
+        Please see BaseEventQueue for additional documentation
+    '''
+
+    DEFAULT_VISIBILITY_TIMEOUT_SECONDS = 30
+
+    def __init__(self, visibility_timeout_seconds: int = DEFAULT_VISIBILITY_TIMEOUT_SECONDS):
+        self.visibility_timeout_seconds = visibility_timeout_seconds
+
+        self.condition = threading.Condition()
+        self.messages = deque()
+        # receipt handle -> (message, visibility deadline)
+        self.in_flight = {}
+        self.receipt_handles = itertools.count()
+
+    def send_messages(self, messages: list):
+        with self.condition:
+            self.messages.extend(messages)
+            self.condition.notify_all()
+
+    def receive_messages(self, max_messages: int, wait_seconds: int = 0):
+        deadline = time.monotonic() + wait_seconds
+
+        with self.condition:
+            self.restore_expired_messages()
+            while len(self.messages) == 0:
+                remaining_seconds = deadline - time.monotonic()
+                if remaining_seconds <= 0:
+                    return []
+                self.condition.wait(remaining_seconds)
+                self.restore_expired_messages()
+
+            received_messages = []
+            visibility_deadline = time.monotonic() + self.visibility_timeout_seconds
+            while len(self.messages) > 0 and len(received_messages) < max_messages:
+                message = self.messages.popleft()
+                receipt_handle = str(next(self.receipt_handles))
+                self.in_flight[receipt_handle] = (message, visibility_deadline)
+                received_messages.append((receipt_handle, message))
+
+            return received_messages
+
+    def delete_messages(self, receipt_handles: list):
+        with self.condition:
+            for receipt_handle in receipt_handles:
+                self.in_flight.pop(receipt_handle, None)
+
+    def restore_expired_messages(self):
+        '''
+            Returns received messages whose visibility timeout expired to
+            the queue. Must be called holding the lock.
+        '''
+        now = time.monotonic()
+        expired_handles = [receipt_handle for (receipt_handle, (message, visibility_deadline))
+                           in self.in_flight.items() if visibility_deadline <= now]
+
+        for receipt_handle in expired_handles:
+            (message, visibility_deadline) = self.in_flight.pop(receipt_handle)
+            self.messages.append(message)
+
+    def __len__(self):
+        with self.condition:
+            return len(self.messages)
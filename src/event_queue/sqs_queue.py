@@ -0,0 +1,28 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+from event_queue.base_queue import BaseEventQueue
+import aws_connector.sqs_boto_wrapper as sqs
+
+
+class SQSEventQueue(BaseEventQueue):
+    '''
+        An event queue backed by an SQS standard queue, shared by all
+        containers. Any service implementing the SQS API can be used by
+        supplying a client configured for it.
+
+        Please see BaseEventQueue for additional documentation
+    '''
+
+    def __init__(self, boto_sqs_client: object, queue_url: str):
+        self.boto_sqs_client = boto_sqs_client
+        self.queue_url = queue_url
+
+    def send_messages(self, messages: list):
+        sqs.send_messages(self.boto_sqs_client, self.queue_url, messages)
+
+    def receive_messages(self, max_messages: int, wait_seconds: int = 0):
+        return sqs.receive_messages(self.boto_sqs_client, self.queue_url, max_messages, wait_seconds)
+
+    def delete_messages(self, receipt_handles: list):
+        sqs.delete_messages(self.boto_sqs_client,
+                            self.queue_url, receipt_handles)
@@ -62,3 +62,12 @@ class AWSError(BaseError):
         '''
         return "(404)" in str(self.cause) and "NOT FOUND" in str(
             self.cause).upper()
+
+
+class StateStoreError(BaseError):
+    """
+        A class representing an error reading or writing a state store
+    """
+
+    def __print_cause__(self):
+        return "State Store Error: %s" % super().__print_cause__()
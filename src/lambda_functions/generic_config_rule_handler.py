@@ -1,59 +1,243 @@
 """Author: Mark Hanegraaff -- 2021
 """
-import boto3
 import json
-from aws_connector.aws_client import AWSClient
+import os
+from aws_connector.aws_client import AWSClient, CREDENTIAL_CACHE
+from aws_connector.inventory_cache import INVENTORY_CACHE
+import aws_connector.config_boto_wrapper as config
+import aws_connector.lambda_boto_wrapper as lambda_wrapper
 from exception.exceptions import ValidationError
 from compliance import factory
+from compliance.evaluation import deleted_evaluation
+from state import factory as state_factory
+from state.evaluation_state import EvaluationStateTracker
+from state.change_event_cache import ChangeEventCache
+from state.scan_checkpoint import ScanCheckpoint
+from event_queue import factory as event_queue_factory
+from event_queue.change_event_buffer import ChangeEventBuffer, coalesce_change_events
+from support.metrics import METRICS, function_name
+from support.time_budget import TimeBudget
 
 import logging
 from support import logging_definition
+from support.logging_definition import SUMMARY, RESOURCE_LOG
 
 log = logging.getLogger()
 
+# Optional evaluation state store, used to publish only the evaluations that
+# changed during scheduled runs. The store type is "SQLITE" or "DYNAMODB",
+# and the location is the database path or table name respectively.
+STATE_STORE_TYPE = os.environ.get("COMPLIANCE_APP_STATE_STORE", None)
+STATE_STORE_LOCATION = os.environ.get(
+    "COMPLIANCE_APP_STATE_STORE_LOCATION", None)
+FULL_REFRESH_SECONDS = int(os.environ.get(
+    "COMPLIANCE_APP_FULL_REFRESH_SECONDS", EvaluationStateTracker.DEFAULT_FULL_REFRESH_SECONDS))
 
-def evaluate_compliance(event, context):
+# The number of seconds a published configuration state is remembered, so
+# that redelivered change notifications are not evaluated again. Set it to
+# 0 to evaluate every notification.
+CHANGE_EVENT_CACHE_SECONDS = int(os.environ.get(
+    "COMPLIANCE_APP_CHANGE_EVENT_CACHE_SECONDS", ChangeEventCache.DEFAULT_TTL_SECONDS))
+
+# Optional change event buffer. When set, change events are queued and
+# evaluated together by evaluate_buffered_compliance. The queue type is
+# "MEMORY" or "SQS", and the location is the SQS queue URL.
+CHANGE_EVENT_QUEUE_TYPE = os.environ.get(
+    "COMPLIANCE_APP_CHANGE_EVENT_QUEUE", None)
+CHANGE_EVENT_QUEUE_LOCATION = os.environ.get(
+    "COMPLIANCE_APP_CHANGE_EVENT_QUEUE_LOCATION", None)
+CHANGE_EVENT_WINDOW_SECONDS = float(os.environ.get(
+    "COMPLIANCE_APP_CHANGE_EVENT_WINDOW_SECONDS", ChangeEventBuffer.DEFAULT_WINDOW_SECONDS))
+
+# Scheduled scans stop this many seconds before the function times out, to
+# publish what they evaluated and save a checkpoint in the state store, from
+# which the next scheduled run resumes. When scan continuations are enabled
+# the function invokes itself to resume the scan right away, up to
+# MAX_SCAN_CONTINUATIONS times per scheduled run.
+SCAN_TIME_RESERVE_SECONDS = float(os.environ.get(
+    "COMPLIANCE_APP_SCAN_TIME_RESERVE_SECONDS", TimeBudget.DEFAULT_RESERVE_SECONDS))
+SCAN_CONTINUATION = os.environ.get(
+    "COMPLIANCE_APP_SCAN_CONTINUATION", "false").lower() == "true"
+MAX_SCAN_CONTINUATIONS = 20
+
+# The most resources that could not be evaluated a checkpoint keeps, to be
+# retried when the scan resumes
+MAX_CHECKPOINT_FAILURES = 1000
+
+# The state store, change event cache and change event buffer are kept at
+# module scope so that they are reused by warm invocations
+STATE_STORE = None
+CHANGE_EVENT_CACHE = None
+CHANGE_EVENT_BUFFER = None
+
+
+def get_state_store():
     '''
-        Generic Config rule Lambda Function main entrypoint
+        Returns the configured state store, or None if one is not configured
     '''
-    def parse_config_event(event: dict):
-        '''
-            Parse the config event and extract info needed. 
-            If anything is missing raise a Validation Error
-        '''
-        try:
-            aws_account_id = event['accountId']
-            rule_parameters = json.loads(event['ruleParameters'])
-            invoking_event = json.loads(event['invokingEvent'])
-        except Exception as e:
-            raise ValidationError("Could not parse Config Payload", e)
+    global STATE_STORE
 
-        # validate the rule parameters
-        try:
-            rule_parameters['ComplianceCommand']
-        except Exception as e:
-            raise ValidationError("Invalid Rule Parameters", e)
+    if STATE_STORE is None and STATE_STORE_TYPE:
+        STATE_STORE = state_factory.load_state_store(
+            STATE_STORE_TYPE, STATE_STORE_LOCATION)
+
+    return STATE_STORE
+
+
+def get_change_event_cache():
+    '''
+        Returns the change event cache, backed by the state store if one
+        is configured, or None if the cache is disabled
+    '''
+    global CHANGE_EVENT_CACHE
+
+    if CHANGE_EVENT_CACHE is None and CHANGE_EVENT_CACHE_SECONDS > 0:
+        CHANGE_EVENT_CACHE = ChangeEventCache(
+            get_state_store(), CHANGE_EVENT_CACHE_SECONDS)
+
+    return CHANGE_EVENT_CACHE
+
+
+def get_change_event_buffer():
+    '''
+        Returns the configured change event buffer, or None if one
+        is not configured
+    '''
+    global CHANGE_EVENT_BUFFER
+
+    if CHANGE_EVENT_BUFFER is None and CHANGE_EVENT_QUEUE_TYPE:
+        CHANGE_EVENT_BUFFER = ChangeEventBuffer(event_queue_factory.load_event_queue(
+            CHANGE_EVENT_QUEUE_TYPE, CHANGE_EVENT_QUEUE_LOCATION), CHANGE_EVENT_WINDOW_SECONDS)
+
+    return CHANGE_EVENT_BUFFER
+
+
+def parse_config_event(event: dict):
+    '''
+        Parse the config event and extract info needed. 
+        If anything is missing raise a Validation Error
+    '''
+    try:
+        aws_account_id = event['accountId']
+        rule_parameters = json.loads(event['ruleParameters'])
+        invoking_event = json.loads(event['invokingEvent'])
+    except Exception as e:
+        raise ValidationError("Could not parse Config Payload", e)
+
+    # validate the rule parameters
+    try:
+        rule_parameters['ComplianceCommand']
+    except Exception as e:
+        raise ValidationError("Invalid Rule Parameters", e)
+
+    return (aws_account_id, rule_parameters, invoking_event)
+
+
+def parse_compliance_commands(rule_name: str):
+    '''
+        The compliance command may be a comma separated list of commands
+        targeting the same resource type, which are evaluated together
+    '''
+    return [command.strip() for command in rule_name.split(",") if command.strip() != ""]
 
-        return (aws_account_id, rule_parameters, invoking_event)
 
+def evaluate_compliance(event, context):
+    '''
+        Generic Config rule Lambda Function main entrypoint
+    '''
     log.info("Generic Config rule was invoked")
+    METRICS.reset()
+    SUMMARY.reset()
 
     (aws_account_id, rule_parameters, invoking_event) = parse_config_event(event)
-    log.info("Event Account Origin: %s" % aws_account_id)
+    log.info("Event Account Origin: %s", aws_account_id)
     execution_role_arn = 'arn:aws:iam::%s:role/role-compliance-generic-rule' % aws_account_id
 
     try:
         rule_name = rule_parameters['ComplianceCommand']
+        config_rule_name = event.get('configRuleName', rule_name)
+        event_type = invoking_event['messageType']
 
-        # Load the appropriate compliance module and apply it.
-        compliance_module = factory.load_compliance_module(
-            rule_parameters['ComplianceCommand'], execution_role_arn, aws_account_id)
+        # Config redelivers notifications for the same configuration state,
+        # whose evaluation does not need to be published again. States are
+        # remembered per compliance command, so that changing the commands
+        # of a rule re-evaluates its resources.
+        cached_rule_name = "%s|%s" % (config_rule_name, rule_name)
+        change_event_cache = None
+        configuration_item = None
+        if event_type != 'ScheduledNotification':
+            change_event_cache = get_change_event_cache()
+            configuration_item = invoking_event.get('configurationItem', None) or \
+                invoking_event.get('configurationItemSummary', None)
+
+        # attributes cached before the change no longer apply
+        if configuration_item is not None:
+            INVENTORY_CACHE.invalidate_configuration_item(
+                aws_account_id, configuration_item)
+
+        if change_event_cache is not None and configuration_item is not None and \
+                change_event_cache.is_published(aws_account_id, cached_rule_name, configuration_item):
+            log.info("The evaluation of %s (state: %s) was already published",
+                     configuration_item['resourceId'], change_event_cache.configuration_state(configuration_item))
+            SUMMARY.count("ALREADY_PUBLISHED")
+            return
+
+        # change events are evaluated together by evaluate_buffered_compliance.
+        # A Lambda container is not guaranteed another invocation, so events
+        # buffered in memory are evaluated before a Lambda invocation returns.
+        # Only local runs, which have no deadline, leave them buffered until
+        # the window elapses.
+        if configuration_item is not None and get_change_event_buffer() is not None:
+            get_change_event_buffer().submit(event)
+            log.info("Buffered the change event of %s",
+                     configuration_item['resourceId'])
+            SUMMARY.count("BUFFERED")
+
+            if CHANGE_EVENT_QUEUE_TYPE == "MEMORY" and \
+                    (TimeBudget.from_context(context).deadline is not None or get_change_event_buffer().flush_due()):
+                evaluate_buffered_events()
+            return
+
+        compliance_commands = parse_compliance_commands(rule_name)
+
+        # Load the appropriate compliance modules and apply them.
+        with METRICS.span("load_modules"):
+            compliance_module = factory.load_compliance_module_group(
+                compliance_commands, execution_role_arn, aws_account_id,
+                rule_parameters.get('InventorySource', 'SERVICE'))
+
+        state_tracker = None
+        if get_state_store() is not None:
+            state_tracker = EvaluationStateTracker(
+                get_state_store(), aws_account_id, config_rule_name, FULL_REFRESH_SECONDS)
+        full_refresh = False
+
+        # scheduled scans resume from the checkpoint of an interrupted scan
+        time_budget = TimeBudget.from_context(
+            context, SCAN_TIME_RESERVE_SECONDS)
+        scan_checkpoint = None
+        checkpoint = None
+        scan_retries = {"attempted": [], "failed": []}
 
-        event_type = invoking_event['messageType']
         if event_type == 'ScheduledNotification':
             log.info("Processing a scheduled event")
-            results = compliance_module.evaluate_compliance_all()
+            if get_state_store() is not None and compliance_module.scan_resumable():
+                scan_checkpoint = ScanCheckpoint(
+                    get_state_store(), aws_account_id, cached_rule_name)
+                checkpoint = scan_checkpoint.load()
+
+            results = time_budget.limit(
+                resume_scan(compliance_module, checkpoint, scan_retries))
             ordering_timestamp = invoking_event['notificationCreationTime']
+        elif event_type == 'OversizedConfigurationItemChangeNotification':
+            log.info("Processing an oversized configuration change event")
+            configuration_item_summary = invoking_event['configurationItemSummary']
+            results = validate_configuration_item(configuration_item_summary)
+            if results is None:
+                results = evaluate_oversized_configuration_item(
+                    compliance_module, configuration_item_summary)
+            ordering_timestamp = configuration_item_summary[
+                'configurationItemCaptureTime']
         else:
             log.info("Processing a configuration change event")
             configuration_item = invoking_event['configurationItem']
@@ -70,24 +254,364 @@ def evaluate_compliance(event, context):
         aws_client = AWSClient()
         config_client = aws_client.get_boto_client("config")
 
-        evaluations = []
-        for evaluation in results:
-            evaluations.append({
-                'ComplianceResourceType': evaluation["resource_type"],
-                'ComplianceResourceId':   evaluation['resource_id'],
-                'ComplianceType':         evaluation["compliance_type"],
-                "Annotation":             evaluation["annotation"],
-                'OrderingTimestamp':      ordering_timestamp
-            })
-        log.info("Publishing compliance status of %d resource(s) to Config Service" % len(
-            evaluations))
-        config_client.put_evaluations(
-            Evaluations=evaluations,
-            ResultToken=event['resultToken'])
+        # Results are published as they are produced, so that the first
+        # batches are sent while the scan is still running. Each batch is
+        # converted to the Config format as it is sent.
+        evaluations = SUMMARY.count_evaluations(results)
+
+        # only publish what changed since the last scheduled run,
+        # unless a full refresh is due
+        if state_tracker is not None and event_type == 'ScheduledNotification':
+            if checkpoint is not None:
+                full_refresh = checkpoint["full_refresh"]
+            else:
+                full_refresh = state_tracker.full_refresh_due()
+            if full_refresh:
+                log.info("Publishing a full refresh of all evaluations")
+            else:
+                evaluations = state_tracker.changed_evaluations(evaluations)
+
+        # evaluations are produced while they are published, so this
+        # span covers both
+        log.info("Publishing compliance status to Config Service")
+        with METRICS.span("evaluate_and_publish"):
+            published_count = config.put_evaluations(
+                config_client, evaluations, event['resultToken'], ordering_timestamp,
+                on_published=state_tracker.record_evaluations if state_tracker is not None else None)
+        log.info("Published compliance status of %d resource(s) to Config Service",
+                 published_count)
+        SUMMARY.count("PUBLISHED", published_count)
+
+        if time_budget.interrupted:
+            SUMMARY.count("SCAN_INTERRUPTED")
+            save_scan_checkpoint(event, context, scan_checkpoint, checkpoint, time_budget,
+                                 full_refresh, scan_failures(compliance_module, checkpoint, scan_retries,
+                                                             time_budget))
+        else:
+            if checkpoint is not None:
+                scan_checkpoint.clear()
+            if full_refresh:
+                state_tracker.record_full_refresh()
+
+        if change_event_cache is not None and configuration_item is not None and published_count > 0:
+            change_event_cache.record_published(
+                aws_account_id, cached_rule_name, configuration_item)
+
+        log.info("Credential cache hits: %d, misses: %d",
+                 CREDENTIAL_CACHE.hits, CREDENTIAL_CACHE.misses)
+        if INVENTORY_CACHE.enabled:
+            log.info("Inventory cache hits: %d, misses: %d",
+                     INVENTORY_CACHE.hits, INVENTORY_CACHE.misses)
+    except Exception as e:
+        log.error("There was an error executing evaluating compliance rule: %s", e)
+        log.error("Function Payload: %s", str(event))
+        raise e
+    finally:
+        log_invocation_end(function_name(context, "compliance-generic-rule"))
+
+
+def resume_scan(compliance_module: object, checkpoint: dict, scan_retries: dict):
+    '''
+        Yields the evaluations of a scheduled scan, resuming the scan of an
+        interrupted checkpoint if there is one. The resources the checkpoint
+        could not evaluate are retried first, and their ids are added to
+        the "attempted" and "failed" lists of 'scan_retries'.
+    '''
+    if checkpoint is None:
+        yield from compliance_module.evaluate_compliance_all(None)
+        return
+
+    for resource_id in checkpoint.get("failed", []):
+        scan_retries["attempted"].append(resource_id)
+        try:
+            evaluations = compliance_module.evaluate_compliance_resource_id(
+                resource_id)
+        except Exception as e:
+            scan_retries["failed"].append(resource_id)
+            SUMMARY.record_failure(resource_id, e)
+            RESOURCE_LOG.warning("%s -> %s", resource_id, e)
+            continue
+
+        yield from evaluations
+
+    log.info("Resuming the scan after resource: %s", checkpoint["cursor"])
+    yield from compliance_module.evaluate_compliance_all(checkpoint["cursor"])
+
+
+def scan_failures(compliance_module: object, checkpoint: dict, scan_retries: dict, time_budget: object):
+    '''
+        Returns the ids of the resources an interrupted scan must retry when
+        it resumes: those the checkpoint could not evaluate and that were not
+        retried successfully, followed by the new failures before the point
+        the scan stopped at
+    '''
+    failed_ids = list(scan_retries["failed"])
+    if checkpoint is not None:
+        attempted_ids = set(scan_retries["attempted"])
+        failed_ids += [resource_id for resource_id in checkpoint.get("failed", [])
+                       if resource_id not in attempted_ids]
+
+    # failures after the last resource evaluated are scanned again anyway
+    if time_budget.last_item is not None:
+        failed_ids += [resource_id for resource_id in compliance_module.failed_resource_ids
+                       if resource_id <= time_budget.last_item.resource_id]
+
+    if len(failed_ids) > MAX_CHECKPOINT_FAILURES:
+        log.warning("%d failed resource(s) will not be retried until the next scan",
+                    len(failed_ids) - MAX_CHECKPOINT_FAILURES)
+
+    return failed_ids[:MAX_CHECKPOINT_FAILURES]
+
+
+def save_scan_checkpoint(event: dict, context: object, scan_checkpoint: object, checkpoint: dict,
+                         time_budget: object, full_refresh: bool, failed_resource_ids: list):
+    '''
+        Records the progress of a scheduled scan that ran out of time, and
+        if scan continuations are enabled, invokes the function again to
+        resume it. 'failed_resource_ids' are retried when it resumes.
+    '''
+    log.warning("The scan ran out of time after evaluating %d resource(s)",
+                time_budget.item_count)
+
+    if scan_checkpoint is None:
+        log.warning(
+            "The scan cannot be resumed, and will start over on the next scheduled run")
+        return
+
+    if time_budget.item_count == 0:
+        # no progress was made, so the checkpoint still applies
+        return
+
+    # the scan may stop while retrying the failures of the checkpoint,
+    # which come before its cursor
+    cursor = time_budget.last_item.resource_id
+    if checkpoint is not None:
+        cursor = max(cursor, checkpoint["cursor"])
+
+    scan_checkpoint.save(checkpoint, cursor, time_budget.item_count,
+                         full_refresh, failed_resource_ids)
+
+    continuation = event.get('scanContinuation', 0)
+    function_arn = getattr(context, 'invoked_function_arn', None)
+    if not SCAN_CONTINUATION or function_arn is None:
+        return
+
+    if continuation >= MAX_SCAN_CONTINUATIONS:
+        log.warning("The scan reached %d continuation(s), and will resume on the next scheduled run",
+                    continuation)
+        return
+
+    # Note that the function runs in the master account, so no assume role
+    # is needed
+    continuation_event = dict(event)
+    continuation_event['scanContinuation'] = continuation + 1
+    lambda_wrapper.invoke_async(AWSClient().get_boto_client(
+        "lambda"), function_arn, continuation_event)
+    log.info("Invoked scan continuation: %d", continuation + 1)
+
+
+def log_invocation_end(name: str):
+    '''
+        Writes the summary and the metrics of the invocation
+    '''
+    SUMMARY.log_summary(name, METRICS.span_durations())
+    METRICS.flush({"FunctionName": name})
+
+
+def evaluate_buffered_compliance(event, context):
+    '''
+        Buffered Config rule Lambda Function entrypoint. Evaluates the change
+        events delivered by an SQS event source mapping, or when invoked
+        with any other event, the events held by the change event buffer.
+
+        Returns the number of evaluations published.
+    '''
+    log.info("Buffered Config rule was invoked")
+    METRICS.reset()
+    SUMMARY.reset()
+
+    try:
+        if 'Records' in event:
+            config_events = [json.loads(record['body'])
+                             for record in event['Records']]
+            published_count = evaluate_change_events(config_events)
+        else:
+            published_count = evaluate_buffered_events()
+
+        log.info("Credential cache hits: %d, misses: %d",
+                 CREDENTIAL_CACHE.hits, CREDENTIAL_CACHE.misses)
     except Exception as e:
-        log.error("There was an error executing evaluating compliance rule: %s" % e)
-        log.error("Function Payload: %s" % str(event))
+        log.error("There was an error evaluating buffered change events: %s", e)
         raise e
+    finally:
+        log_invocation_end(function_name(context, "compliance-buffered-rule"))
+
+    return {"published": published_count}
+
+
+def evaluate_buffered_events():
+    '''
+        Reads the change event buffer until it is empty, evaluating
+        and publishing the events read, and returns the number of
+        evaluations published. Events are removed from the buffer
+        once they have been published.
+    '''
+    change_event_buffer = get_change_event_buffer()
+    if change_event_buffer is None:
+        raise ValidationError("A change event queue is not configured", None)
+
+    published_count = 0
+    while True:
+        (receipt_handles, config_events) = change_event_buffer.receive_events()
+        if len(config_events) == 0:
+            break
+
+        published_count += evaluate_change_events(config_events)
+        change_event_buffer.delete_events(receipt_handles)
+
+    return published_count
+
+
+def evaluate_change_events(config_events: list):
+    '''
+        Coalesces a list of Config rule change events, so that only the
+        newest state of each resource is evaluated, and evaluates each
+        rule's resources together. Returns the number of evaluations
+        published.
+    '''
+    coalesced_events = coalesce_change_events(config_events)
+
+    resource_count = sum([len(configuration_items)
+                          for (event, configuration_items) in coalesced_events])
+    log.info("Coalesced %d change event(s) into %d resource(s) across %d rule(s)",
+             len(config_events), resource_count, len(coalesced_events))
+    SUMMARY.count("CHANGE_EVENTS", len(config_events))
+
+    published_count = 0
+    for (event, configuration_items) in coalesced_events:
+        published_count += evaluate_change_event_group(
+            event, configuration_items)
+
+    return published_count
+
+
+def evaluate_change_event_group(event: dict, configuration_items: list):
+    '''
+        Evaluates the configuration items of several change events received
+        by the same rule in the same account together. 'configuration_items'
+        is a list of (message type, configuration item, result token) tuples.
+
+        A result token identifies the rule invocation that delivered a change,
+        so each evaluation is published with the token of its own change.
+        Returns the number of evaluations published.
+    '''
+    (aws_account_id, rule_parameters, invoking_event) = parse_config_event(event)
+    execution_role_arn = 'arn:aws:iam::%s:role/role-compliance-generic-rule' % aws_account_id
+
+    rule_name = rule_parameters['ComplianceCommand']
+    config_rule_name = event.get('configRuleName', rule_name)
+    cached_rule_name = "%s|%s" % (config_rule_name, rule_name)
+
+    # the events may have been submitted by other containers, whose
+    # cached attributes were not invalidated in this one
+    for (message_type, configuration_item, result_token) in configuration_items:
+        INVENTORY_CACHE.invalidate_configuration_item(
+            aws_account_id, configuration_item)
+
+    change_event_cache = get_change_event_cache()
+    if change_event_cache is not None:
+        configuration_items = [(message_type, configuration_item, result_token)
+                               for (message_type, configuration_item, result_token) in configuration_items
+                               if not change_event_cache.is_published(aws_account_id, cached_rule_name, configuration_item)]
+
+    if len(configuration_items) == 0:
+        log.info("The evaluations of all buffered changes were already published")
+        return 0
+
+    with METRICS.span("load_modules"):
+        compliance_module = factory.load_compliance_module_group(
+            parse_compliance_commands(rule_name), execution_role_arn, aws_account_id)
+
+    results = []
+    batch_items = []
+    for (message_type, configuration_item, result_token) in configuration_items:
+        deleted_results = validate_configuration_item(configuration_item)
+
+        if deleted_results is not None:
+            results.extend(deleted_results)
+        elif message_type == 'OversizedConfigurationItemChangeNotification':
+            results.extend(evaluate_oversized_configuration_item(
+                compliance_module, configuration_item))
+        else:
+            batch_items.append(configuration_item)
+
+    with METRICS.span("evaluate"):
+        results.extend(
+            compliance_module.evaluate_compliance_resources(batch_items))
+
+    # each resource is published with the time and the result token
+    # of its own change
+    changes = {
+        (configuration_item['resourceType'], configuration_item['resourceId']):
+            (configuration_item['configurationItemCaptureTime'], result_token)
+        for (message_type, configuration_item, result_token) in configuration_items
+    }
+    token_results = {}
+    for evaluation in results:
+        (ordering_timestamp, result_token) = changes[(
+            evaluation.resource_type, evaluation.resource_id)]
+        evaluation.ordering_timestamp = ordering_timestamp
+        token_results.setdefault(result_token, []).append(evaluation)
+
+    # published evaluations are recorded like those of unbuffered changes,
+    # so that scheduled runs compare against them
+    state_tracker = None
+    if get_state_store() is not None:
+        state_tracker = EvaluationStateTracker(
+            get_state_store(), aws_account_id, config_rule_name, FULL_REFRESH_SECONDS)
+
+    # Note that we are interacting with the master account and so
+    # no assume role is needed
+    config_client = AWSClient().get_boto_client("config")
+
+    log.info("Publishing compliance status of %d buffered change(s) from %d rule invocation(s) to Config Service",
+             len(results), len(token_results))
+    published_count = 0
+    with METRICS.span("publish"):
+        for (result_token, evaluations) in token_results.items():
+            published_count += config.put_evaluations(
+                config_client, SUMMARY.count_evaluations(evaluations), result_token,
+                on_published=state_tracker.record_evaluations if state_tracker is not None else None)
+    SUMMARY.count("PUBLISHED", published_count)
+
+    if change_event_cache is not None:
+        for (message_type, configuration_item, result_token) in configuration_items:
+            change_event_cache.record_published(
+                aws_account_id, cached_rule_name, configuration_item)
+
+    return published_count
+
+
+def evaluate_oversized_configuration_item(compliance_module: object, configuration_item_summary: dict):
+    '''
+        Evaluates the resource described by an oversized configuration change
+        notification, which only carries a summary of the configuration item.
+        The full item is read from the Config history, and if the history does
+        not include the change yet, the resource is read directly from the
+        service that owns it.
+    '''
+    if configuration_item_summary['resourceType'] != compliance_module.APPLICABLE_RESOURCE:
+        # the summary is enough to report the resource as not applicable
+        return compliance_module.evaluate_compliance_resource(configuration_item_summary)
+
+    configuration_item = compliance_module.get_configuration_item(
+        configuration_item_summary)
+
+    if configuration_item is not None:
+        return compliance_module.evaluate_compliance_resource(configuration_item)
+
+    return compliance_module.evaluate_compliance_resource_id(
+        configuration_item_summary['resourceId'])
 
 
 def validate_configuration_item(configuration_item):
@@ -97,11 +621,6 @@ def validate_configuration_item(configuration_item):
     '''
     # Check if resource was deleted
     if configuration_item['configurationItemStatus'] == "ResourceDeleted":
-        return {
-            "resource_type": configuration_item['resourceType'],
-            "resource_id": configuration_item['resourceId'],
-            "compliance_type": "NOT_APPLICABLE",
-            "annotation": "This resource was deleted."
-        }
+        return [deleted_evaluation(configuration_item['resourceType'], configuration_item['resourceId'])]
 
     return None
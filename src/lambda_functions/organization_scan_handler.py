@@ -0,0 +1,94 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+from aws_connector.aws_client import CREDENTIAL_CACHE
+from exception.exceptions import ValidationError
+from compliance import organization_scan
+
+import logging
+from support import logging_definition
+from support.logging_definition import SUMMARY
+from support.metrics import METRICS, function_name
+
+log = logging.getLogger()
+
+
+def scan_organization(event, context):
+    """
+    Lambda handler that evaluates a compliance command across a list of member
+    accounts, for organization wide audits and backfills. The lambda function
+    expects a payload like this:
+
+    {
+        "accountIDs": ["999999999999", "888888888888"],
+        "complianceCommand": "S3_ENABLE_VERSIONING",
+        "inventorySource": "CONFIG",
+        "maxConcurrentAccounts": 10,
+        "maxConcurrentCalls": 100
+    }
+
+    Only "accountIDs" and "complianceCommand" are required. Evaluations are
+    written to the log as audit events, and a summary of each account
+    is returned.
+    """
+    def parse_scan_event(event: dict):
+        '''
+            Parse the payload, validate it, and return the
+            relevant fields
+        '''
+        try:
+            account_ids = [str(account_id)
+                           for account_id in event["accountIDs"]]
+            compliance_commands = [command.strip() for command in event["complianceCommand"].split(",")
+                                   if command.strip() != ""]
+            inventory_source = event.get("inventorySource", "SERVICE")
+            max_concurrent_accounts = int(event.get(
+                "maxConcurrentAccounts", organization_scan.ACCOUNT_CONCURRENCY))
+            max_concurrent_calls = int(event.get(
+                "maxConcurrentCalls", organization_scan.TOTAL_CONCURRENCY))
+        except Exception as e:
+            raise ValidationError(
+                "Could not parse function payload, because one or more fields were invalid", e)
+
+        return (account_ids, compliance_commands, inventory_source, max_concurrent_accounts, max_concurrent_calls)
+
+    log.info("Organization Scan Handler was invoked")
+    METRICS.reset()
+    SUMMARY.reset()
+
+    try:
+        (account_ids, compliance_commands, inventory_source,
+         max_concurrent_accounts, max_concurrent_calls) = parse_scan_event(event)
+
+        log.info("Evaluating command(s): %s across %d AWS Account(s)",
+                 ", ".join(compliance_commands), len(account_ids))
+
+        with METRICS.span("scan"):
+            summaries = organization_scan.scan_accounts(
+                account_ids, compliance_commands, inventory_source,
+                max_concurrent_accounts=max_concurrent_accounts,
+                max_concurrent_calls=max_concurrent_calls)
+
+        for summary in summaries:
+            if summary["status"] == "SUCCEEDED":
+                for (compliance_type, count) in summary["complianceTypes"].items():
+                    SUMMARY.count(compliance_type, count)
+            else:
+                SUMMARY.record_failure(summary["accountID"], summary["error"])
+
+        log.info("Credential cache hits: %d, misses: %d",
+                 CREDENTIAL_CACHE.hits, CREDENTIAL_CACHE.misses)
+    except Exception as e:
+        log.error(
+            "There was an error scanning the organization, because: %s", str(e))
+        log.error("Function Payload: %s", str(event))
+        raise e
+    finally:
+        name = function_name(context, "compliance-organization-scan")
+        SUMMARY.log_summary(name, METRICS.span_durations())
+        METRICS.flush({"FunctionName": name})
+
+    return {
+        "succeeded": len([summary for summary in summaries if summary["status"] == "SUCCEEDED"]),
+        "failed": len([summary for summary in summaries if summary["status"] == "FAILED"]),
+        "accounts": summaries
+    }
@@ -1,16 +1,51 @@
 """Author: Mark Hanegraaff -- 2021
 """
-import boto3
 import json
-from aws_connector.aws_client import AWSClient
+from aws_connector.aws_client import AWSClient, LazyAWSClient, CREDENTIAL_CACHE, MAX_POOL_CONNECTIONS
 from exception.exceptions import ValidationError
+from support.concurrency import bounded_map
+from support.metrics import METRICS, function_name
 import compliance.factory as factory
 
 import logging
 from support import logging_definition
+from support.logging_definition import RESOURCE_LOG, SUMMARY
 
 log = logging.getLogger()
 
+# The number of resources remediated concurrently by a batch payload
+REMEDIATION_CONCURRENCY = MAX_POOL_CONNECTIONS
+
+
+def execution_role_arn(remediation_account_id: str):
+    '''
+        Returns the arn of the role assumed to remediate resources
+        in the supplied account
+    '''
+    return 'arn:aws:iam::%s:role/role-compliance-generic-remediation' % remediation_account_id
+
+
+def parse_remediation_entry(resource: dict):
+    '''
+        Validates an entry of a batch payload and returns its
+        (resource_id, remediation_account_id, compliance_command).
+        Account ids may also be supplied as numbers.
+    '''
+    if not isinstance(resource, dict):
+        raise ValidationError("Resource entries must be objects", None)
+
+    remediation_account_id = resource.get("remediationAccountID", None)
+    if isinstance(remediation_account_id, int) and not isinstance(remediation_account_id, bool):
+        remediation_account_id = str(remediation_account_id)
+
+    entry = (resource.get("resourceID", None), remediation_account_id,
+             resource.get("complianceCommand", None))
+    for (field_name, value) in zip(["resourceID", "remediationAccountID", "complianceCommand"], entry):
+        if not isinstance(value, str):
+            raise ValidationError("'%s' must be a string" % field_name, None)
+
+    return entry
+
 
 def remediate_resource(event, context):
     """
@@ -22,6 +57,9 @@ def remediate_resource(event, context):
         "remediationAccountID" : "999999999999", 
         "complianceCommand" : "S3_ENABLE_VERSIONING"
     }
+
+    Payloads containing a "resources" list are handled as a batch.
+    See remediate_resources.
     """
     def parse_config_event(event: dict):
         '''
@@ -41,20 +79,192 @@ def remediate_resource(event, context):
 
     log.info("Generic Remediation Handler was invoked")
 
+    if "resources" in event:
+        return remediate_resources(event, context)
+
+    METRICS.reset()
+    SUMMARY.reset()
+
     try:
         (resource_id, remediation_account_id,
          compliance_command) = parse_config_event(event)
 
-        log.info("Remediating non-compliant resource: %s, for command: %s in AWS Account: %s" %
-                 (resource_id, compliance_command, remediation_account_id))
-        execution_role_arn = 'arn:aws:iam::%s:role/role-compliance-generic-remediation' % remediation_account_id
+        log.info("Remediating non-compliant resource: %s, for command: %s in AWS Account: %s",
+                 resource_id, compliance_command, remediation_account_id)
+        with METRICS.span("load_modules"):
+            compliance_module = factory.load_compliance_module(
+                compliance_command, execution_role_arn(remediation_account_id), remediation_account_id)
+        with METRICS.span("remediate"):
+            compliance_module.remediate_resource(resource_id)
+        SUMMARY.count("SUCCEEDED")
 
-        compliance_module = factory.load_compliance_module(
-            compliance_command, execution_role_arn, remediation_account_id)
-        compliance_module.remediate_resource(resource_id)
+        log.info("Credential cache hits: %d, misses: %d",
+                 CREDENTIAL_CACHE.hits, CREDENTIAL_CACHE.misses)
 
     except Exception as e:
+        SUMMARY.record_failure(event.get("resourceID", None), e)
         log.error(
-            "There was an error remediating non-compliant resource, because: %s" % str(e))
-        log.error("Function Payload: %s" % str(event))
+            "There was an error remediating non-compliant resource, because: %s", str(e))
+        log.error("Function Payload: %s", str(event))
         raise e
+    finally:
+        log_invocation_end(context)
+
+
+def log_invocation_end(context: object):
+    '''
+        Writes the summary and the metrics of the invocation
+    '''
+    name = function_name(context, "compliance-generic-remediation")
+    SUMMARY.log_summary(name, METRICS.span_durations())
+    METRICS.flush({"FunctionName": name})
+
+
+def remediate_resources(event, context):
+    """
+    Lambda handler that remediates a batch of non-compliant resources, possibly
+    spanning multiple accounts and compliance commands. The lambda function
+    expects a payload like this:
+
+    {
+        "resources": [
+            {
+                "resourceID" : "bucketA",
+                "remediationAccountID" : "999999999999",
+                "complianceCommand" : "S3_ENABLE_VERSIONING"
+            },
+            ...
+        ]
+    }
+
+    Resources are grouped by account so that a single assume-role operation
+    takes place per account, and are remediated concurrently. A failure to
+    remediate a resource does not fail the batch. Instead the result of each
+    resource is returned in the order of the payload, e.g.
+
+    {
+        "succeeded": 1,
+        "failed": 1,
+        "results": [
+            {"resourceID": "bucketA", ..., "status": "SUCCEEDED"},
+            {"resourceID": "bucketB", ..., "status": "FAILED", "error": "..."}
+        ]
+    }
+    """
+    log.info("Generic Batch Remediation Handler was invoked")
+    METRICS.reset()
+    SUMMARY.reset()
+
+    try:
+        return remediate_resource_batch(event)
+    finally:
+        log_invocation_end(context)
+
+
+def remediate_resource_batch(event: dict):
+    '''
+        Remediates the resources of a batch payload and returns the
+        result of each one. See remediate_resources
+    '''
+    try:
+        resources = event["resources"]
+        if not isinstance(resources, list):
+            raise ValidationError("'resources' must be a list", None)
+    except Exception as e:
+        log.error("Function Payload: %s", event)
+        raise ValidationError(
+            "Could not parse function payload, because the resource list was invalid", e)
+
+    # Load a compliance module for each account and command. Modules
+    # targeting the same account share an AWS session, which is created
+    # by the first worker that needs it. Loading is cheap and happens
+    # before the workers start, since the dictionaries are not thread safe.
+    #
+    # Invalid entries are kept in their place with the reason they could
+    # not be parsed, and reported as failed.
+    remediation_items = []
+    aws_client_objects = {}
+    compliance_modules = {}
+    module_errors = {}
+
+    for resource in resources:
+        try:
+            (resource_id, remediation_account_id, compliance_command) = parse_remediation_entry(resource)
+            module_key = (remediation_account_id, compliance_command)
+        except Exception as e:
+            resource_id = resource.get("resourceID", None) if isinstance(resource, dict) else None
+            remediation_items.append((resource_id, None, None, ValidationError(
+                "Invalid resource entry: %s" % (resource,), e)))
+            continue
+
+        remediation_items.append(
+            (resource_id, remediation_account_id, compliance_command, None))
+        if module_key in compliance_modules or module_key in module_errors:
+            continue
+
+        if remediation_account_id not in aws_client_objects:
+            aws_client_objects[remediation_account_id] = LazyAWSClient(
+                execution_role_arn(remediation_account_id))
+
+        try:
+            with METRICS.span("load_modules"):
+                compliance_modules[module_key] = factory.load_compliance_module(
+                    compliance_command, execution_role_arn(
+                        remediation_account_id), remediation_account_id,
+                    aws_client_object=aws_client_objects[remediation_account_id])
+        except Exception as e:
+            module_errors[module_key] = e
+
+    def remediate_item(remediation_item: tuple):
+        (resource_id, remediation_account_id, compliance_command, entry_error) = remediation_item
+
+        if entry_error is not None:
+            raise entry_error
+
+        module_key = (remediation_account_id, compliance_command)
+        if module_key in module_errors:
+            raise module_errors[module_key]
+
+        RESOURCE_LOG.info("Remediating non-compliant resource: %s, for command: %s in AWS Account: %s",
+                          resource_id, compliance_command, remediation_account_id)
+        with METRICS.span("remediate"):
+            compliance_modules[module_key].remediate_resource(resource_id)
+
+    results = []
+    for (remediation_item, result, exception) in bounded_map(
+            remediate_item, remediation_items, REMEDIATION_CONCURRENCY):
+        (resource_id, remediation_account_id, compliance_command, _) = remediation_item
+
+        if exception is None:
+            SUMMARY.count("SUCCEEDED")
+            results.append({
+                "resourceID": resource_id,
+                "remediationAccountID": remediation_account_id,
+                "complianceCommand": compliance_command,
+                "status": "SUCCEEDED"
+            })
+        else:
+            SUMMARY.record_failure(resource_id, exception)
+            RESOURCE_LOG.warning("Could not remediate resource: %s, because: %s",
+                                 resource_id, exception)
+            results.append({
+                "resourceID": resource_id,
+                "remediationAccountID": remediation_account_id,
+                "complianceCommand": compliance_command,
+                "status": "FAILED",
+                "error": str(exception)
+            })
+
+    failed_count = len(
+        [result for result in results if result["status"] == "FAILED"])
+
+    log.info("Remediated %d of %d resource(s)",
+             len(results) - failed_count, len(results))
+    log.info("Credential cache hits: %d, misses: %d",
+             CREDENTIAL_CACHE.hits, CREDENTIAL_CACHE.misses)
+
+    return {
+        "succeeded": len(results) - failed_count,
+        "failed": failed_count,
+        "results": results
+    }
@@ -0,0 +1,65 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+from abc import ABC, abstractmethod
+
+
+class BaseStateStore(ABC):
+    '''
+        Base Class for all state stores. A state store persists JSON
+        serializable values that are grouped into partitions and addressed
+        by a key within the partition. For example the partition may identify
+        an account and rule, and the key a resource within it.
+
+        Implementations must be safe to use from multiple threads.
+    '''
+
+    @abstractmethod
+    def get_item(self, partition: str, key: str):
+        '''
+            Returns the value stored under the partition and key, or None
+            if one cannot be found.
+        '''
+        pass
+
+    def get_items(self, partition: str, keys: list):
+        '''
+            Returns the values stored under the supplied keys of a partition
+            as a dictionary of key -> value. Keys that cannot be found are
+            omitted. Implementations should override this method to read
+            the keys in batches.
+        '''
+        items = {}
+        for key in keys:
+            value = self.get_item(partition, key)
+            if value is not None:
+                items[key] = value
+        return items
+
+    @abstractmethod
+    def get_partition(self, partition: str):
+        '''
+            Returns all values stored in a partition as a dictionary
+            of key -> value.
+        '''
+        pass
+
+    @abstractmethod
+    def put_items(self, partition: str, items: dict):
+        '''
+            Stores a dictionary of key -> value in a partition, replacing
+            any existing values.
+        '''
+        pass
+
+    @abstractmethod
+    def delete_items(self, partition: str, keys: list):
+        '''
+            Removes the supplied keys from a partition
+        '''
+        pass
+
+    def put_item(self, partition: str, key: str, value: object):
+        '''
+            Stores a single value in a partition
+        '''
+        self.put_items(partition, {key: value})
@@ -0,0 +1,120 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ChangeEventCache():
+    '''
+        Remembers the configuration state of each resource whose evaluation
+        was published by a rule, so that configuration change notifications
+        redelivered for the same state are not evaluated and published again.
+
+        A configuration state is identified by the 'configurationStateId' and
+        'configurationStateMd5Hash' of the configuration item. States are kept
+        in memory for the life of the container, and optionally in a state
+        store shared by all containers, in a partition named after the
+        account and rule and keyed by resource type and id. Entries expire
+        after 'ttl_seconds', so that a resource is eventually re-evaluated
+        even when its state does not change.
+    '''
+
+    DEFAULT_TTL_SECONDS = 3600
+    DEFAULT_MAX_SIZE = 10000
+
+    def __init__(self, state_store: object = None, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                 max_size: int = DEFAULT_MAX_SIZE):
+        self.state_store = state_store
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+
+        self.lock = threading.Lock()
+        self.published_states = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def partition(self, aws_account_id: str, rule_name: str):
+        return "change-events|%s|%s" % (aws_account_id, rule_name)
+
+    def resource_key(self, configuration_item: dict):
+        return "%s|%s" % (configuration_item['resourceType'], configuration_item['resourceId'])
+
+    def configuration_state(self, configuration_item: dict):
+        '''
+            Returns the identifier of the configuration state described by a
+            configuration item, or None if the item does not carry one
+        '''
+        state_id = configuration_item.get('configurationStateId', None)
+        state_md5_hash = configuration_item.get(
+            'configurationStateMd5Hash', None)
+
+        if state_id is None and not state_md5_hash:
+            return None
+        return "%s|%s" % (state_id, state_md5_hash or "")
+
+    def is_current(self, published_state: list, configuration_state: str):
+        '''
+            Returns True if a published state matches the configuration
+            state and has not expired
+        '''
+        return published_state is not None and \
+            published_state[0] == configuration_state and \
+            time.time() - published_state[1] < self.ttl_seconds
+
+    def is_published(self, aws_account_id: str, rule_name: str, configuration_item: dict):
+        '''
+            Returns True if the evaluation of the configuration item's state
+            was already published by the rule
+        '''
+        configuration_state = self.configuration_state(configuration_item)
+        if configuration_state is None:
+            return False
+
+        partition = self.partition(aws_account_id, rule_name)
+        resource_key = self.resource_key(configuration_item)
+        cache_key = (partition, resource_key)
+
+        with self.lock:
+            published_state = self.published_states.get(cache_key, None)
+            if published_state is not None:
+                self.published_states.move_to_end(cache_key)
+
+        is_published = self.is_current(published_state, configuration_state)
+
+        # the state may have been published by another container
+        if not is_published and self.state_store is not None:
+            is_published = self.is_current(self.state_store.get_item(
+                partition, resource_key), configuration_state)
+
+        with self.lock:
+            if is_published:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return is_published
+
+    def record_published(self, aws_account_id: str, rule_name: str, configuration_item: dict):
+        '''
+            Records that the evaluation of the configuration item's state
+            was published by the rule
+        '''
+        configuration_state = self.configuration_state(configuration_item)
+        if configuration_state is None:
+            return
+
+        partition = self.partition(aws_account_id, rule_name)
+        resource_key = self.resource_key(configuration_item)
+        published_state = [configuration_state, time.time()]
+
+        with self.lock:
+            self.published_states[(partition, resource_key)] = published_state
+            self.published_states.move_to_end((partition, resource_key))
+            while len(self.published_states) > self.max_size:
+                self.published_states.popitem(last=False)
+
+        if self.state_store is not None:
+            self.state_store.put_item(
+                partition, resource_key, published_state)
@@ -0,0 +1,164 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+import json
+import time
+import aws_connector.rate_limiter as rate_limiter
+from state.base_store import BaseStateStore
+from exception.exceptions import StateStoreError
+
+
+class DynamoDBStateStore(BaseStateStore):
+    '''
+        A state store backed by a DynamoDB table, which can be shared by all
+        Lambda containers. The table must use a string partition key named
+        "partition" and a string sort key named "key". Values are stored as
+        JSON strings in the "value" attribute.
+
+        Any object exposing the get_item, batch_get_item, query and
+        batch_write_item methods of the boto DynamoDB client may be supplied
+        as the client.
+
+        Please see BaseStateStore for additional documentation
+    '''
+
+    # The maximum number of items accepted by a single batch_write_item call
+    MAX_ITEMS_PER_BATCH = 25
+
+    # The maximum number of keys accepted by a single batch_get_item call
+    MAX_KEYS_PER_BATCH = 100
+
+    # The number of times unprocessed items are resubmitted
+    MAX_BATCH_ATTEMPTS = 5
+
+    def __init__(self, boto_dynamodb_client: object, table_name: str):
+        self.boto_dynamodb_client = boto_dynamodb_client
+        self.table_name = table_name
+
+    def get_item(self, partition: str, key: str):
+        try:
+            response = rate_limiter.call(
+                self.boto_dynamodb_client, "dynamodb", "GetItem",
+                TableName=self.table_name,
+                Key={
+                    'partition': {'S': partition},
+                    'key': {'S': key}
+                }
+            )
+        except Exception as e:
+            raise StateStoreError(
+                "Could not read item from table: %s" % self.table_name, e)
+
+        if 'Item' not in response:
+            return None
+        return json.loads(response['Item']['value']['S'])
+
+    def get_items(self, partition: str, keys: list):
+        '''
+            Reads the keys in batches, resubmitting any unprocessed keys
+            with a growing delay
+        '''
+        items = {}
+        for i in range(0, len(keys), self.MAX_KEYS_PER_BATCH):
+            request = {
+                'Keys': [{
+                    'partition': {'S': partition},
+                    'key': {'S': key}
+                } for key in keys[i:i + self.MAX_KEYS_PER_BATCH]]
+            }
+
+            for attempt in range(self.MAX_BATCH_ATTEMPTS):
+                try:
+                    response = rate_limiter.call(
+                        self.boto_dynamodb_client, "dynamodb", "BatchGetItem",
+                        RequestItems={self.table_name: request})
+                except Exception as e:
+                    raise StateStoreError(
+                        "Could not read items from table: %s" % self.table_name, e)
+
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    items[item['key']['S']] = json.loads(item['value']['S'])
+
+                request = response.get('UnprocessedKeys', {}).get(
+                    self.table_name, None)
+                if request is None or len(request.get('Keys', [])) == 0:
+                    break
+                time.sleep(0.1 * (2 ** attempt))
+            else:
+                raise StateStoreError("%d item(s) could not be read from table: %s" %
+                                      (len(request['Keys']), self.table_name), None)
+
+        return items
+
+    def get_partition(self, partition: str):
+        items = {}
+        query_args = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': '#p = :p',
+            'ExpressionAttributeNames': {'#p': 'partition'},
+            'ExpressionAttributeValues': {':p': {'S': partition}}
+        }
+
+        try:
+            while True:
+                response = rate_limiter.call(
+                    self.boto_dynamodb_client, "dynamodb", "Query", **query_args)
+
+                for item in response.get('Items', []):
+                    items[item['key']['S']] = json.loads(item['value']['S'])
+
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            raise StateStoreError(
+                "Could not read partition from table: %s" % self.table_name, e)
+
+        return items
+
+    def put_items(self, partition: str, items: dict):
+        self.batch_write([{
+            'PutRequest': {
+                'Item': {
+                    'partition': {'S': partition},
+                    'key': {'S': key},
+                    'value': {'S': json.dumps(value)}
+                }
+            }
+        } for (key, value) in items.items()])
+
+    def delete_items(self, partition: str, keys: list):
+        self.batch_write([{
+            'DeleteRequest': {
+                'Key': {
+                    'partition': {'S': partition},
+                    'key': {'S': key}
+                }
+            }
+        } for key in keys])
+
+    def batch_write(self, write_requests: list):
+        '''
+            Submits write requests in batches, resubmitting any unprocessed
+            items with a growing delay
+        '''
+        for i in range(0, len(write_requests), self.MAX_ITEMS_PER_BATCH):
+            batch = write_requests[i:i + self.MAX_ITEMS_PER_BATCH]
+
+            for attempt in range(self.MAX_BATCH_ATTEMPTS):
+                try:
+                    response = rate_limiter.call(
+                        self.boto_dynamodb_client, "dynamodb", "BatchWriteItem",
+                        RequestItems={self.table_name: batch})
+                except Exception as e:
+                    raise StateStoreError(
+                        "Could not write items to table: %s" % self.table_name, e)
+
+                batch = response.get('UnprocessedItems', {}).get(
+                    self.table_name, [])
+                if len(batch) == 0:
+                    break
+                time.sleep(0.1 * (2 ** attempt))
+
+            if len(batch) > 0:
+                raise StateStoreError("%d item(s) could not be written to table: %s" %
+                                      (len(batch), self.table_name), None)
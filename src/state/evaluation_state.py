@@ -0,0 +1,97 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+import time
+import itertools
+import logging
+from support import logging_definition
+from compliance.evaluation import Evaluation
+
+log = logging.getLogger()
+
+
+class EvaluationStateTracker():
+    '''
+        Tracks the compliance status last published for each resource
+        evaluated by a rule in an account, so that scheduled runs only need
+        to publish the evaluations that changed. A full refresh, in which
+        every evaluation is published, is due every 'full_refresh_seconds'.
+
+        The published state is kept in a state store partition named after
+        the account and rule, keyed by resource type and id.
+    '''
+
+    DEFAULT_FULL_REFRESH_SECONDS = 86400
+
+    # The number of evaluations whose published state is read at once
+    LOOKUP_BATCH_SIZE = 100
+
+    FULL_REFRESH_PARTITION = "full-refresh"
+
+    def __init__(self, state_store: object, aws_account_id: str, rule_name: str,
+                 full_refresh_seconds: int = DEFAULT_FULL_REFRESH_SECONDS):
+        self.state_store = state_store
+        self.partition = "evaluations|%s|%s" % (aws_account_id, rule_name)
+        self.full_refresh_seconds = full_refresh_seconds
+
+    def resource_key(self, evaluation: Evaluation):
+        return "%s|%s" % (evaluation.resource_type, evaluation.resource_id)
+
+    def resource_state(self, evaluation: Evaluation):
+        return [evaluation.compliance_type, evaluation.annotation]
+
+    def full_refresh_due(self):
+        '''
+            Returns True if every evaluation should be published, because
+            the last full refresh is older than the refresh period.
+        '''
+        last_full_refresh = self.state_store.get_item(
+            self.FULL_REFRESH_PARTITION, self.partition)
+
+        if last_full_refresh is None:
+            return True
+        return time.time() - last_full_refresh >= self.full_refresh_seconds
+
+    def changed_evaluations(self, evaluations: object):
+        '''
+            Consumes an iterable of Evaluation records and yields the ones whose
+            compliance type or annotation differ from the ones last published.
+            The published state is read in batches of LOOKUP_BATCH_SIZE, so
+            only the state of the resources evaluated is loaded.
+        '''
+        evaluations = iter(evaluations)
+
+        evaluation_count = 0
+        changed_count = 0
+        while True:
+            batch = list(itertools.islice(evaluations, self.LOOKUP_BATCH_SIZE))
+            if len(batch) == 0:
+                break
+
+            evaluation_count += len(batch)
+            published_state = self.state_store.get_items(
+                self.partition, [self.resource_key(evaluation) for evaluation in batch])
+
+            for evaluation in batch:
+                if published_state.get(self.resource_key(evaluation), None) != \
+                        self.resource_state(evaluation):
+                    changed_count += 1
+                    yield evaluation
+
+        log.info("%d of %d evaluation(s) changed since they were last published",
+                 changed_count, evaluation_count)
+
+    def record_evaluations(self, evaluations: list):
+        '''
+            Records the evaluations as published
+        '''
+        self.state_store.put_items(self.partition, {
+            self.resource_key(evaluation): self.resource_state(evaluation)
+            for evaluation in evaluations
+        })
+
+    def record_full_refresh(self):
+        '''
+            Records that a full refresh was published
+        '''
+        self.state_store.put_item(
+            self.FULL_REFRESH_PARTITION, self.partition, time.time())
@@ -0,0 +1,33 @@
+"""Author: Mark Hanegraaff -- 2021
+
+This module contains a small factory capable of generating state store
+objects based on a store type
+"""
+
+from exception.exceptions import NotSupportedError
+
+
+def load_state_store(store_type: str, location: str = None):
+    '''
+        Returns a state store given its type. The location is the database
+        path for "SQLITE" stores and the table name for "DYNAMODB" stores.
+        If the store type is not supported, raise a NotSupported error
+    '''
+
+    # stores are imported when loaded, so that functions that do not use
+    # them are not slowed down by their dependencies
+    if store_type == "SQLITE":
+        from state.sqlite_store import SQLiteStateStore
+
+        if location is None:
+            return SQLiteStateStore()
+        return SQLiteStateStore(location)
+    elif store_type == "DYNAMODB":
+        from aws_connector.aws_client import AWSClient
+        from state.dynamodb_store import DynamoDBStateStore
+
+        # The table is hosted in the master account, so no assume role is needed
+        return DynamoDBStateStore(AWSClient().get_boto_client('dynamodb'), location)
+    else:
+        raise NotSupportedError(
+            "Unknown state store type: %s" % store_type, None)
@@ -0,0 +1,80 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+import time
+import logging
+from support import logging_definition
+
+log = logging.getLogger()
+
+
+class ScanCheckpoint():
+    '''
+        Records how far a scheduled scan of an account got before it ran out
+        of time, so that the next invocation resumes it rather than starting
+        over. Scans are resumed after the id of the last resource evaluated,
+        which requires the resources to be scanned in ascending id order.
+
+        Checkpoints are kept in a state store partition shared by all rules,
+        keyed by account and rule. Besides the cursor, a checkpoint holds the
+        partial state of the scan and the ids of the resources before the
+        cursor that could not be evaluated, which are retried on resume, e.g.
+
+        {
+            "cursor": "bucketM",
+            "failed": ["bucketC"],
+            "evaluated": 25000,
+            "full_refresh": true,
+            "started": 1614556800.0,
+            "invocations": 2
+        }
+    '''
+
+    PARTITION = "scan-checkpoints"
+
+    def __init__(self, state_store: object, aws_account_id: str, rule_name: str):
+        self.state_store = state_store
+        self.key = "%s|%s" % (aws_account_id, rule_name)
+
+    def load(self):
+        '''
+            Returns the checkpoint of an interrupted scan, or None if the
+            last scan completed
+        '''
+        return self.state_store.get_item(self.PARTITION, self.key)
+
+    def save(self, checkpoint: dict, cursor: str, evaluated_count: int, full_refresh: bool,
+             failed_resource_ids: list = None):
+        '''
+            Records the progress of an interrupted scan. 'checkpoint' is the
+            checkpoint the scan resumed from, or None for a new scan, and
+            'evaluated_count' the number of resources evaluated since then.
+            'failed_resource_ids' are the resources before the cursor that
+            could not be evaluated. Returns the new checkpoint.
+        '''
+        if checkpoint is None:
+            checkpoint = {
+                "evaluated": 0,
+                "started": time.time(),
+                "invocations": 0
+            }
+
+        new_checkpoint = {
+            "cursor": cursor,
+            "failed": failed_resource_ids or [],
+            "evaluated": checkpoint["evaluated"] + evaluated_count,
+            "full_refresh": full_refresh,
+            "started": checkpoint["started"],
+            "invocations": checkpoint["invocations"] + 1
+        }
+        self.state_store.put_item(self.PARTITION, self.key, new_checkpoint)
+
+        log.info("Saved scan checkpoint after resource: %s (%d resource(s) evaluated in %d invocation(s))",
+                 cursor, new_checkpoint["evaluated"], new_checkpoint["invocations"])
+
+        return new_checkpoint
+
+    def clear(self):
+        '''
+            Removes the checkpoint once the scan completed
+        '''
+        self.state_store.delete_items(self.PARTITION, [self.key])
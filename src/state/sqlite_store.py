@@ -0,0 +1,81 @@
+"""Author: Mark Hanegraaff -- 2021
+"""
+import json
+import sqlite3
+import threading
+from state.base_store import BaseStateStore
+from exception.exceptions import StateStoreError
+
+
+class SQLiteStateStore(BaseStateStore):
+    '''
+        A state store backed by a local SQLite database. When the database
+        is located in /tmp its contents survive warm Lambda invocations.
+
+        Please see BaseStateStore for additional documentation
+    '''
+
+    DEFAULT_DATABASE_PATH = "/tmp/compliance-state.db"
+
+    # The number of keys read by a single query, which must stay below
+    # the number of parameters SQLite accepts in a statement
+    MAX_KEYS_PER_QUERY = 500
+
+    def __init__(self, database_path: str = DEFAULT_DATABASE_PATH):
+        try:
+            self.connection = sqlite3.connect(
+                database_path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS state "
+                "(partition TEXT, key TEXT, value TEXT, PRIMARY KEY (partition, key))")
+            self.connection.commit()
+        except Exception as e:
+            raise StateStoreError(
+                "Could not open state database: %s" % database_path, e)
+
+        self.lock = threading.Lock()
+
+    def get_item(self, partition: str, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM state WHERE partition = ? AND key = ?",
+                (partition, key)).fetchone()
+
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_items(self, partition: str, keys: list):
+        rows = []
+        with self.lock:
+            for i in range(0, len(keys), self.MAX_KEYS_PER_QUERY):
+                batch = keys[i:i + self.MAX_KEYS_PER_QUERY]
+                rows += self.connection.execute(
+                    "SELECT key, value FROM state WHERE partition = ? AND key IN (%s)" %
+                    ", ".join(["?"] * len(batch)), [partition] + batch).fetchall()
+
+        return {key: json.loads(value) for (key, value) in rows}
+
+    def get_partition(self, partition: str):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, value FROM state WHERE partition = ?",
+                (partition,)).fetchall()
+
+        return {key: json.loads(value) for (key, value) in rows}
+
+    def put_items(self, partition: str, items: dict):
+        rows = [(partition, key, json.dumps(value))
+                for (key, value) in items.items()]
+
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO state (partition, key, value) VALUES (?, ?, ?)", rows)
+            self.connection.commit()
+
+    def delete_items(self, partition: str, keys: list):
+        with self.lock:
+            self.connection.executemany(
+                "DELETE FROM state WHERE partition = ? AND key = ?",
+                [(partition, key) for key in keys])
+            self.connection.commit()
@@ -0,0 +1,58 @@
+"""Author: Mark Hanegraaff -- 2021
+This module contains helpers used to run AWS calls concurrently
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+
+def chunked(items: object, size: int):
+    '''
+        Consumes an iterable and yields its items as lists no larger
+        than 'size'. E.g. with a size of 100
+
+        [item1, item2 ... item100], [item101, ...]
+    '''
+    items = iter(items)
+
+    while True:
+        batch = list(islice(items, size))
+        if len(batch) == 0:
+            return
+        yield batch
+
+
+def bounded_map(function: object, items: object, max_workers: int):
+    '''
+        Applies a function to each item of an iterable using a pool of at most
+        'max_workers' threads, and yields an (item, result, exception) tuple
+        for each one, in the order of the items. The exception is None unless
+        the function raised one.
+
+        Only a small window of items is processed ahead of the consumer, so
+        memory use does not depend on the number of items. A 'max_workers'
+        value of 1 applies the function sequentially on the calling thread.
+    '''
+    def call(item: object):
+        try:
+            return (item, function(item), None)
+        except Exception as e:
+            return (item, None, e)
+
+    if max_workers <= 1:
+        for item in items:
+            yield call(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+
+        for item in items:
+            pending.append(executor.submit(call, item))
+
+            # keep the pool busy while the oldest results are consumed
+            if len(pending) >= max_workers * 2:
+                yield pending.popleft().result()
+
+        while len(pending) > 0:
+            yield pending.popleft().result()
@@ -1,8 +1,19 @@
 """Author: Mark Hanegraaff -- 2021
 This module initializes the logger, so that it can produce consistent logging
 across all services
+
+Lines describing a single resource are written through RESOURCE_LOG, which
+only keeps a sample of them when "COMPLIANCE_APP_RESOURCE_LOG_SAMPLE_RATE"
+is set below 1, so that log volume does not grow with the size of an
+account. Each invocation instead ends with a single summary line, written
+by SUMMARY, with the count of each outcome, the failures and the timings.
 """
+import json
 import logging
+import os
+import random
+import threading
+import time
 
 # fix for aws Lambda
 ROOT = logging.getLogger()
@@ -12,3 +23,130 @@ if ROOT.handlers:
 #
 
 logging.basicConfig(level=logging.INFO, format='[%(levelname)s] - %(message)s')
+
+# The fraction of per-resource lines that are logged, between 0 and 1
+RESOURCE_LOG_SAMPLE_RATE = float(os.environ.get(
+    "COMPLIANCE_APP_RESOURCE_LOG_SAMPLE_RATE", 1.0))
+
+# The maximum number of failures listed by an invocation summary
+MAX_SUMMARY_FAILURES = 100
+
+
+class SampledLogger():
+    '''
+        Writes a random sample of the lines it is given to a logger. Lines
+        are formatted lazily, so lines that are not sampled cost neither
+        formatting nor I/O, e.g.
+
+        RESOURCE_LOG.info("%s - %s -> %s", resource_id, module_name, compliance_type)
+    '''
+
+    def __init__(self, logger: logging.Logger, sample_rate: float = RESOURCE_LOG_SAMPLE_RATE):
+        self.logger = logger
+        self.sample_rate = sample_rate
+
+    def sampled(self):
+        '''
+            Returns True if the next line should be logged
+        '''
+        if self.sample_rate >= 1.0:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def info(self, message: str, *args):
+        if self.sampled():
+            self.logger.info(message, *args)
+
+    def warning(self, message: str, *args):
+        if self.sampled():
+            self.logger.warning(message, *args)
+
+
+class InvocationSummary():
+    '''
+        Collects the outcome of a single invocation: a count of each outcome,
+        e.g. each compliance type, and the resources that failed. It is
+        written as one JSON line when the invocation ends.
+
+        Outcomes may be recorded concurrently by worker threads.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+            Discards the outcomes recorded so far, and restarts the clock
+        '''
+        with self.lock:
+            self.start_time = time.perf_counter()
+            self.counts = {}
+            self.failures = []
+            self.failure_count = 0
+
+    def count(self, outcome: str, amount: int = 1):
+        '''
+            Adds to the count of an outcome
+        '''
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + amount
+
+    def count_evaluations(self, evaluations: object):
+        '''
+            Consumes an iterable of evaluations and yields each of them,
+            counting them by compliance type
+        '''
+        counts = {}
+        try:
+            for evaluation in evaluations:
+                counts[evaluation.compliance_type] = counts.get(
+                    evaluation.compliance_type, 0) + 1
+                yield evaluation
+        finally:
+            for (compliance_type, amount) in counts.items():
+                self.count(compliance_type, amount)
+
+    def record_failure(self, resource_id: str, error: object):
+        '''
+            Records a resource that could not be processed. Only the first
+            MAX_SUMMARY_FAILURES failures are listed.
+        '''
+        with self.lock:
+            self.failure_count += 1
+            if len(self.failures) < MAX_SUMMARY_FAILURES:
+                self.failures.append(
+                    {"resource_id": str(resource_id), "error": str(error)})
+
+    def summary(self, function_name: str, timings: dict = None):
+        '''
+            Returns the summary of the invocation as a dictionary
+        '''
+        with self.lock:
+            timings_ms = {name: round(duration_ms, 3)
+                          for (name, duration_ms) in (timings or {}).items()}
+            timings_ms['total'] = round(
+                (time.perf_counter() - self.start_time) * 1000.0, 3)
+
+            return {
+                "function": function_name,
+                "counts": dict(self.counts),
+                "failure_count": self.failure_count,
+                "failures": list(self.failures),
+                "timings_ms": timings_ms
+            }
+
+    def log_summary(self, function_name: str, timings: dict = None):
+        '''
+            Writes the summary of the invocation as a single log line, e.g.
+
+            SUMMARY {"function": "compliance-generic-rule", "counts": {"COMPLIANT": 980, ...}, ...}
+        '''
+        logging.getLogger().info("SUMMARY %s", json.dumps(
+            self.summary(function_name, timings)))
+
+
+# The per-resource log, and the summary of the current invocation,
+# shared by all modules
+RESOURCE_LOG = SampledLogger(logging.getLogger())
+SUMMARY = InvocationSummary()
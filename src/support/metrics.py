@@ -0,0 +1,235 @@
+"""Author: Mark Hanegraaff -- 2021
+This module records timing spans and AWS call metrics during a Lambda
+invocation, and writes them as CloudWatch Embedded Metric Format (EMF) log
+lines when the invocation ends.
+
+Metrics are only written when the "COMPLIANCE_APP_METRICS" environment
+variable is set to "true". Otherwise AWS calls are timed by a shared object
+that does nothing, while spans, of which there are only a few per invocation,
+are still timed for the invocation summary (see support/logging_definition).
+"""
+import json
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get(
+    "COMPLIANCE_APP_METRICS", "false").lower() == "true"
+METRICS_NAMESPACE = os.environ.get(
+    "COMPLIANCE_APP_METRICS_NAMESPACE", "ContinuousCompliance")
+
+# The latency percentiles reported for each AWS operation
+LATENCY_PERCENTILES = [50, 90, 99]
+
+
+class NullTimer():
+    '''
+        A context manager that does nothing, returned when
+        metrics are disabled
+    '''
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer():
+    '''
+        A context manager that measures the duration of a block and
+        reports it to a callback, along with the exception it raised
+    '''
+    __slots__ = ['callback', 'start_time']
+
+    def __init__(self, callback: object):
+        self.callback = callback
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.callback((time.perf_counter() - self.start_time)
+                      * 1000.0, exc_value)
+        return False
+
+
+class InvocationMetrics():
+    '''
+        Collects the metrics of a single invocation. Spans measure the
+        phases of a handler, e.g. "evaluate", while calls measure each AWS
+        operation, e.g. "s3:GetBucketVersioning", and keep every latency so
+        that percentiles can be reported.
+
+        Calls may be recorded concurrently by worker threads.
+    '''
+
+    def __init__(self, enabled: bool = METRICS_ENABLED, namespace: str = METRICS_NAMESPACE):
+        self.enabled = enabled
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+            Discards all metrics recorded so far
+        '''
+        with self.lock:
+            self.spans = {}
+            self.calls = {}
+
+    def span(self, span_name: str):
+        '''
+            Returns a context manager timing a phase of the invocation, e.g.
+
+            with METRICS.span("publish"):
+                ...
+        '''
+        return Timer(lambda duration_ms, exception: self.record_span(span_name, duration_ms))
+
+    def aws_call(self, service_name: str, operation_name: str):
+        '''
+            Returns a context manager timing a single AWS call, e.g.
+
+            with METRICS.aws_call("s3", "GetBucketVersioning"):
+                boto_s3_client.get_bucket_versioning(Bucket=bucket_name)
+        '''
+        if not self.enabled:
+            return NULL_TIMER
+
+        call_name = "%s:%s" % (service_name, operation_name)
+        return Timer(lambda duration_ms, exception: self.record_aws_call(call_name, duration_ms, exception))
+
+    def record_span(self, span_name: str, duration_ms: float):
+        '''
+            Adds the duration of a span
+        '''
+        with self.lock:
+            (count, total_ms) = self.spans.get(span_name, (0, 0.0))
+            self.spans[span_name] = (count + 1, total_ms + duration_ms)
+
+    def record_aws_call(self, call_name: str, duration_ms: float, exception: Exception = None):
+        '''
+            Adds the latency and outcome of an AWS call
+        '''
+        throttled = False
+        if exception is not None:
+            error_code = getattr(exception, 'response', {}).get(
+                'Error', {}).get('Code', '')
+            throttled = 'throttl' in error_code.lower() or error_code in [
+                'SlowDown', 'TooManyRequestsException', 'RequestLimitExceeded']
+
+        with self.lock:
+            call_metrics = self.calls.setdefault(call_name, {
+                "latencies": [],
+                "errors": 0,
+                "throttles": 0
+            })
+            call_metrics['latencies'].append(duration_ms)
+            if exception is not None:
+                call_metrics['errors'] += 1
+            if throttled:
+                call_metrics['throttles'] += 1
+
+    def span_durations(self):
+        '''
+            Returns the total duration of each span in milliseconds
+        '''
+        with self.lock:
+            return {span_name: total_ms for (span_name, (count, total_ms)) in self.spans.items()}
+
+    def emf_documents(self, dimensions: dict):
+        '''
+            Returns the recorded metrics as a list of EMF documents: one per
+            AWS operation and one per span, each carrying the supplied
+            dimensions, e.g. {"FunctionName": "compliance-generic-rule"}
+        '''
+        timestamp = int(time.time() * 1000)
+        dimension_names = list(dimensions.keys())
+        documents = []
+
+        def emf_document(dimension_name: str, dimension_value: str, metric_values: list):
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [dimension_names + [dimension_name]],
+                        "Metrics": [{"Name": name, "Unit": unit} for (name, unit, value) in metric_values]
+                    }]
+                },
+                dimension_name: dimension_value
+            }
+            document.update(dimensions)
+            for (name, unit, value) in metric_values:
+                document[name] = value
+            return document
+
+        with self.lock:
+            for (call_name, call_metrics) in sorted(self.calls.items()):
+                latencies = sorted(call_metrics['latencies'])
+                metric_values = [
+                    ("Calls", "Count", len(latencies)),
+                    ("Errors", "Count", call_metrics['errors']),
+                    ("Throttles", "Count", call_metrics['throttles'])
+                ]
+                for percentile in LATENCY_PERCENTILES:
+                    metric_values.append(("LatencyP%d" % percentile, "Milliseconds",
+                                          round(percentile_value(latencies, percentile), 3)))
+                metric_values.append(
+                    ("LatencyMax", "Milliseconds", round(latencies[-1], 3)))
+
+                documents.append(emf_document(
+                    "Operation", call_name, metric_values))
+
+            for (span_name, (count, total_ms)) in sorted(self.spans.items()):
+                documents.append(emf_document("Span", span_name, [
+                    ("Count", "Count", count),
+                    ("Duration", "Milliseconds", round(total_ms, 3))
+                ]))
+
+        return documents
+
+    def flush(self, dimensions: dict):
+        '''
+            Writes the recorded metrics to standard output as EMF log lines,
+            where Lambda forwards them to CloudWatch, and resets them.
+            EMF lines must be plain JSON, so the logger is not used.
+        '''
+        if not self.enabled:
+            return
+
+        for document in self.emf_documents(dimensions):
+            print(json.dumps(document), flush=True)
+
+        self.reset()
+
+
+def percentile_value(sorted_values: list, percentile: int):
+    '''
+        Returns the nearest-rank percentile of a sorted list of values
+    '''
+    if len(sorted_values) == 0:
+        return 0.0
+
+    rank = max(0, min(len(sorted_values) - 1,
+                      int(round(percentile / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def function_name(context: object, default_name: str):
+    '''
+        Returns the name of the Lambda function from the invocation
+        context, or the default name when running locally
+    '''
+    return getattr(context, 'function_name', default_name)
+
+
+# The metrics of the current invocation, shared by all modules
+METRICS = InvocationMetrics()
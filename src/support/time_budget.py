@@ -0,0 +1,75 @@
+"""Author: Mark Hanegraaff -- 2021
+This module contains the time budget of a Lambda invocation, used to stop
+long running scans before the function times out
+"""
+import time
+
+
+class TimeBudget():
+    '''
+        Tracks the time left to a Lambda invocation, less a reserve kept for
+        the work that follows a scan, such as publishing the last evaluations
+        and saving a checkpoint.
+
+        Invocations without a deadline, for example local runs, have an
+        unlimited budget.
+    '''
+
+    DEFAULT_RESERVE_SECONDS = 30
+
+    def __init__(self, deadline: float = None, reserve_seconds: float = DEFAULT_RESERVE_SECONDS):
+        self.deadline = deadline
+        self.reserve_seconds = reserve_seconds
+        self.interrupted = False
+        self.last_item = None
+        self.item_count = 0
+
+    @classmethod
+    def from_context(cls, context: object, reserve_seconds: float = DEFAULT_RESERVE_SECONDS):
+        '''
+            Returns the time budget of the invocation described by a Lambda
+            context, using its get_remaining_time_in_millis method
+        '''
+        get_remaining_time = getattr(
+            context, 'get_remaining_time_in_millis', None)
+        if get_remaining_time is None:
+            return cls(None, reserve_seconds)
+
+        return cls(time.monotonic() + get_remaining_time() / 1000.0, reserve_seconds)
+
+    def remaining_seconds(self):
+        '''
+            Returns the number of seconds left before the reserve,
+            or None if the budget is unlimited
+        '''
+        if self.deadline is None:
+            return None
+        return self.deadline - self.reserve_seconds - time.monotonic()
+
+    def expired(self):
+        '''
+            Returns True if the time left is within the reserve
+        '''
+        remaining_seconds = self.remaining_seconds()
+        return remaining_seconds is not None and remaining_seconds <= 0
+
+    def limit(self, items: object):
+        '''
+            Yields the items of an iterable until the budget expires. When it
+            does, 'interrupted' is set and the iterable is closed, so that
+            generators stop any work in progress. 'last_item' is the last
+            item yielded, and 'item_count' the number of items yielded.
+        '''
+        try:
+            for item in items:
+                self.last_item = item
+                self.item_count += 1
+                yield item
+
+                if self.expired():
+                    self.interrupted = True
+                    break
+        finally:
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
@@ -27,7 +27,7 @@ COMPLIANCE_APP_AWS_EVENTACCTID = "COMPLIANCE_APP_AWS_EVENTACCTID"
 AWS_ACCOUNT_ID = os.environ.get(COMPLIANCE_APP_AWS_EVENTACCTID, None)
 
 if AWS_ACCOUNT_ID == None:
-    log.error("You must specify the following environment variable: %s" %
+    log.error("You must specify the following environment variable: %s",
               COMPLIANCE_APP_AWS_EVENTACCTID)
     exit(1)
 